@@ -0,0 +1,268 @@
+'''
+A JSON (and Arrow) query API on the app's Flask server, for batch jobs that need the comparisons the UI shows.
+
+Served from the fact store, i.e. from every company downloaded in full by any worker (see fact_store).
+
+    GET /api/v1/entities
+    GET /api/v1/labels?entity=Apple Inc.&entity=MICROSOFT CORP
+    GET /api/v1/facts?entity=Apple Inc.&entity=MICROSOFT CORP&label=Assets&label=Liabilities
+                     &start=2015&end=2022&aggregation=mean&page=1&page_size=10000&format=json
+
+    aggregation : none (the facts themselves - default), mean, sum, min, max, last or count - per Entity and Label
+    format : json (default), ndjson or arrow (needs pyarrow)
+
+Responses carry an ETag; a request sending it back in If-None-Match gets a 304 while the data has not changed.
+Pages of facts are streamed, a chunk of rows at a time.
+'''
+
+import hashlib
+import io
+import json
+import math
+from urllib.parse import urlencode
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from app.fact_store import fact_store
+
+
+api = Blueprint("api", __name__, url_prefix = "/api/v1")
+
+aggregations = ("none", "mean", "sum", "min", "max", "last", "count")
+
+formats = {"json": "application/json",
+           "ndjson": "application/x-ndjson",
+           "arrow": "application/vnd.apache.arrow.stream"}
+
+default_page_size = 10000
+max_page_size = 100000
+
+#Rows per streamed chunk
+chunk_size = 2000
+
+
+class QueryError(Exception):
+
+    def __init__(self, message, status = 400):
+        super().__init__(message)
+        self.status = status
+
+
+@api.errorhandler(QueryError)
+def query_error(error):
+    return jsonify({"error": str(error)}), error.status
+
+
+def etag_of(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys = True, default = str).encode("utf-8")).hexdigest()
+
+
+def not_modified(etag):
+    '''Whether the client already has what etag stands for'''
+
+    return etag in request.if_none_match
+
+
+def entities_asked():
+
+    entities = request.args.getlist("entity")
+
+    if not entities:
+        raise QueryError("At least one entity is needed (?entity=...)")
+
+    missing = [entity for entity in entities if entity not in fact_store]
+
+    if missing:
+        raise QueryError("Not loaded: {}".format(", ".join(missing)), status = 404)
+
+    return entities
+
+
+def period_bound(value, upper):
+    '''A year alone means its first day as a start, its last day as an end'''
+
+    if value is None or value == "":
+        return None
+
+    if len(value) == 4 and value.isdigit():
+        return "{}-12-31".format(value) if upper else "{}-01-01".format(value)
+
+    return value
+
+
+def positive_int(name, default, maximum = None):
+
+    value = request.args.get(name, default)
+
+    try:
+        value = int(value)
+    except ValueError:
+        raise QueryError("{} should be an integer".format(name))
+
+    if value < 1:
+        raise QueryError("{} should be positive".format(name))
+
+    return min(value, maximum) if maximum else value
+
+
+def aggregate(facts, aggregation):
+
+    '''Per Entity and Label, like the main scatter does with the mean'''
+
+    if aggregation == "none":
+        return facts
+
+    grouped = facts.sort_values("end").groupby(["Entity", "Label"], sort = True)
+
+    if aggregation == "last":
+        aggregated = grouped.tail(1).reset_index(drop = True)
+    else:
+        aggregated = grouped.agg(Value = ("Value", aggregation), start = ("end", "min"), end = ("end", "max")).reset_index()
+
+    return aggregated
+
+
+def records(facts):
+    '''Rows as JSON-ready dictionaries (dates as ISO strings)'''
+
+    facts = facts.copy()
+
+    for column in ("end", "start"):
+        if column in facts:
+            facts[column] = facts[column].dt.strftime("%Y-%m-%d")
+
+    return facts.to_dict(orient = "records")
+
+
+def stream_json(facts, meta):
+
+    '''{"meta": ..., "data": [...]} streamed a chunk of rows at a time'''
+
+    yield '{"meta": ' + json.dumps(meta) + ', "data": ['
+
+    for c, first_row in enumerate(range(0, len(facts), chunk_size)):
+
+        rows = json.dumps(records(facts.iloc[first_row:first_row + chunk_size]))[1:-1]
+
+        if rows:
+            yield ("," if c > 0 else "") + rows
+
+    yield "]}"
+
+
+def stream_ndjson(facts, meta):
+
+    '''The meta on the first line, then a row per line'''
+
+    yield json.dumps({"meta": meta}) + "\n"
+
+    for first_row in range(0, len(facts), chunk_size):
+        yield "".join(json.dumps(row) + "\n" for row in records(facts.iloc[first_row:first_row + chunk_size]))
+
+
+def arrow_stream(facts, meta):
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise QueryError("The arrow format needs pyarrow installed on the server", status = 406)
+
+    table = pa.Table.from_pandas(facts, preserve_index = False)
+    table = table.replace_schema_metadata({"meta": json.dumps(meta)})
+
+    sink = io.BytesIO()
+
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize = chunk_size):
+            writer.write_batch(batch)
+
+    return sink.getvalue()
+
+
+@api.route("/entities")
+def entities():
+
+    etag = etag_of("entities", fact_store.entities, fact_store.version_of(fact_store.entities))
+
+    if not_modified(etag):
+        return Response(status = 304)
+
+    response = jsonify({"entities": [{"entity": entity, "rows": fact_store.rows_of(entity)} for entity in fact_store.entities]})
+    response.set_etag(etag)
+
+    return response
+
+
+@api.route("/labels")
+def labels():
+
+    entities = entities_asked()
+
+    etag = etag_of("labels", entities, fact_store.version_of(entities))
+
+    if not_modified(etag):
+        return Response(status = 304)
+
+    response = jsonify({"entities": entities, "labels": fact_store.common_labels(entities)})
+    response.set_etag(etag)
+
+    return response
+
+
+@api.route("/facts")
+def facts():
+
+    entities = entities_asked()
+
+    labels = request.args.getlist("label")
+    start = period_bound(request.args.get("start"), upper = False)
+    end = period_bound(request.args.get("end"), upper = True)
+
+    aggregation = request.args.get("aggregation", "none")
+    output_format = request.args.get("format", "json")
+
+    if aggregation not in aggregations:
+        raise QueryError("aggregation should be one of {}".format(", ".join(aggregations)))
+
+    if output_format not in formats:
+        raise QueryError("format should be one of {}".format(", ".join(formats)))
+
+    page = positive_int("page", 1)
+    page_size = positive_int("page_size", default_page_size, max_page_size)
+
+    etag = etag_of("facts", entities, labels, start, end, aggregation, output_format, page, page_size, fact_store.version_of(entities))
+
+    if not_modified(etag):
+        return Response(status = 304)
+
+    try:
+        result = aggregate(fact_store.query(entities, labels, start, end), aggregation)
+    except ValueError as e:
+        raise QueryError("Bad date: {}".format(e))
+
+    total = len(result)
+    pages = max(math.ceil(total / page_size), 1)
+
+    if page > pages:
+        raise QueryError("There are only {} pages".format(pages), status = 404)
+
+    result = result.iloc[(page - 1) * page_size: page * page_size]
+
+    meta = {"entities": entities, "labels": labels, "start": start, "end": end, "aggregation": aggregation,
+            "page": page, "pages": pages, "page_size": page_size, "total": total}
+
+    if output_format == "arrow":
+        response = Response(arrow_stream(result, meta), mimetype = formats["arrow"])
+    elif output_format == "ndjson":
+        response = Response(stream_with_context(stream_ndjson(result, meta)), mimetype = formats["ndjson"])
+    else:
+        response = Response(stream_with_context(stream_json(result, meta)), mimetype = formats["json"])
+
+    response.set_etag(etag)
+
+    if page < pages:
+        args = request.args.to_dict(flat = False)
+        args["page"] = [str(page + 1)]
+        response.headers["Link"] = '<{}?{}>; rel="next"'.format(request.base_url, urlencode(args, doseq = True))
+
+    return response
@@ -0,0 +1,198 @@
+'''
+Headless batch mode - comparison reports for many peer groups at once, without clicking through the UI.
+
+A spec file (JSON) lists the data, the peer groups and the feature pairs wanted:
+
+    {
+        "data": ["Secdata_Downloaded_at_07_05_2022 14.13.52.csv"],
+        "output_dir": "reports",
+        "years": [2015, 2022],
+        "scales": {"x": "Linear", "y": "Log"},
+        "peer_groups": {
+            "FAANG": ["Meta Platforms, Inc.", "Apple Inc.", "AMAZON COM INC", "NETFLIX INC", "Alphabet Inc."]
+        },
+        "pairs": [["Assets", "Liabilities"], ["Revenues", "Net Income (Loss)"]]
+    }
+
+"data" are CSVs as the app's "Download Data as CSV" button saves them.
+
+Every (peer group, pair) gives a standalone HTML report, with the same scatter and time series the app shows.
+The dataset is loaded once; reports are rendered in a pool of processes sharing it
+(forked after loading, so the workers read the parent's copy instead of loading their own).
+
+    python -m app.batch_reports spec.json --workers 8
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+
+from app.fact_store import fact_columns
+from app.figures import scatter_of_averages, create_double_time_series
+from app.manifest import colors_per_entity
+
+
+#The dataset all reports come from - set in the parent before the workers are forked
+_dataset = None
+
+
+def load_dataset(files):
+
+    '''The facts of one or more CSVs saved from the app, as a single DataFrame'''
+
+    if isinstance(files, str):
+        files = [files]
+
+    data = pd.concat([pd.read_csv(file) for file in files], ignore_index = True)[fact_columns]
+
+    data["end"] = pd.to_datetime(data["end"])
+
+    return data
+
+
+def _share_dataset(files_or_dataset):
+
+    '''Worker initializer - only does any work where workers are not forked (e.g. Windows)'''
+
+    global _dataset
+
+    if _dataset is None:
+        _dataset = files_or_dataset if isinstance(files_or_dataset, pd.DataFrame) else load_dataset(files_or_dataset)
+
+
+def slug(text):
+    return re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_")[:60]
+
+
+def render_report(group_name, entities, xaxis_column_name, yaxis_column_name, year_value, scales, output_dir, include_plotlyjs):
+
+    '''
+    Builds one report and writes it.
+
+    Returns
+    -------
+    (path of the report, seconds it took) - or (None, reason) if the group cannot be compared on this pair
+    '''
+
+    started = time.perf_counter()
+
+    data = _dataset.loc[_dataset["Entity"].isin(entities)]
+
+    missing = [entity for entity in entities if entity not in set(data["Entity"])]
+
+    if missing:
+        return None, "{}: not in the data: {}".format(group_name, ", ".join(missing))
+
+    for label in (xaxis_column_name, yaxis_column_name):
+        if not (data.loc[data["Label"] == label, "Entity"].nunique() == len(entities)):
+            return None, "{}: {} is not reported by every company".format(group_name, label)
+
+    random_colors_assigned = colors_per_entity(entities)
+
+    scatter = scatter_of_averages(data, xaxis_column_name, yaxis_column_name, scales.get("x", "Linear"), scales.get("y", "Linear"), year_value, random_colors_assigned)
+
+    in_years = data.loc[(data["Year"] >= year_value[0]) & (data["Year"] <= year_value[1])]
+
+    x_series = create_double_time_series(in_years.loc[in_years["Label"] == xaxis_column_name], scales.get("x", "Linear"), "<b>{}</b>".format(xaxis_column_name), random_colors_assigned)
+    y_series = create_double_time_series(in_years.loc[in_years["Label"] == yaxis_column_name], scales.get("y", "Linear"), "<b>{}</b>".format(yaxis_column_name), random_colors_assigned)
+
+    title = "{}: {} vs {} ({}-{})".format(group_name, xaxis_column_name, yaxis_column_name, year_value[0], year_value[1])
+
+    #plotly.js goes in the first figure only
+    body = "\n".join(pio.to_html(fig, full_html = False, include_plotlyjs = include_plotlyjs if f == 0 else False)
+                     for f, fig in enumerate([scatter, x_series, y_series]))
+
+    html = "<html><head><meta charset='utf-8'><title>{0}</title></head><body><h2>{0}</h2>\n{1}\n</body></html>".format(title, body)
+
+    path = os.path.join(output_dir, "{}__{}__vs__{}.html".format(slug(group_name), slug(xaxis_column_name), slug(yaxis_column_name)))
+
+    with open(path, "w", encoding = "utf-8") as f:
+        f.write(html)
+
+    return path, time.perf_counter() - started
+
+
+def run_batch(spec, workers = None):
+
+    '''
+    Renders every report a spec asks for.
+
+    Returns
+    -------
+    dict with the reports written, those skipped (and why) and the time it all took
+    '''
+
+    global _dataset
+
+    started = time.perf_counter()
+
+    _dataset = load_dataset(spec["data"])
+
+    output_dir = spec.get("output_dir", "reports")
+    os.makedirs(output_dir, exist_ok = True)
+
+    years = spec.get("years") or [int(_dataset["Year"].min()), int(_dataset["Year"].max())]
+    scales = spec.get("scales", {})
+
+    #Next to the reports once, instead of 3MB inlined in each of them - they still open offline
+    include_plotlyjs = spec.get("plotlyjs", "directory")
+
+    if include_plotlyjs == "directory":
+        with open(os.path.join(output_dir, "plotly.min.js"), "w", encoding = "utf-8") as f:
+            f.write(get_plotlyjs())
+
+    tasks = [(group_name, entities, x, y, years, scales, output_dir, include_plotlyjs)
+             for group_name, entities in spec["peer_groups"].items()
+             for x, y in spec["pairs"]]
+
+    #Forked workers see the dataset loaded above without copying or reloading it
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+
+    written, skipped = [], []
+
+    with ProcessPoolExecutor(max_workers = workers, mp_context = context,
+                             initializer = _share_dataset, initargs = (spec["data"],)) as pool:
+
+        futures = [pool.submit(render_report, *task) for task in tasks]
+
+        for future in as_completed(futures):
+
+            path, outcome = future.result()
+
+            if path is None:
+                skipped.append(outcome)
+            else:
+                written.append(path)
+
+    return {"written": sorted(written), "skipped": skipped, "seconds": time.perf_counter() - started}
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Comparison reports for many peer groups at once")
+    parser.add_argument("spec", help = "JSON file listing data, peer groups and feature pairs")
+    parser.add_argument("--workers", type = int, default = None, help = "Processes to render with (all cores by default)")
+    args = parser.parse_args(argv)
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+
+    outcome = run_batch(spec, args.workers)
+
+    for reason in outcome["skipped"]:
+        print("Skipped", reason)
+
+    print("{} reports written to {} in {:.1f}s".format(len(outcome["written"]), spec.get("output_dir", "reports"), outcome["seconds"]))
+
+
+if __name__ == "__main__":
+    main()
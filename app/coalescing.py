@@ -0,0 +1,222 @@
+'''
+Coalescing of the requests a session fires in bursts (sweeping the mouse over the scatter, dragging the year slider).
+
+The browser only ever shows the answer to the last of them, yet every one of them used to be computed.
+Here, per session and per output:
+    - requests are answered one at a time
+    - a request that a newer one (same session, same output) has overtaken while it was waiting is dropped
+      (answered with "no update" - the newer one's answer is on its way)
+
+and, across sessions, identical requests arriving while one of them is being computed wait for that computation instead of repeating it.
+
+A session's requests are spread over every gunicorn worker, so what each (session, output) pair was last asked for is kept on disk:
+a small file per pair holding the generation of its latest request, next to a lock file taken (with flock) by the one request being answered.
+Requests only wait for each other while there is a worker thread to wait in - see gunicorn.conf.py.
+'''
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from dash.exceptions import PreventUpdate
+
+try:
+    import fcntl
+except ImportError:
+    #E.g. on Windows - the development server is a single process, where a lock per pair is enough
+    fcntl = None
+
+
+class Superseded(PreventUpdate):
+    '''A newer request of the same session has asked for the same output'''
+
+
+class RequestCoalescer:
+
+    '''
+    Parameters
+    ----------
+    directory : str
+        Where the (session, output) pairs are kept track of - the same for every worker
+    max_idle : int
+        Seconds after which the files of a pair nobody asked for anymore are deleted
+
+    Examples
+    --------
+    >>> coalescer = RequestCoalescer("/tmp/coalescing")
+    >>> coalescer.run(session_id, "x-time-series.figure", key, lambda: build_figure())
+    '''
+
+    def __init__(self, directory, max_idle = 3600):
+
+        self.directory = directory
+        self.max_idle = max_idle
+
+        #key -> Future of the computation in progress (in this process)
+        self._in_flight = {}
+
+        #Generation file -> lock, where there is no fcntl
+        self._local_locks = {}
+
+        self._lock = threading.Lock()
+        self._dropped_at = time.time()
+
+        self.computed = 0
+        self.superseded = 0
+        self.shared = 0
+
+    def _path_of(self, session, output):
+        return os.path.join(self.directory, hashlib.sha1("{}\n{}".format(session, output).encode("utf-8")).hexdigest())
+
+    def _enter(self, path):
+
+        '''Makes a new generation the latest of a pair - returns it'''
+
+        os.makedirs(self.directory, exist_ok = True)
+
+        generation = uuid.uuid4().hex
+
+        #Aside, then renamed - whoever reads it meanwhile gets one generation or the other, never half of one
+        temporary = "{}.{}.tmp".format(path, generation)
+
+        with open(temporary, "w") as f:
+            f.write(generation)
+
+        os.replace(temporary, path)
+
+        return generation
+
+    @staticmethod
+    def _latest(path):
+
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _turn(self, path):
+
+        '''Held by one request of a pair at a time, in whichever worker'''
+
+        if fcntl is None:
+
+            with self._lock:
+                lock = self._local_locks.setdefault(path, threading.Lock())
+
+            with lock:
+                yield
+
+            return
+
+        #A file opened per request - flock locks of separate opens exclude each other, threads of one process too
+        with open(path + ".lock", "a") as f:
+
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _drop_idle(self):
+
+        '''Deletes the files of the pairs nobody has asked for within max_idle - looked for at most once a minute'''
+
+        with self._lock:
+
+            if time.time() - self._dropped_at < 60:
+                return
+
+            self._dropped_at = time.time()
+
+        for entry in os.scandir(self.directory):
+
+            #A pair's lock file goes along with its generation file, whose modification time is that of its latest request
+            if entry.name.endswith(".lock"):
+                continue
+
+            try:
+                if time.time() - entry.stat().st_mtime < self.max_idle:
+                    continue
+
+                os.remove(entry.path)
+
+                if not entry.name.endswith(".tmp"):
+                    os.remove(entry.path + ".lock")
+
+            except FileNotFoundError:
+                pass
+
+            self._local_locks.pop(entry.path, None)
+
+    def run(self, session, output, key, compute):
+
+        '''
+        compute(), unless a newer request of session for output came in meanwhile (raises Superseded)
+        or the same key is already being computed (then its result is shared).
+
+        Without a session (e.g. the session id has not reached the browser yet), just compute().
+        '''
+
+        if session is None:
+            return compute()
+
+        path = self._path_of(session, output)
+
+        generation = self._enter(path)
+
+        with self._turn(path):
+
+            #Deleted for being idle, it has no newer generation either
+            if self._latest(path) not in (generation, None):
+                with self._lock:
+                    self.superseded += 1
+                raise Superseded
+
+            result = self.shared_computation(key, compute)
+
+        self._drop_idle()
+
+        return result
+
+    def shared_computation(self, key, compute):
+
+        '''compute() - or, if the same key is being computed already, the result of that'''
+
+        with self._lock:
+
+            future = self._in_flight.get(key)
+            owner = future is None
+
+            if owner:
+                future = self._in_flight[key] = Future()
+            else:
+                self.shared += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+        with self._lock:
+            self.computed += 1
+
+        return result
+
+    def stats(self):
+        return {"computed": self.computed, "superseded": self.superseded, "shared": self.shared}
@@ -0,0 +1,289 @@
+'''
+Things that used to be set up again on every "Load Data" click, now set up once per process:
+
+    - a pool of SecFactsDownloader instances, one per user agent, each with a persistent HTTP session
+    - the companies table, indexed by title, to turn the companies chosen into CIKs
+
+Company facts are fetched through the downloader's session (see fetch_company_facts) rather than by fetch_facts,
+which opens a new connection per request, prints and goes on when the SEC answers with an error.
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import pandas as pd
+import requests
+
+from secdata import SecFactsDownloader
+
+
+#Shipped along with the app - found regardless of the directory the app is started from
+companies_info_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "companiesinfo.csv")
+
+companies_info_url = "https://www.sec.gov/files/company_tickers.json"
+
+companyfacts_url = "https://data.sec.gov/api/xbrl/companyfacts/CIK{:010d}.json"
+
+
+class SecApiError(Exception):
+
+    def __init__(self, message, status = None):
+        super().__init__(message)
+        self.status = status
+
+
+class RateLimiter:
+
+    '''
+    Lets at most max_per_second calls of wait() through within any second, across threads - the others wait their turn.
+
+    Examples
+    --------
+    >>> limiter = RateLimiter(10)
+    >>> limiter.wait()
+    '''
+
+    def __init__(self, max_per_second = 10):
+
+        self.max_per_second = max_per_second
+
+        #When the last max_per_second calls went through
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def wait(self):
+
+        with self._lock:
+
+            now = time.monotonic()
+
+            #The call max_per_second calls back must be a second old before this one goes
+            if len(self._sent) >= self.max_per_second:
+                now = max(now, self._sent.popleft() + 1)
+
+            self._sent.append(now)
+
+        time.sleep(max(now - time.monotonic(), 0))
+
+
+class RateLimitedSession(requests.Session):
+
+    '''A requests.Session sending no more than max_requests_per_second requests'''
+
+    def __init__(self, max_requests_per_second = 10):
+
+        super().__init__()
+
+        self.limiter = RateLimiter(max_requests_per_second)
+
+    def request(self, *args, **kwargs):
+
+        self.limiter.wait()
+
+        return super().request(*args, **kwargs)
+
+
+class DownloaderPool:
+
+    '''
+    SecFactsDownloader instances, kept per user agent (least recently used ones dropped beyond max_size).
+
+    Each downloader also carries a requests.Session with the user agent set,
+    so that everything the app downloads (see fetch_company_facts) keeps its connections to the SEC open
+    and, however many sessions and fetch workers use the same user agent at once, its requests stay within the SEC's limit
+    (10 per second, per user agent - the limit is per process: with several gunicorn workers, split it with max_requests_per_second).
+
+    Examples
+    --------
+    >>> downloader_pool = DownloaderPool()
+    >>> my_downloader = downloader_pool.get("my_email@my_domain.com")
+    >>> my_downloader.session.get(url)
+    '''
+
+    def __init__(self, max_size = 64, max_requests_per_second = 10):
+
+        self.max_size = max_size
+        self.max_requests_per_second = max_requests_per_second
+
+        self._downloaders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._downloaders)
+
+    def get(self, user_agent):
+
+        with self._lock:
+
+            if user_agent in self._downloaders:
+                self._downloaders.move_to_end(user_agent)
+                return self._downloaders[user_agent]
+
+            downloader = SecFactsDownloader(user_agent)
+
+            downloader.session = RateLimitedSession(self.max_requests_per_second)
+            downloader.session.headers.update({'User-Agent': user_agent})
+
+            self._downloaders[user_agent] = downloader
+
+            while len(self._downloaders) > self.max_size:
+                _, dropped = self._downloaders.popitem(last = False)
+                dropped.session.close()
+
+            return downloader
+
+
+def get_json(session, url, retries = 3, timeout = 30):
+
+    '''
+    The JSON at url, fetched through session.
+
+    When the SEC throttles (429) or is unavailable (503), it is asked again after the Retry-After it gives (1 second by default),
+    up to retries times. Any other error raises SecApiError.
+    '''
+
+    for attempt in range(retries + 1):
+
+        response = session.get(url, timeout = timeout)
+
+        if response.ok:
+            return response.json()
+
+        if (response.status_code not in (429, 503)) or (attempt == retries):
+            break
+
+        try:
+            wait = float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            wait = 1
+
+        time.sleep(min(max(wait, 0), 30))
+
+    raise SecApiError("{} answered {}".format(url, response.status_code), status = response.status_code)
+
+
+def company_facts_to_df(response_content):
+
+    '''
+    The DataFrame SecFactsDownloader.fetch_facts builds out of one companyfacts JSON
+    (same columns, one row per fact reported, under each of the company's taxonomies)
+    '''
+
+    frames = []
+
+    for principles, facts_of_principles in response_content["facts"].items():
+
+        for fact in facts_of_principles.values():
+
+            #Like fetch_facts, only the first unit a fact is reported in
+            unit, values = next(iter(fact["units"].items()))
+
+            facts_df = pd.DataFrame(values)
+            facts_df["Description"] = fact["description"]
+            facts_df["Label"] = fact["label"]
+            facts_df["Unit_of_Measurement"] = unit
+            facts_df["Underlying_Principles"] = principles
+
+            frames.append(facts_df)
+
+    if not frames:
+        raise SecApiError("No facts reported by CIK {}".format(response_content.get("cik")))
+
+    all_facts_df = pd.concat(frames)
+
+    all_facts_df["cik"] = response_content["cik"]
+    all_facts_df["Entity"] = response_content["entityName"]
+
+    return all_facts_df
+
+
+def fetch_company_facts(downloader, cik):
+
+    '''
+    All the facts a company reported, shaped like SecFactsDownloader.fetch_facts([cik]) returns them (so that preprocess_df applies)
+    - through the downloader's session (see DownloaderPool), raising SecApiError when the SEC does not deliver them
+    '''
+
+    return company_facts_to_df(get_json(downloader.session, companyfacts_url.format(int(cik))))
+
+
+class CompaniesIndex:
+
+    '''
+    The companies reporting to the SEC (CIK, ticker, title), with their CIKs looked up by title.
+
+    Parameters
+    ----------
+    companies_info : pandas DataFrame with columns 'cik_str', 'ticker' and 'title'
+    '''
+
+    def __init__(self, companies_info):
+
+        self.companies_info = companies_info
+
+        #A title may come with several tickers, but (nearly always) a single CIK
+        self._ciks_of_title = companies_info.groupby("title", sort = False)["cik_str"].unique().to_dict()
+
+        self.titles = list(self._ciks_of_title)
+
+        self._title_of_cik = {int(cik): title for title, ciks in self._ciks_of_title.items() for cik in ciks}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def ciks_of(self, titles):
+        '''The CIKs of the companies with these titles (unknown titles are skipped)'''
+
+        ciks = []
+
+        for title in titles:
+            for cik in self._ciks_of_title.get(title, []):
+                if cik not in ciks:
+                    ciks.append(int(cik))
+
+        return ciks
+
+    def titles_of(self, ciks):
+        '''The titles of the companies with these CIKs (as the CIK itself, for an unknown one)'''
+
+        return [self._title_of_cik.get(int(cik), str(cik)) for cik in ciks]
+
+
+def load_companies_info(session = None, file = companies_info_file):
+
+    '''The companies table from the file shipped with the app, or from the SEC if the file is missing'''
+
+    if os.path.isfile(file):
+        return pd.read_csv(file, index_col = 0).reset_index(drop = True)
+
+    session = session or requests.Session()
+
+    json_response = session.get(companies_info_url).json()
+
+    return pd.DataFrame(list(json_response.values()))
+
+
+_companies_index = None
+_companies_index_lock = threading.Lock()
+
+
+def companies_index(session = None):
+
+    '''The process-wide CompaniesIndex, built the first time it is asked for'''
+
+    global _companies_index
+
+    if _companies_index is None:
+
+        with _companies_index_lock:
+
+            if _companies_index is None:
+                _companies_index = CompaniesIndex(load_companies_info(session))
+
+    return _companies_index
+
+
+#One pool per process, shared by every session - with N gunicorn workers, set SECOMPAIR_SEC_REQUESTS_PER_SECOND to 10 // N
+downloader_pool = DownloaderPool(max_requests_per_second = int(os.environ.get("SECOMPAIR_SEC_REQUESTS_PER_SECOND", 10)))
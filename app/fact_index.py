@@ -0,0 +1,242 @@
+'''
+An inverted index over facts.
+
+For every Label it keeps a bitset of the entities reporting it
+and, the other way around, for every Entity a bitset of the labels it reports
+(optionally broken down per Year).
+
+The common labels of any group of companies are then a single bitwise AND
+across the bitsets of the selected entities, instead of a pass over the whole DataFrame.
+'''
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+def _ids_to_bitset(ids):
+    '''Turns an iterable of non-negative integer ids into a python int with those bits set'''
+
+    ids = np.asarray(ids, dtype=np.int64)
+
+    if ids.size == 0:
+        return 0
+
+    flags = np.zeros(int(ids.max()) + 1, dtype=bool)
+    flags[ids] = True
+
+    return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+
+def _bitset_to_ids(bitset):
+    '''The reverse of _ids_to_bitset - the positions of the bits set, in ascending order'''
+
+    if bitset == 0:
+        return np.empty(0, dtype=np.int64)
+
+    raw = np.frombuffer(bitset.to_bytes((bitset.bit_length() + 7) // 8, "little"), dtype=np.uint8)
+
+    return np.flatnonzero(np.unpackbits(raw, bitorder="little"))
+
+
+class LabelIndex:
+
+    '''
+    Label <-> Entity bitsets, built incrementally as data gets loaded.
+
+    Entities and Labels are given a stable integer id the first time they are seen,
+    and that id is the position of their bit in every bitset.
+
+    Examples
+    --------
+    >>> index = LabelIndex()
+    >>> index.add(fin_df)
+    >>> index.common_labels(["Apple Inc.", "MICROSOFT CORP"])
+    ['Assets', 'Liabilities', ...]
+    >>> index.common_labels(["Apple Inc.", "MICROSOFT CORP"], years = (2015, 2022))
+    '''
+
+    def __init__(self):
+
+        self._entity_ids = {}
+        self._label_ids = {}
+
+        self._entities = []
+        self._labels = []
+
+        #Label id -> bitset of entity ids
+        self._entities_of_label = []
+
+        #Entity id -> bitset of label ids (all years)
+        self._labels_of_entity = {}
+
+        #Entity id -> {Year -> bitset of label ids}
+        self._labels_of_entity_per_year = {}
+
+        #Callbacks run in several threads under gunicorn
+        self._lock = threading.Lock()
+
+    def __contains__(self, entity):
+        return entity in self._entity_ids
+
+    def __len__(self):
+        return len(self._entity_ids)
+
+    @property
+    def entities(self):
+        return list(self._entities)
+
+    @property
+    def labels(self):
+        return list(self._labels)
+
+    def _id_of(self, value, ids, values):
+
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+
+        return ids[value]
+
+    def add(self, fin_df):
+
+        '''
+        Indexes a (preprocessed) dataframe of facts.
+
+        Each entity found in fin_df has its bitsets replaced,
+        so re-loading a company after new filings does not leave stale labels behind.
+
+        Parameters
+        ----------
+        fin_df : pandas DataFrame with at least the columns 'Entity', 'Label' and 'Year'
+        '''
+
+        pairs = fin_df[["Entity", "Label", "Year"]].drop_duplicates()
+
+        with self._lock:
+
+            #Ids looked up once per distinct label, not per row
+            label_codes, distinct_labels = pd.factorize(pairs["Label"])
+
+            label_ids = np.array([self._id_of(label, self._label_ids, self._labels) for label in distinct_labels], dtype=np.int64)[label_codes]
+
+            #Room for the labels that were just met for the first time
+            self._entities_of_label.extend([0] * (len(self._labels) - len(self._entities_of_label)))
+
+            pairs = pairs.assign(label_id = label_ids)
+
+            for entity, of_entity in pairs.groupby("Entity", sort = False):
+
+                e = self._id_of(entity, self._entity_ids, self._entities)
+                entity_bit = 1 << e
+
+                #Forget whatever this entity reported before
+                for old_label in _bitset_to_ids(self._labels_of_entity.get(e, 0)):
+                    self._entities_of_label[old_label] &= ~entity_bit
+
+                entity_label_ids = np.unique(of_entity["label_id"].to_numpy())
+
+                self._labels_of_entity[e] = _ids_to_bitset(entity_label_ids)
+
+                for label in entity_label_ids:
+                    self._entities_of_label[label] |= entity_bit
+
+                self._labels_of_entity_per_year[e] = {
+                    int(year): _ids_to_bitset(of_year["label_id"].to_numpy())
+                    for year, of_year in of_entity.groupby("Year", sort = False)
+                    }
+
+    def to_frame(self, entities = None):
+
+        '''
+        The distinct (Entity, Label, Year) indexed, one row each - what add() takes to build the index again.
+
+        Parameters
+        ----------
+        entities : iterable of entity names, optional
+            Only these (all of them by default)
+        '''
+
+        with self._lock:
+
+            ids = self._entity_ids.values() if entities is None else [self._entity_ids[entity] for entity in entities if entity in self._entity_ids]
+
+            entity_ids, label_ids, years = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+
+            for e in ids:
+                for year, bitset in self._labels_of_entity_per_year[e].items():
+
+                    of_year = _bitset_to_ids(bitset)
+
+                    label_ids.append(of_year)
+                    entity_ids.append(np.full(len(of_year), e, dtype=np.int64))
+                    years.append(np.full(len(of_year), year, dtype=np.int64))
+
+            return pd.DataFrame({"Entity": np.array(self._entities, dtype=object)[np.concatenate(entity_ids)],
+                                 "Label": np.array(self._labels, dtype=object)[np.concatenate(label_ids)],
+                                 "Year": np.concatenate(years)})
+
+    def labels_of(self, entity, years = None):
+
+        '''Bitset of the labels an entity reports, optionally only within years = (low, high)'''
+
+        e = self._entity_ids.get(entity)
+
+        if e is None:
+            return 0
+
+        if years is None:
+            return self._labels_of_entity[e]
+
+        low, high = years
+
+        bitset = 0
+        for year, year_bitset in self._labels_of_entity_per_year[e].items():
+            if low <= year <= high:
+                bitset |= year_bitset
+
+        return bitset
+
+    def common_labels(self, entities, years = None):
+
+        '''
+        All labels reported by every one of the entities given (sorted).
+
+        Same result as common_values_based_on_a_group(fin_df, "Label", "Entity")
+        but without touching the facts themselves.
+
+        Parameters
+        ----------
+        entities : iterable of entity names
+        years : tuple (low, high), optional
+            If given, a label counts only when each entity reported it at least once within these years
+        '''
+
+        entities = list(entities)
+
+        if len(entities) == 0:
+            return []
+
+        common = -1
+        for entity in entities:
+
+            common &= self.labels_of(entity, years)
+
+            #No need to go on
+            if common == 0:
+                return []
+
+        return sorted(self._labels[i] for i in _bitset_to_ids(common))
+
+    def entities_reporting(self, label):
+
+        '''All indexed entities reporting a label'''
+
+        l = self._label_ids.get(label)
+
+        if l is None:
+            return []
+
+        return [self._entities[i] for i in _bitset_to_ids(self._entities_of_label[l])]
+
@@ -0,0 +1,396 @@
+'''
+The facts of every company downloaded in full, kept server side, on disk.
+
+A company's preprocessed facts are a single .npz file, in the warm cache's directory and format (see warm_cache),
+written by whichever worker fetched it - so every gunicorn worker, and the app after a restart, serves the same facts,
+and anything besides the Dash callbacks (e.g. the query API) can use them without going to the SEC again.
+
+Which labels each company reports (see fact_index) is kept next to them, in label_index.npz, along with the version of every file it was built from:
+a process starting up reads that instead of every company's facts, and only the files written since are indexed again.
+
+Only full companyfacts downloads end up here: never uploaded CSVs (anyone's, about any entity),
+nor the few starting features a progressive load fetches first.
+'''
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from app.fact_index import LabelIndex
+from app.warm_cache import cache_directory, cache_file_of, cache_file_pattern, fetched_of, is_fresh, read_company, save_company
+
+
+fact_columns = ['end', 'Label', 'Entity', 'Value', 'Year']
+
+index_file_name = "label_index.npz"
+
+
+def save_index(path, files, index):
+
+    '''
+    Writes the label index of some files, next to them, with the version of each file it was built from.
+
+    Parameters
+    ----------
+    path : str
+    files : dict of file name -> (modification time, entity, rows)
+    index : LabelIndex covering (at least) the entities of files
+    '''
+
+    pairs = index.to_frame({entity for _, entity, _ in files.values()})
+
+    entity_codes, entities = pd.factorize(pairs["Entity"])
+    label_codes, labels = pd.factorize(pairs["Label"])
+
+    names = list(files)
+
+    #Aside, then renamed - other workers may be reading (or writing) it
+    temporary = "{}.{}.tmp.npz".format(path, uuid.uuid4().hex)
+
+    np.savez(temporary,
+             files = np.array(names, dtype = str),
+             mtimes = np.array([files[name][0] for name in names], dtype = np.int64),
+             file_entities = np.array([files[name][1] for name in names], dtype = str),
+             rows = np.array([files[name][2] for name in names], dtype = np.int64),
+             entities = np.array(entities.tolist(), dtype = str),
+             labels = np.array(labels.tolist(), dtype = str),
+             entity = entity_codes.astype(np.int32),
+             label = label_codes.astype(np.int32),
+             year = pairs["Year"].to_numpy(dtype = np.int32))
+
+    os.replace(temporary, path)
+
+
+def load_index(path):
+
+    '''
+    What save_index wrote: (files, distinct Entity, Label, Year as a DataFrame for LabelIndex.add)
+    - or ({}, None) if there is nothing (readable) there
+    '''
+
+    if not os.path.isfile(path):
+        return {}, None
+
+    try:
+        with np.load(path) as saved:
+
+            files = {str(name): (int(mtime), str(entity), int(rows))
+                     for name, mtime, entity, rows in zip(saved["files"], saved["mtimes"], saved["file_entities"], saved["rows"])}
+
+            pairs = pd.DataFrame({"Entity": np.array(saved["entities"].tolist(), dtype = object)[saved["entity"]],
+                                  "Label": np.array(saved["labels"].tolist(), dtype = object)[saved["label"]],
+                                  "Year": saved["year"]})
+
+    except Exception as e:
+        print("Reading", path, "failed:", e)
+        return {}, None
+
+    return files, pairs
+
+
+class FactStore:
+
+    '''
+    Preprocessed facts per company, picked up from the directory as they get written (by this process or any other).
+
+    Every entity carries a version - the modification time of its file, which changes whenever any worker writes the company again -
+    so that anything derived from its facts (like the label index) can tell whether it is still up to date.
+
+    The facts last read are kept in memory (up to max_cached entities) while their file stays the same.
+
+    Examples
+    --------
+    >>> fact_store = FactStore()
+    >>> fact_store.put(preprocess_df(my_downloader.fetch_facts([320193])), 320193)
+    >>> fact_store.query(entities = ["Apple Inc."], labels = ["Assets"], start = "2015-01-01")
+    '''
+
+    def __init__(self, directory = cache_directory, max_cached = 64, rescan_after = 5):
+
+        self.directory = directory
+        self.max_cached = max_cached
+
+        #Seconds after which the directory is listed again, even if its modification time says nothing was written
+        self.rescan_after = rescan_after
+
+        #File name -> (modification time, entity, rows)
+        self._files = {}
+
+        #Entity -> (path, modification time, rows) of its newest file
+        self._entities = {}
+
+        #(modification time of the directory, when it was listed)
+        self._listed = (None, 0.0)
+
+        #(path, modification time) -> facts
+        self._facts = OrderedDict()
+
+        #Which labels each entity reports, kept up to date with the files (and saved next to them)
+        self.label_index = LabelIndex()
+        self._index_loaded = False
+
+        self._lock = threading.Lock()
+
+    def __contains__(self, entity):
+        return entity in self._current()
+
+    def __len__(self):
+        return len(self._current())
+
+    @property
+    def entities(self):
+        return sorted(self._current())
+
+    def put(self, facts, cik):
+
+        '''Stores (replacing) the preprocessed facts of a company downloaded in full'''
+
+        if facts is None or len(facts) == 0:
+            return
+
+        save_company(facts, cik, self.directory)
+
+    def _current(self):
+
+        '''Entity -> (path, modification time, rows), once the files written since last time are picked up'''
+
+        try:
+            directory_mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            directory_mtime = None
+
+        with self._lock:
+
+            #A file written (renamed into place) changes the directory's modification time
+            if (directory_mtime == self._listed[0]) and (time.time() - self._listed[1] < self.rescan_after):
+                return self._entities
+
+            self._listed = (directory_mtime, time.time())
+
+            #Once per process: the index as last saved, by any of them
+            if not self._index_loaded:
+
+                self._index_loaded = True
+
+                saved_files, pairs = load_index(os.path.join(self.directory, index_file_name))
+
+                if pairs is not None:
+                    self.label_index.add(pairs)
+                    self._files = saved_files
+
+            files = {}
+            indexed = 0
+
+            for entry in (os.scandir(self.directory) if directory_mtime is not None else []):
+
+                if not cache_file_pattern.match(entry.name):
+                    continue
+
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+                known = self._files.get(entry.name)
+
+                if (known is not None) and (known[0] == mtime):
+                    files[entry.name] = known
+                    continue
+
+                try:
+                    facts = read_company(entry.path)
+                except Exception as e:
+                    print("Reading", entry.path, "failed:", e)
+                    continue
+
+                if len(facts) == 0:
+                    continue
+
+                self.label_index.add(facts)
+                self._remember(entry.path, mtime, facts)
+
+                indexed += 1
+
+                files[entry.name] = (mtime, facts["Entity"].iloc[0], len(facts))
+
+            entities = {}
+
+            for name, (mtime, entity, rows) in files.items():
+                if (entity not in entities) or (mtime > entities[entity][1]):
+                    entities[entity] = (os.path.join(self.directory, name), mtime, rows)
+
+            #Files written or deleted since the index was saved
+            if indexed or (files.keys() != self._files.keys()):
+                try:
+                    save_index(os.path.join(self.directory, index_file_name), files, self.label_index)
+                except OSError as e:
+                    print("Saving the label index failed:", e)
+
+            self._files = files
+            self._entities = entities
+
+            return entities
+
+    def _remember(self, path, mtime, facts):
+
+        self._facts[(path, mtime)] = facts.sort_values(["Label", "end"]).reset_index(drop = True)
+        self._facts.move_to_end((path, mtime))
+
+        while len(self._facts) > self.max_cached:
+            self._facts.popitem(last = False)
+
+    def _facts_of(self, entity):
+
+        path, mtime, _ = self._current()[entity]
+
+        with self._lock:
+
+            if (path, mtime) in self._facts:
+                self._facts.move_to_end((path, mtime))
+                return self._facts[(path, mtime)]
+
+            self._remember(path, mtime, read_company(path))
+
+            return self._facts[(path, mtime)]
+
+    def company_facts(self, cik, remember = True):
+
+        '''
+        The facts of a company by CIK, as last written by any process - or None if it is not here (or cannot be read).
+
+        Unless remember, facts not in memory already are read without being kept there
+        (e.g. when streamed to disk a company at a time, see partitioned_facts).
+        '''
+
+        path = cache_file_of(cik, self.directory)
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            if (path, mtime) in self._facts:
+                self._facts.move_to_end((path, mtime))
+                return self._facts[(path, mtime)]
+
+        try:
+            facts = read_company(path)
+        except Exception as e:
+            print("Reading", path, "failed:", e)
+            return None
+
+        if not remember:
+            return facts
+
+        with self._lock:
+            self._remember(path, mtime, facts)
+            return self._facts[(path, mtime)]
+
+    def fresh(self, ciks, max_age):
+
+        '''The CIKs among ciks stored here and fetched less than max_age seconds ago - only when each was fetched is read'''
+
+        fresh = []
+
+        for cik in ciks:
+
+            path = cache_file_of(cik, self.directory)
+
+            try:
+                with np.load(path) as cached:
+                    if is_fresh(fetched_of(cached), max_age):
+                        fresh.append(cik)
+
+            except FileNotFoundError:
+                continue
+
+            except Exception as e:
+                print("Reading", path, "failed:", e)
+
+        return fresh
+
+    def entities_of(self, ciks):
+
+        '''The entity of each company by CIK - or None unless every one of them is here'''
+
+        self._current()
+
+        entities = []
+
+        for cik in ciks:
+
+            known = self._files.get(os.path.basename(cache_file_of(cik, self.directory)))
+
+            if known is None:
+                return None
+
+            entities.append(known[1])
+
+        return entities
+
+    def version_of(self, entities):
+        '''One version for a group of entities - changes whenever any of them is written again'''
+
+        current = self._current()
+
+        return tuple(current[entity][1] if entity in current else 0 for entity in entities)
+
+    def rows_of(self, entity):
+
+        current = self._current()
+
+        return current[entity][2] if entity in current else 0
+
+    def common_labels(self, entities, years = None):
+        '''All labels reported by every one of the entities given (sorted) - see LabelIndex.common_labels'''
+
+        self._current()
+
+        return self.label_index.common_labels(entities, years)
+
+    def query(self, entities, labels = None, start = None, end = None):
+
+        '''
+        The facts of some entities, optionally only some labels within some dates.
+
+        Parameters
+        ----------
+        entities : list of entity names (all must be in the store)
+        labels : list of labels, optional
+        start, end : anything pandas.Timestamp understands (e.g. "2015" or "2015-06-30"), optional
+            Bounds (inclusive) on the end of the reporting period
+
+        Returns
+        -------
+        pandas DataFrame with the columns 'end', 'Label', 'Entity', 'Value', 'Year'
+        '''
+
+        frames = [self._facts_of(entity) for entity in entities]
+
+        if not frames:
+            return pd.DataFrame(columns = fact_columns)
+
+        facts = pd.concat(frames, ignore_index = True)
+
+        keep = pd.Series(True, index = facts.index)
+
+        if labels:
+            keep &= facts["Label"].isin(labels)
+
+        if start is not None:
+            keep &= facts["end"] >= pd.Timestamp(start)
+
+        if end is not None:
+            keep &= facts["end"] <= pd.Timestamp(end)
+
+        return facts.loc[keep].reset_index(drop = True)
+
+
+#Every process reads the same directory
+fact_store = FactStore()
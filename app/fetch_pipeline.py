@@ -0,0 +1,94 @@
+'''
+Fetching and preprocessing, one company at a time.
+
+SecFactsDownloader.fetch_facts(ciks) builds a single raw DataFrame for all the companies asked for
+(every column, every unframed comparative) before anything gets cut down,
+so the memory it takes grows with the whole selection.
+
+Here each company is fetched on its own (through the downloader's session, see downloaders.fetch_company_facts) and preprocessed right away;
+only its (much smaller) preprocessed facts are kept, and its raw facts are released before the next one's arrive.
+With max_workers > 1, that many companies are in flight at once - and so, at most, that many raw payloads.
+
+Examples
+--------
+>>> fetch_preprocessed(my_downloader, [320193, 789019], preprocess_df, max_workers = 4)
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from app.downloaders import fetch_company_facts
+
+
+def fetch_and_preprocess(downloader, cik, preprocess, store = None):
+
+    '''The preprocessed facts of a single company (also put in store, if given) - or None if they could not be fetched'''
+
+    try:
+        facts = preprocess(fetch_company_facts(downloader, cik))
+    except Exception as e:
+        print("Fetching CIK", cik, "failed:", e)
+        return None
+
+    if store is not None:
+        store.put(facts, cik)
+
+    return facts
+
+
+def preprocessed_facts(downloader, ciks, preprocess, max_workers = 1, store = None):
+
+    '''
+    Yields (cik, preprocessed facts or None), in the order of ciks, as each company is done.
+
+    Parameters
+    ----------
+    downloader : a pooled SecFactsDownloader (see downloaders), whose session is used
+    ciks : list of int
+    preprocess : function turning fetch_facts' DataFrame into the app's (e.g. preprocess_df)
+    max_workers : int
+        Companies fetched at once - the SEC allows 10 requests per second, per user agent
+    store : FactStore, optional
+        Where each company is kept too, as soon as it is done (see fact_store)
+    '''
+
+    if max_workers <= 1:
+
+        for cik in ciks:
+            yield cik, fetch_and_preprocess(downloader, cik, preprocess, store)
+
+        return
+
+    with ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = "fetch") as pool:
+
+        in_flight = deque()
+
+        for cik in ciks:
+
+            #Never more than max_workers companies ahead of the one being consumed
+            if len(in_flight) >= max_workers:
+                done_cik, future = in_flight.popleft()
+                yield done_cik, future.result()
+
+            in_flight.append((cik, pool.submit(fetch_and_preprocess, downloader, cik, preprocess, store)))
+
+        while in_flight:
+            done_cik, future = in_flight.popleft()
+            yield done_cik, future.result()
+
+
+def fetch_preprocessed(downloader, ciks, preprocess, max_workers = 1, store = None):
+
+    '''
+    The preprocessed facts of all the companies asked for, as a single DataFrame
+    (None if none of them could be fetched).
+    '''
+
+    frames = [facts for _, facts in preprocessed_facts(downloader, ciks, preprocess, max_workers, store) if facts is not None]
+
+    if not frames:
+        return None
+
+    return pd.concat(frames, ignore_index = True)
@@ -0,0 +1,181 @@
+'''
+A process-wide cache of finished figures.
+
+Analysts keep looking at the same comparisons (e.g. Assets vs Liabilities of the same peers over the same years).
+A figure depends only on the dataset and on the inputs of the callback building it,
+so the key is the dataset's digest (see store_format) plus those inputs.
+
+Least recently used figures are evicted first, once either the number of figures
+or the memory they take in total goes over the limits given.
+'''
+
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import plotly.io as pio
+
+
+def figure_key(kind, dataset_digest, *inputs):
+
+    '''
+    A key for a figure of a certain kind (e.g. "scatter") built out of a dataset and some callback inputs.
+
+    Inputs only need to be JSON serializable; dictionaries are keyed regardless of their order.
+    '''
+
+    raw = json.dumps([kind, dataset_digest, inputs], sort_keys = True, default = str)
+
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def memory_size(obj):
+
+    '''Bytes a JSON-like object (dicts, lists, strings, numbers) takes in memory, everything it holds included'''
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum(memory_size(key) + memory_size(value) for key, value in obj.items())
+
+    elif isinstance(obj, list):
+        size += sum(memory_size(value) for value in obj)
+
+    return size
+
+
+class FigureCache:
+
+    '''
+    LRU cache of figures, bounded both in number and in bytes.
+
+    Parameters
+    ----------
+    max_entries : int
+        How many figures to keep at most
+    max_bytes : int
+        How much memory the figures (as the dicts kept and returned) may take in total
+
+    Examples
+    --------
+    >>> cache = FigureCache(max_entries = 256, max_bytes = 64 * 1024 ** 2)
+    >>> cache.get_or_create(figure_key("scatter", digest, "Assets", "Liabilities"), lambda: build_figure())
+    >>> cache.stats()
+    {'hits': 0, 'misses': 1, ...}
+    '''
+
+    def __init__(self, max_entries = 256, max_bytes = 64 * 1024 ** 2):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        #key -> (figure as a dict, its size in bytes)
+        self._figures = OrderedDict()
+        self._bytes = 0
+
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        #Seconds spent building the figures that were not found
+        self.build_seconds = 0.0
+
+    def __len__(self):
+        return len(self._figures)
+
+    def __contains__(self, key):
+        return key in self._figures
+
+    def get(self, key):
+
+        '''The figure stored under key (marking it as recently used) or None'''
+
+        with self._lock:
+
+            if key not in self._figures:
+                self.misses += 1
+                return None
+
+            self._figures.move_to_end(key)
+            self.hits += 1
+
+            return self._figures[key][0]
+
+    def put(self, key, fig):
+
+        '''
+        Stores a figure (plotly Figure or its dict) and returns it as a dict.
+
+        A figure bigger than the whole memory bound is returned but not kept.
+        '''
+
+        serialized = pio.to_json(fig, validate = False)
+
+        fig = json.loads(serialized)
+
+        #Parsed, the figure takes several times the size of its JSON (a float in a list is 32 bytes, not its digits)
+        size = memory_size(fig)
+
+        if size > self.max_bytes:
+            return fig
+
+        with self._lock:
+
+            if key in self._figures:
+                self._bytes -= self._figures.pop(key)[1]
+
+            self._figures[key] = (fig, size)
+            self._bytes += size
+
+            while (len(self._figures) > self.max_entries) or (self._bytes > self.max_bytes):
+
+                _, (_, evicted_size) = self._figures.popitem(last = False)
+
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+        return fig
+
+    def get_or_create(self, key, create_figure):
+
+        '''The cached figure for key, or the one create_figure() builds (which then gets cached)'''
+
+        fig = self.get(key)
+
+        if fig is not None:
+            return fig
+
+        started = time.perf_counter()
+
+        fig = create_figure()
+
+        self.build_seconds += time.perf_counter() - started
+
+        return self.put(key, fig)
+
+    def clear(self):
+
+        with self._lock:
+            self._figures.clear()
+            self._bytes = 0
+
+    def stats(self):
+
+        '''Hit/miss metrics and memory used'''
+
+        requests = self.hits + self.misses
+
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._figures),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "build_seconds": self.build_seconds}
@@ -0,0 +1,118 @@
+'''
+The figures of the dashboard, built from a plain DataFrame of facts.
+
+They know nothing about Dash, so that the callbacks, the figure cache
+and anything running outside the app can all share them.
+'''
+
+import plotly.express as px
+
+
+plotting_template = "plotly_white"
+
+
+def averages_per_entity(df, xaxis_column_name, yaxis_column_name, year_value, random_colors_assigned):
+
+    '''
+    The aggregation behind the scatter plot.
+
+    For each Entity, the mean Value of the two features wanted within the years wanted,
+    one column per feature, along with each Entity's color and the ratio of the two.
+    '''
+
+    df = df.copy()
+
+    df["Color"] = df["Entity"].map(random_colors_assigned)
+
+    #Keep only wanted rows --> filter for Years & Features wanted
+    dff = df[(df['Year'] <= year_value[1]) & (df['Year'] >= year_value[0]) & ((df["Label"] == xaxis_column_name)| (df["Label"] == yaxis_column_name))]
+
+    dff = dff.groupby(["Entity", "Label", "Color"])["Value"].mean().reset_index()
+
+    dff_ = dff.pivot(index = ["Entity","Color"], columns = "Label",  values = "Value").reset_index()
+
+    dff_["Ratio"] = (dff_[xaxis_column_name] / dff_[yaxis_column_name])
+
+    dff_["Dummy_Col_for_Size"] = 2
+
+    return dff_
+
+
+def scatter_of_averages(df, xaxis_column_name, yaxis_column_name, xaxis_type, yaxis_type, year_value, random_colors_assigned):
+
+    '''The main scatter plot - one point per Entity, its average X against its average Y'''
+
+    dff_ = averages_per_entity(df, xaxis_column_name, yaxis_column_name, year_value, random_colors_assigned)
+
+    fig = px.scatter(
+        data_frame=dff_,
+        text="Entity",
+        custom_data= ["Ratio", "Color"],
+        x=xaxis_column_name ,
+        y= yaxis_column_name,
+        hover_name= "Entity",
+        size = "Dummy_Col_for_Size",
+        symbol_sequence= dff_.shape[0] * ['x'],
+        template = plotting_template,
+        color = "Entity",color_discrete_map = random_colors_assigned
+        )
+
+    fig.update_traces(hovertemplate=  xaxis_column_name[:30] + ': %{x} <br>'+ yaxis_column_name[:30] + ': %{y} <br>' + xaxis_column_name[:30] + " / " + yaxis_column_name[:30] + ': %{customdata[0]:.4f}' )
+
+    fig.update_xaxes(title=xaxis_column_name, type='linear' if xaxis_type == 'Linear' else 'log')
+
+    fig.update_yaxes(title=yaxis_column_name, type='linear' if yaxis_type == 'Linear' else 'log')
+
+    fig.update_layout(margin={'l': 40, 'b': 40, 't': 10, 'r': 0}, hovermode='closest')
+
+    fig.update_layout(showlegend=False)
+
+    return fig
+
+
+def create_double_time_series(dff, axis_type, title, random_colors_assigned):
+
+    fig = px.scatter(dff,
+                     x='end',
+                     y='Value',
+                     color = "Entity",
+                     color_discrete_map = random_colors_assigned,
+                     template = plotting_template)
+
+    fig.update_traces(mode='lines+markers')
+
+    fig.update_xaxes(showgrid=False, title_text = "")
+
+    fig.update_yaxes( title_text = "" , type='linear' if axis_type == 'Linear' else 'log')
+
+    fig.add_annotation(x=0, y=0.85, xanchor='left', yanchor='bottom',
+                       xref='paper', yref='paper', showarrow=False, align='left',
+                       text=title)
+
+    fig.update_layout(height=225, margin={'l': 20, 'b': 30, 'r': 10, 't': 10})
+
+    fig.update_layout(showlegend=False)
+
+    return fig
+
+
+def time_series_of_entities(df, entity_name, second_entity_name, column_name, axis_type, random_colors_assigned):
+
+    '''
+    The history of one feature for the entity hovered over
+    and, if one was clicked on, a second entity to compare it with.
+    '''
+
+    if second_entity_name is not None:
+        dff = df[(df['Entity'] == entity_name) | (df['Entity'] == second_entity_name) ]
+    else:
+        dff = df[df['Entity'] == entity_name]
+
+    dff = dff[dff['Label'] == column_name]
+
+    title = '<b>{}</b><br>{}'.format(entity_name, column_name)
+
+    if (second_entity_name is not None) and (second_entity_name != entity_name):
+        title = '<b>{} vs {}</b><br>{}'.format(entity_name,second_entity_name ,column_name)
+
+    return create_double_time_series(dff, axis_type, title, random_colors_assigned)
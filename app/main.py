@@ -1,7 +1,9 @@
 #%%Modules
-from dash import Dash, html, dcc, Input, Output, State, callback_context
+from dash import Dash, html, dcc, Input, Output, State, callback_context, no_update
 from dash.exceptions import PreventUpdate
 
+from flask import Response, abort, stream_with_context
+
 import dash_bootstrap_components as dbc
 
 import pandas as pd
@@ -17,17 +19,61 @@ import plotly.io as pio
 pio.renderers.default='browser'
 
 
-#Import Class
-from secdata import SecFactsDownloader
+#Downloaders (one per user agent) and the companies table, set up once per process
+from app.downloaders import downloader_pool, companies_index
+
+#Every company downloaded in full, kept server side on disk for all the workers (and indexed Label <-> Entity)
+from app.fact_store import fact_store
+
+#JSON/Arrow query API over the fact store, for batch jobs
+from app.api import api
+
+#How the dataset travels inside dcc.Store
+from app.store_format import frame_to_store, store_to_frame, store_digest
+
+#The figures themselves, and a cache of the ones already built
+from app.figures import scatter_of_averages, time_series_of_entities
+from app.figure_cache import FigureCache, figure_key
+
+#What the slider, the dropdowns and the colors need to know about a dataset
+from app.manifest import dataset_manifest, manifest_of
+
+#Bursts of hovers/slides of a session answered once, not once per request
+from app.coalescing import RequestCoalescer
+
+import os
+import tempfile
+
+import uuid
+
+#Each company fetched and preprocessed on its own, instead of all of them at once
+from app.fetch_pipeline import preprocessed_facts
+
+#Starting features first, the rest in the background
+from app.progressive import fetch_priority_facts, backfill_jobs
+
+#Out of core mode - datasets on disk, read a few row groups at a time
+from app.partitioned_facts import partitioned_facts, is_partitioned_reference
+
+#The watchlist companies, loaded from the local cache at boot (shared by the gunicorn workers, see gunicorn.conf.py)
+from app.warm_cache import warm_facts, read_watchlist, max_age as cache_max_age
+
+#Which X/Y pairs are worth a look, all of them ranked at once
+from app.screening import screen_label_pairs, screening_cache
+
+import json
+
+from itertools import chain
 
 #%%Util Functions
 
 
-def preprocess_df(df):
+def preprocess_df(df, deduplicate = True):
     
     '''A data pipeline that renders our dataframe more easy to handle'''
     
     import pandas as pd
+    import numpy as np
     
     def lighten_df(df):
         '''Keep only the bare minimum of our dataframe'''
@@ -36,6 +82,38 @@ def preprocess_df(df):
         
         return df[keep_only_columns]
     
+    def keep_latest_filings(df):
+        
+        '''
+        A fact may be reported more than once for the same period 
+        (e.g. restated in a later filing, or under a new tag carrying the same label).
+        Only the one filed last is kept - otherwise it would count twice in every average.
+        '''
+        
+        period = ["Entity", "Label", "end"]
+        
+        duplicated = df.duplicated(period, keep = False)
+        
+        #Most facts are reported just once - only the rest need sorting
+        if not duplicated.any():
+            return df
+        
+        filing_order = [c for c in ("filed", "accn") if c in df]
+        
+        #By position - the index of a fetched dataframe is not unique
+        positions = np.flatnonzero(duplicated.to_numpy())
+        
+        repeated = df.iloc[positions][period + filing_order].assign(position = positions).sort_values(filing_order, kind = "stable")
+        
+        superseded = repeated.loc[repeated.duplicated(period, keep = "last").to_numpy(), "position"].to_numpy()
+        
+        print("Removed", len(superseded), "facts reported more than once for the same period")
+        
+        keep = np.ones(len(df), dtype = bool)
+        keep[superseded] = False
+        
+        return df.iloc[keep]
+    
     #Just a rename so that values column appears in a more readable way in the plots
     df["Value"] = df["val"]
     
@@ -52,6 +130,10 @@ def preprocess_df(df):
     #Unfortunately, 4th quarter's reports contain amount that regard a whole year
     df = df.loc[( df["frame"].str.contains("Q[123]") )]
     
+    #Before the filing dates are dropped along with everything else
+    if deduplicate:
+        df = keep_latest_filings(df)
+    
     return lighten_df(df)
 
 def common_values_based_on_a_group(fin_df , common_values_from = "Label", where_groups_lie = "Entity"):
@@ -100,12 +182,42 @@ def common_values_based_on_a_group(fin_df , common_values_from = "Label", where_
 
 #external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
-app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP]) # external_stylesheets=external_stylesheets)
+app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP], compress = True) # external_stylesheets=external_stylesheets)
+
+app.server.register_blueprint(api)
+
+#Signs the digest of every dataset sent to the browser (see store_format) - the same for every worker, as long as the app is preloaded
+#(set SECOMPAIR_SECRET_KEY to keep the datasets already loaded valid across restarts)
+app.server.secret_key = os.environ.get("SECOMPAIR_SECRET_KEY") or uuid.uuid4().hex
 
 on_development = True
 on_debug_mode = True
 allow_download = True
 
+#Deliver the starting features at once and backfill the rest (otherwise wait for everything)
+progressive_loading = True
+
+#How often (ms) the page asks whether more of the data has arrived
+backfill_poll_interval = 2000
+
+#Companies fetched at once (the SEC allows up to 10 requests/second)
+fetch_workers = 4
+
+#Drop figure requests a newer one of the same session has overtaken (and share identical ones between sessions)
+coalesce_requests = True
+
+#Keep datasets on disk (memory-mapped, see partitioned_facts) instead of in the Store - for datasets bigger than memory
+out_of_core = False
+
+#Rows of an uploaded CSV parsed at a time, in out of core mode
+upload_chunksize = 100000
+
+#Load the watchlist companies from the local cache at boot, instead of downloading them on the first click
+warm_up_at_boot = True
+
+#How many X/Y pairs the screening suggests
+suggested_pairs_wanted = 20
+
 
 #%%App Constants
 
@@ -113,18 +225,24 @@ allow_download = True
 starting_x = "Assets"
 starting_y = "Assets"
 
-plotting_template = "plotly_white"
+#Shared by all sessions of this process - the same comparison is built only once
+figure_cache = FigureCache(max_entries = 512, max_bytes = 128 * 1024 ** 2)
+
+#Per session and figure, the latest request wins - in whichever worker it lands
+request_coalescer = RequestCoalescer(os.path.join(tempfile.gettempdir(), "secompair-coalescing"))
 
   
 #Initiate Downloader
-my_downloader = SecFactsDownloader("my_email@my_domain.com")
+my_downloader = downloader_pool.get("my_email@my_domain.com")
 
 #This will check whether there is any file containing the CIKs
 #Otherwise it will download them
-available_coms_to_download = my_downloader.fetch_companies_info(return_dataframe = True)
+#Either way, only once per process - every click looks CIKs up in the same index
+companies = companies_index(my_downloader.session).titles
 
-# = my_downloader.sec_companies_info
-companies = available_coms_to_download['title'].unique()
+#Once per server under gunicorn's preload - before the workers are forked
+if warm_up_at_boot:
+    warm_facts.load(companies_index().ciks_of(read_watchlist()))
 
 
 # Main title of the whole page
@@ -335,7 +453,10 @@ load_button = html.Button('Load Data',
                           n_clicks=0, 
                           style = {"background-color":"powderblue"})#, style={'width': '10%', 'height' : "5%" , 'float': 'left' ,'display': 'inline-block'}),
 
-setup = html.Div( [ fetch_from_edgar_section, html.Br(), html.Br(), load_from_previous_run_section ,  load_button] )
+#Which companies could not be fetched, if any
+load_failures = html.Div(id = 'load-failures')
+
+setup = html.Div( [ fetch_from_edgar_section, html.Br(), html.Br(), load_from_previous_run_section ,  load_button, load_failures] )
 
 setup_ribbon = html.Details(
     
@@ -407,7 +528,19 @@ y_side = html.Div(children =[
     style={'width': '49%',  'display': 'inline-block'}
     )
 
-feature_tuning_section = html.Div(children = [x_side, y_side] )
+#The best X/Y pairs out of the screening of all of them - picking one sets both dropdowns
+suggested_pairs = dcc.Dropdown(
+    
+    [],
+    
+    placeholder = 'Suggested comparisons',
+    
+    id='suggested-pairs',
+    
+    style = feature_dropdown_style
+)
+
+feature_tuning_section = html.Div(children = [suggested_pairs, html.Br(), x_side, y_side] )
 
 
 
@@ -459,6 +592,11 @@ download_section = html.Div(
                     style = download_button_as_csv_style
                     ),
         dcc.Download(id="download-dataframe-csv"),
+        #Out of core, the CSV is streamed from the server instead (see download_dataset)
+        html.A(html.Button("Download Data as CSV", style = download_button_as_csv_style),
+               id = "csv-link",
+               style = {"display": "none"}
+               ),
         
     ] 
     
@@ -515,7 +653,19 @@ app.layout = html.Div([
     
     dcc.Store(id = 'random_colors_assigned', storage_type  = 'memory', data = 'dict'),
     
-    dcc.Store(id = 'available_features', storage_type  = 'memory', data = 'list')
+    # Years, entities, common features, colors etc. of the dataset in memory-output
+    dcc.Store(id = 'dataset-manifest', storage_type  = 'memory', data = 'dict'),
+    
+    # The background job filling in the rest of the data (progressive loading)
+    dcc.Store(id = 'backfill-job', storage_type  = 'memory', data = None),
+    
+    dcc.Interval(id = 'backfill-poll', interval = backfill_poll_interval, n_intervals = 0, disabled = True),
+    
+    dcc.Store(id = 'available_features', storage_type  = 'memory', data = 'list'),
+    
+    #Which page load a request comes from - for the coalescing of its requests
+    #(in memory: a duplicated tab copies sessionStorage, and would share its id)
+    dcc.Store(id = 'session-id', storage_type  = 'memory')
     
     #dcc.Store(id = 'number_of_clicks', storage_type  = 'memory', data = 'number ')
 ])
@@ -544,6 +694,20 @@ def toggle_popover(n,is_open):
     return is_open
 
 
+@app.callback(
+    Output('session-id', 'data'),
+    Input('session-id', 'modified_timestamp'),
+    State('session-id', 'data')
+    )
+def assign_session_id(modified_timestamp, session_id):
+    
+    #Once per page load
+    if session_id is not None:
+        raise PreventUpdate
+    
+    return uuid.uuid4().hex
+
+
 @app.callback(
     Output("collapse", "is_open"),
     [Input("collapse-button", "n_clicks")],
@@ -568,7 +732,7 @@ def toggle_collapse2(n, is_open):
 
 #Useful to read  CSVs
 
-def parse_contents(contents, filename):
+def parse_contents(contents, filename, chunksize = None):
     
     content_type, content_string = contents[0].split(',')
 
@@ -577,8 +741,9 @@ def parse_contents(contents, filename):
     try:
         if 'csv' in filename:
             # Assume that the user uploaded a CSV file
+            #(a chunk of rows at a time, if a chunksize is given)
             df_from_csv = pd.read_csv(
-                io.StringIO(decoded.decode('utf-8')))
+                io.StringIO(decoded.decode('utf-8')), chunksize = chunksize)
             
             return df_from_csv
         else:
@@ -590,14 +755,129 @@ def parse_contents(contents, filename):
         ])
 
 
+def to_stores(downloaded_data, uploaded_df, stored = False):
+    
+    '''
+    What memory-output and dataset-manifest get, out of downloaded and/or uploaded data.
+    
+    The downloaded data comes as an iterable of DataFrames, a company at a time (Nones left out):
+    out of core, each is written to disk before the next is read or fetched - the whole download is never in memory at once.
+    
+    stored tells whether it is the full facts of companies in the fact store (not just the starting features of some) -
+    then the labels they have in common come out of the fact store's label index, instead of indexing the dataset.
+    '''
+    
+    if out_of_core:
+        return to_partitioned_stores(downloaded_data, uploaded_df)
+    
+    downloaded_data = concat_facts(*downloaded_data) if downloaded_data is not None else None
+    
+    if (downloaded_data is not None) & (uploaded_df is not None):
+        print("Appending one with the other")
+        data = pd.concat([downloaded_data, uploaded_df])
+        
+    elif  (downloaded_data is not None) & (uploaded_df is None):
+        print("Only downloaded data found")
+        data = downloaded_data
+        
+    elif (downloaded_data is None) & (uploaded_df is not None):
+        print("Only uploaded data found")
+        
+        data = uploaded_df
+    else:
+        
+        return no_update, no_update
+    
+    #Keep only these columns to keep it lite
+    data = data[['end', 'Label', 'Entity', 'Value', 'Year']]
+    
+    #Dates from an uploaded CSV come as plain strings
+    data = data.assign(end = pd.to_datetime(data["end"]))
+    
+    #Turn it into a dictionary so that we can circulate it between the components
+    #Unfortunately, dash does not support dataframes as at May 2022
+    #So it travels as compact columns (see store_format) instead of DataFrame.to_dict()
+    stored_data = frame_to_store(data, key = app.server.secret_key)
+    #print("Type of Data", type(data))
+    
+    rows_per_entity = data["Entity"].value_counts()
+    
+    #Only uploads and starting features need an index of their own - never the labels other loads indexed
+    if stored and (uploaded_df is None) and all(entity in fact_store for entity in rows_per_entity.index):
+        
+        manifest = manifest_of(stored_data["digest"], rows_per_entity, data["Year"].unique(), fact_store.common_labels(rows_per_entity.index.tolist()))
+    
+    else:
+        
+        #The only pass over the dataset the slider, dropdowns and colors need
+        manifest = dataset_manifest(data, stored_data["digest"], rows_per_entity)
+    
+    return stored_data, manifest
+
+
+def to_partitioned_stores(downloaded_data, uploaded_chunks):
+    
+    '''
+    Out of core mode: the data is written to disk, a chunk at a time, 
+    and memory-output only gets a reference to it.
+    '''
+    
+    frames = (frame for frame in downloaded_data if frame is not None) if downloaded_data is not None else []
+    
+    if uploaded_chunks is not None:
+        frames = chain(frames, uploaded_chunks)
+    
+    facts = partitioned_facts.write(frames)
+    
+    if len(facts) == 0:
+        return no_update, no_update
+    
+    print("Dataset of", len(facts), "rows written to", facts.directory)
+    
+    #Not the facts, nor even the names of what each entity reports - the codes written along with the dataset are enough
+    manifest = manifest_of(facts.digest, facts.rows_per_entity(), facts.years, facts.common_labels())
+    
+    return facts.reference(), manifest
+
+
+def uploaded_data_of(upload_data, file):
+    
+    if upload_data is not None:
+        
+        print("We have data")
+        
+        #Out of core, the CSV is never parsed all at once
+        if out_of_core:
+            return parse_contents(upload_data, file[0], chunksize = upload_chunksize)
+        
+        uploaded_df = parse_contents(upload_data, file[0])
+        
+        print("Downloaded Data Columns", uploaded_df.columns)
+        
+        return uploaded_df
+    
+    print("No Upload data")
+    
+    return None
+
+
 #Our Base for everything -- we can either download it, load it or both
 @app.callback(
     #We want the callback to update the child property 'data' of placeholder memory-update
     Output('memory-output', 'data'),
+    #Along with a summary of it, computed while we still have it as a DataFrame
+    Output('dataset-manifest', 'data'),
+    #And, when loading progressively, the job fetching the rest and whether to keep asking about it
+    Output('backfill-job', 'data'),
+    Output('backfill-poll', 'disabled'),
+    #And which companies the SEC did not deliver
+    Output('load-failures', 'children'),
     
     #Bearing in mind that:
         #The respective action button is pressed
     Input('load-data','n_clicks'),
+        #Or it is time to check on the background job
+    Input('backfill-poll', 'n_intervals'),
         #Some companies are selected from the dropdown for download
     Input('choose-companies', 'value'), 
         #The user-agent provided on the text input
@@ -605,117 +885,213 @@ def parse_contents(contents, filename):
         #And/or the content of a loaded csv file
     Input('upload-data', 'contents'),
         #And its filename
-    State('upload-data', 'filename')
+    State('upload-data', 'filename'),
+    State('backfill-job', 'data')
     )
-def loadData(n_clicks, companies, credentials, upload_data, file):
+def loadData(n_clicks, n_intervals, companies, credentials, upload_data, file, backfill):
     
     #changed_id = [p['prop_id'] for p in callback_context.triggered][0]
     button_pressed = callback_context.triggered[0]['prop_id'] == 'load-data.n_clicks'
     
+    poll = callback_context.triggered[0]['prop_id'] == 'backfill-poll.n_intervals'
     
-    #print("upload-data",upload_data)
-    #print("Hi")
-    
-    #print("Change id", changed_id)
-    #print("Context",callback_context.triggered)
-    # print("companies", companies)
-    # print("companies", type(companies))
-    # print("credentials", credentials)
-    
-    #print("credentials", type(credentials))
-    #print("Wanted", callback_context.triggered[0]['prop_id'])
+    if poll and (backfill is not None):
+        
+        return deliver_backfill(backfill, credentials, upload_data, file)
     
     if button_pressed : #n_clicks > 0:
         
+        #Whatever was still being fetched for the previous load is not wanted anymore
+        if backfill is not None:
+            backfill_jobs.cancel(backfill["id"])
+        
+        backfill = None
+        
+        failed = []
+        
+        #Whether what is loaded is the full facts of companies in the fact store
+        stored = True
+        
         if (credentials is not None) & (companies is not None)  :
             
             print("Inside the download attempt")
             
-            #Import Class
-            from secdata import SecFactsDownloader
-                    
-            #Initiate Downloader
-            my_downloader = SecFactsDownloader(credentials)
-            
-            #print("My Downloader", type(my_downloader))
+            #Initiate Downloader - or reuse the one this user agent already has
+            my_downloader = downloader_pool.get(credentials)
             
-            companies_info = my_downloader.fetch_companies_info(return_dataframe = True) #sec_companies_info
-            #companies_info = companies_info()
-
-            #print("companies_info", (companies_info))
-            #print("companies_info type", type(companies_info))
+            ciks_wanted = companies_index().ciks_of(companies)
             
-            ciks_wanted = [c for c in companies_info.loc[companies_info["title"].isin(companies)]["cik_str"].unique()]
+            #Companies fetched not long ago are here already - only the rest need downloading
+            warm_ciks, stored_ciks = facts_at_hand(ciks_wanted)
+            warm_data = frames_at_hand(warm_ciks, stored_ciks)
             
-            #print("ciks_wanted", ciks_wanted )
-            print("starting download")
-            data = my_downloader.fetch_facts(ciks_wanted)
-            print("Finished download")
+            ciks_wanted = [cik for cik in ciks_wanted if (cik not in warm_ciks) and (cik not in stored_ciks)]
             
+            if not ciks_wanted:
+                
+                print("All", len(warm_ciks) + len(stored_ciks), "companies found in the warm cache")
+                downloaded_data = warm_data
             
-            downloaded_data = preprocess_df(data)
-            print("Downloaded Data Columns", downloaded_data.columns)
+            elif progressive_loading:
+                
+                print("starting download of", starting_x, "and", starting_y)
+                priority_data = fetch_priority_facts(my_downloader, ciks_wanted, [starting_x, starting_y])
+                
+                priority_data = preprocess_df(priority_data) if priority_data is not None else None
+                
+                #Everything else, in the background - the job keeps the starting features along until it is done
+                job = backfill_jobs.start(my_downloader, ciks_wanted, priority_data, preprocess_df)
+                
+                backfill = {"id": job.id, "ciks": ciks_wanted, "warm_ciks": warm_ciks, "stored_ciks": stored_ciks, "delivered": 0}
+                
+                downloaded_data = chain(warm_data, [priority_data])
+                stored = False
+                
+            else:
+                
+                print("starting download")
+                #Each company preprocessed as soon as it arrives - the raw facts of all of them never sit in memory at once
+                #(fetched while to_stores goes through them, the companies that fail added to failed)
+                fetched = preprocessed_facts(my_downloader, ciks_wanted, preprocess_df, max_workers = fetch_workers, store = fact_store)
+                
+                downloaded_data = chain(warm_data, fetched_frames(fetched, failed))
             
         else:
-            #print("Inside the LOAD attempt")
-            #print("Loading")
-            #data = pd.read_csv("df_deb.csv")
-            #print("Loaded")
             downloaded_data = None#preprocess_df(data)
             
-        #print("Shape", data.shape)
-        
-        if upload_data is not None:
-            
-            print("We have data")
-            #print("Upload data", upload_data)
-            
-            uploaded_df = parse_contents(upload_data, file[0])
-            #uploaded_df = pd.read_csv("C:\\Users\\kvoul\\Downloads\\Secdata_Downloaded_at_07_05_2022 14.13.52.csv")
-            
-            print("Downloaded Data Columns", uploaded_df.columns)
-            
-            #print("file", file )
-            
-        else:
-            
-            uploaded_df = None
-            
-            print("No Upload data")
+        uploaded_df = uploaded_data_of(upload_data, file)
             
     else:
         raise PreventUpdate
+    
+    if (downloaded_data is None) & (uploaded_df is None):
         
+        print("You gotta choose something")
+        
+        raise PreventUpdate
     
-    #print("Type of Data", type(data))
+    stored_data, manifest = to_stores(downloaded_data, uploaded_df, stored)
     
-    if (downloaded_data is not None) & (uploaded_df is not None):
-        print("Appending one with the other")
-        data = downloaded_data.append(uploaded_df)
+    #Nothing was loaded, and nothing more is coming
+    if (stored_data is no_update) & (backfill is None):
         
-    elif  (downloaded_data is not None) & (uploaded_df is None):
-        print("Only downloaded data found")
-        data = downloaded_data
+        if failed:
+            return no_update, no_update, no_update, no_update, failure_alert(failed)
         
-    elif (downloaded_data is None) & (uploaded_df is not None):
-        print("Only uploaded data found")
+        raise PreventUpdate
+    
+    return stored_data, manifest, backfill, backfill is None, failure_alert(failed)
+
+
+def failure_alert(failed_ciks):
+    
+    '''Tells the user which companies are missing from what was loaded, rather than leaving it to them to notice'''
+    
+    if not failed_ciks:
+        return None
+    
+    return dbc.Alert("Could not fetch from the SEC: {} - try loading them again in a while".format(", ".join(companies_index().titles_of(failed_ciks))),
+                     color = "warning", dismissable = True)
+
+
+def facts_at_hand(ciks):
+    
+    '''
+    The companies among ciks fetched less than cache_max_age seconds ago, which need no downloading:
+    (CIKs held in the warm cache, CIKs found in the fact store) - see frames_at_hand for their facts
+    
+    Watchlist companies come out of the warm cache loaded at boot (see warm_cache) while it is fresh,
+    any other (or any watchlist company downloaded again since) out of the fact store, written by whichever worker fetched it.
+    '''
+    
+    warm_ciks = warm_facts.fresh(ciks, cache_max_age)
+    
+    return warm_ciks, fact_store.fresh([cik for cik in ciks if cik not in warm_ciks], cache_max_age)
+
+
+def frames_at_hand(warm_ciks, stored_ciks):
+    
+    '''The facts of the companies facts_at_hand found, a company at a time - out of core, none of them kept in memory'''
+    
+    for cik in warm_ciks:
+        yield warm_facts.facts_of([cik])
+    
+    for cik in stored_ciks:
+        yield fact_store.company_facts(cik, remember = not out_of_core)
+
+
+def fetched_frames(fetched, failed):
+    
+    '''The facts of (CIK, facts) pairs, as they arrive - the CIKs that could not be fetched are appended to failed'''
+    
+    for cik, facts in fetched:
         
-        data = uploaded_df
-    else:
+        if facts is None:
+            failed.append(cik)
+        else:
+            yield facts
+
+
+def concat_facts(*frames):
+    
+    '''The facts of the frames that are not None, as one DataFrame (None if all are)'''
+    
+    frames = [frame for frame in frames if frame is not None]
+    
+    if not frames:
+        return None
+    
+    return pd.concat(frames, ignore_index = True)
+
+
+def deliver_backfill(backfill, credentials, upload_data, file):
+    
+    '''
+    Whatever more the background job has fetched since last time.
+    
+    The job's state is on disk, so any worker can deliver it (see progressive) - 
+    and never anything with fewer companies completed than the browser already has.
+    '''
+    
+    job = backfill_jobs.get(backfill["id"])
+    
+    #E.g. deleted after a long while - start it again; its first deliveries are held back until it catches up
+    if job is None:
         
-        print("You gotta choose something")
+        job = backfill_jobs.start(downloader_pool.get(credentials), backfill["ciks"], None, preprocess_df)
+        
+        return no_update, no_update, dict(backfill, id = job.id), False, no_update
+    
+    state = job.state()
+    
+    #Its runner went quiet (e.g. that worker was restarted) - go on with it here
+    if job.is_stale(state, backfill_jobs.stale_after):
+        backfill_jobs.resume(job, downloader_pool.get(credentials), preprocess_df)
+    
+    finished = state["finished"]
+    
+    #Nothing new
+    if job.no_of_completed(state) <= backfill["delivered"]:
+        
+        if finished:
+            return no_update, no_update, backfill, True, no_update
         
         raise PreventUpdate
     
-    #Keep only these columns to keep it lite
-    data = data[['end', 'Label', 'Entity', 'Value', 'Year']]
+    #Out of core, every delivery is a whole dataset written to disk - only the complete one is
+    if out_of_core and not finished:
+        raise PreventUpdate
     
-    #Turn it into a dictionary so that we can circulate it between the components
-    #Unfortunately, dash does not support dataframes as at May 2022
-    data = data.reset_index().to_dict()
-    #print("Type of Data", type(data))
+    backfill = dict(backfill, delivered = job.no_of_completed(state))
+    
+    #The companies that were at hand when loading, then the job's
+    at_hand = frames_at_hand(backfill.get("warm_ciks", []), backfill.get("stored_ciks", []))
+    
+    #Once finished, only the companies that failed are left with nothing but their starting features
+    stored_data, manifest = to_stores(chain(at_hand, job.frames(state, remember = not out_of_core)), uploaded_data_of(upload_data, file),
+                                      stored = finished and not state["failed"])
     
-    return data 
+    return stored_data, manifest, backfill, finished, failure_alert(state["failed"])
 
 
 @app.callback(
@@ -725,18 +1101,20 @@ def loadData(n_clicks, companies, credentials, upload_data, file):
      Output('crossfilter-year--slider', 'value'),
      Output('crossfilter-year--slider', 'marks')],
     
-    [Input('memory-output', 'data')]
+    [Input('dataset-manifest', 'data')]
     
     )
-def updateRangeSlider(df):
+def updateRangeSlider(manifest):
     
-    #Here, df is a dictionary
-    years = [y for y in set(df["Year"].values())]
+    if (manifest is None) | (isinstance(manifest,str)) :
+        raise PreventUpdate
+    
+    years = manifest["years"]
     
     specific_marks = { str(year) : {"label":str(year), "style" :{"transform": "rotate(45deg)"}} for year in years}
     
     
-    return [min(years), max(years), [min(years), max(years)] , specific_marks ]
+    return [manifest["min_year"], manifest["max_year"], [manifest["min_year"], manifest["max_year"]] , specific_marks ]
 
 
 @app.callback(
@@ -753,10 +1131,14 @@ def download_for_user(n_clicks, df):
     
     if button_pressed:
         
-        df_ = pd.DataFrame(df)
-        
         csv_filename = "Secdata_Downloaded_at_" +datetime.now().strftime("%d_%m_%Y %H.%M.%S") + ".csv"
         
+        #Out of core, the button is not even shown - see download_dataset
+        if is_partitioned_reference(df):
+            raise PreventUpdate
+        
+        df_ = store_to_frame(df)
+        
         return dcc.send_data_frame(df_.to_csv, csv_filename)
     
     else:
@@ -764,76 +1146,152 @@ def download_for_user(n_clicks, df):
 
 
 
+@app.callback(
+    Output('csv-link', 'href'),
+    Output('csv-link', 'style'),
+    Output('btn_csv', 'style'),
+    Input('memory-output','data')
+)
+def choose_download(df):
+    
+    '''Out of core, the CSV comes from a link to download_dataset; otherwise from the Store, through btn_csv'''
+    
+    if is_partitioned_reference(df):
+        return app.get_relative_path("/download/{}.csv".format(df["digest"])), {}, {"display": "none"}
+    
+    return None, {"display": "none"}, download_button_as_csv_style
+
+
+@app.server.route("/download/<digest>.csv")
+def download_dataset(digest):
+    
+    '''Out of core mode: a dataset on disk as CSV, streamed a row group at a time - never loaded as a whole'''
+    
+    try:
+        facts = partitioned_facts.open(digest)
+    except KeyError:
+        abort(404)
+    
+    csv_filename = "Secdata_Downloaded_at_" +datetime.now().strftime("%d_%m_%Y %H.%M.%S") + ".csv"
+    
+    def csv_chunks():
+        for f_, frame in enumerate(facts.iter_frames()):
+            yield frame.to_csv(header = (f_ == 0), index = False)
+    
+    return Response(stream_with_context(csv_chunks()), mimetype = "text/csv",
+                    headers = {"Content-Disposition": 'attachment; filename="{}"'.format(csv_filename)})
+
+
+def labels_on_offer(manifest, companies, uploaded_files):
+    
+    '''
+    What the X/Y dropdowns offer: the labels of the dataset loaded (worked out while loading, see to_stores) - 
+    or, as soon as a company is added to (or removed from) the selection, those the companies selected have in common,
+    out of the fact store's label index, if every one of them is stored there (and nothing is uploaded).
+    '''
+    
+    if callback_context.triggered[0]['prop_id'] == 'choose-companies.value':
+        
+        entities = fact_store.entities_of(companies_index().ciks_of(companies)) if companies and (uploaded_files is None) else None
+        
+        #Not downloaded yet - the dropdowns change once they are loaded
+        if not entities:
+            raise PreventUpdate
+        
+        return fact_store.common_labels(entities)
+    
+    if (manifest is None) | (isinstance(manifest,str)) :
+        raise PreventUpdate
+    
+    return manifest["common_labels"]
+
+
 @app.callback(
     Output('crossfilter-xaxis-column','options' ),
-    Input('memory-output','data')#,
+    Input('dataset-manifest','data'),
+    Input('choose-companies', 'value'),
+    State('upload-data', 'filename')
     )
-def extract_available_features_for_x(df):
-    
-    common_elements = common_values_based_on_a_group( fin_df = pd.DataFrame(data = df), common_values_from="Label", where_groups_lie = "Entity" )
+def extract_available_features_for_x(manifest, companies, uploaded_files):
     
     #common_elements = common_elements.sort()
     
-    return common_elements
+    return labels_on_offer(manifest, companies, uploaded_files)
 
 
 @app.callback(
     Output('crossfilter-yaxis-column','options' ),
-    Input('memory-output','data')#,
+    Input('dataset-manifest','data'),
+    Input('choose-companies', 'value'),
+    State('upload-data', 'filename')
     )
-def extract_available_features_for_y(df):
-       
-    common_elements = common_values_based_on_a_group( fin_df  = pd.DataFrame(data = df), common_values_from="Label", where_groups_lie = "Entity" )
+def extract_available_features_for_y(manifest, companies, uploaded_files):
     
-    return common_elements
+    return labels_on_offer(manifest, companies, uploaded_files)
+    
+
+@app.callback(
+    Output('suggested-pairs','options' ),
+    Input('crossfilter-year--slider', 'value'),
+    Input('memory-output', 'data'),
+    State('dataset-manifest','data')
+    )
+def suggest_pairs(year_value, df, manifest):
+    
+    if (df is None) | (isinstance(df,str)) | (manifest is None) | (isinstance(manifest,str)) :
+        raise PreventUpdate
+    
+    #Only pairs the dropdowns offer
+    labels = manifest["common_labels"]
+    
+    key = (digest_of(df), tuple(year_value), tuple(labels), suggested_pairs_wanted)
+    
+    #Screened once per dataset and years, for every session
+    return screening_cache.get_or_create(key, lambda: pair_options(facts_of(df, years = year_value, labels = labels), labels, year_value))
+
+
+def pair_options(fin_df, labels, year_value):
+    
+    '''The suggested pairs as dropdown options, each valued as the JSON of [X, Y]'''
+    
+    pairs = screen_label_pairs(fin_df, labels = labels, years = year_value, top_n = suggested_pairs_wanted)
     
+    return [{"label": "{} vs {} (r = {:.2f}, {} companies)".format(pair.X, pair.Y, pair.correlation, pair.entities), 
+             "value": json.dumps([pair.X, pair.Y])} 
+            for pair in pairs.itertuples(index = False)]
+
+
+@app.callback(
+    Output('crossfilter-xaxis-column', 'value'),
+    Output('crossfilter-yaxis-column', 'value'),
+    Input('suggested-pairs', 'value')
+    )
+def apply_suggested_pair(suggested_pair):
+    
+    if suggested_pair is None:
+        raise PreventUpdate
+    
+    xaxis_column_name, yaxis_column_name = json.loads(suggested_pair)
+    
+    return xaxis_column_name, yaxis_column_name
+
 
 @app.callback(
     Output('random_colors_assigned','data' ),
-    Input('memory-output','data')#,
+    Input('dataset-manifest','data')#,
     #Input('load-data','n_clicks')
     )
-def random_colors(df): #n_clicks):
-    
-    def generate_color_per_entity(df):
-
-        no_of_entities = len(df["Entity"].unique())
-
-        plotly_colors = [
-            '#1f77b4',  # muted blue
-            '#ff7f0e',  # safety orange
-            '#2ca02c',  # cooked asparagus green
-            '#d62728',  # brick red
-            '#9467bd',  # muted purple
-            '#8c564b',  # chestnut brown
-            '#e377c2',  # raspberry yogurt pink
-            '#7f7f7f',  # middle gray
-            '#bcbd22',  # curry yellow-green
-            '#17becf'   # blue-teal
-        ]
-        
-        from random import sample
-        random_colors = sample(plotly_colors,no_of_entities)
-        
-        random_colors_assigned = {df["Entity"].unique()[c]:random_colors[c] for c,color in enumerate(random_colors)}
-        
-        return(random_colors_assigned)
+def random_colors(manifest): #n_clicks):
     
-    #button_pressed = callback_context.triggered[0]['prop_id'] == 'load-data.n_clicks'
-    
-    #print("Button pressed in random colors")
+    #Not random anymore - the same entities always get the same colors, however many they are
     
-    if (df is None) | (isinstance(df,str)) : #| (not button_pressed)  :
+    if (manifest is None) | (isinstance(manifest,str)) :
         
         raise PreventUpdate
         
     else:
         
-        df = pd.DataFrame(data = df)
-    
-        random_colors_assigned = generate_color_per_entity(df)
-        
-        return random_colors_assigned
+        return manifest["colors"]
 
     
         
@@ -845,12 +1303,13 @@ def random_colors(df): #n_clicks):
     Input('crossfilter-yaxis-type', 'value'),
     Input('crossfilter-year--slider', 'value'),
     Input('memory-output', 'data'),
-    Input('random_colors_assigned','data')#,
+    Input('random_colors_assigned','data'),#,
     #Input('load-data','n_clicks')
+    State('session-id', 'data')
     )
 def update_graph(xaxis_column_name, yaxis_column_name,
                  xaxis_type, yaxis_type,
-                 year_value, df, random_colors_assigned):
+                 year_value, df, random_colors_assigned, session_id):
     
     #button_pressed = callback_context.triggered[0]['prop_id'] == 'load-data.n_clicks'
     
@@ -862,87 +1321,88 @@ def update_graph(xaxis_column_name, yaxis_column_name,
         
     else:
         
-        df = pd.DataFrame(data = df)
-    
-        df["Color"] = df["Entity"].map(random_colors_assigned)
-            
-        low, high = year_value
-        
-        #print("df.columns",df.columns)
-        
-        #print("unique labels",df["Label"].unique())
-        
-        #print("first unique label",df["Label"].unique()[0])
-        
-        #print("second unique label",df["Label"].unique()[1])
-        
-        #print("xaxis_column_name",xaxis_column_name,"yaxis_column_name", yaxis_column_name)
+        key = figure_key("scatter", digest_of(df), xaxis_column_name, yaxis_column_name, xaxis_type, yaxis_type, year_value, random_colors_assigned)
         
-        #Keep only wanted rows --> filter for Years & Features wanted
-        dff = df[(df['Year'] <= year_value[1]) & (df['Year'] >= year_value[0]) & ((df["Label"] == xaxis_column_name)| (df["Label"] == yaxis_column_name))]
-    
-        #print("shape of dff after filtering", dff.shape )
-        
-        dff = dff.groupby(["Entity", "Label", "Color"])["Value"].mean().reset_index()
-        
-        dff_ = dff.pivot(index = ["Entity","Color"], columns = "Label",  values = "Value").reset_index()
-        
-        dff_["Ratio"] = (dff_[xaxis_column_name] / dff_[yaxis_column_name]) 
-        
-        dff_["Dummy_Col_for_Size"] = 2
-        
-        fig = px.scatter(
-            data_frame=dff_,
-            text="Entity",
-            custom_data= ["Ratio", "Color"],
-            x=xaxis_column_name ,#dff_[xaxis_column_name],
-            y= yaxis_column_name, #dff_[yaxis_column_name],
-            hover_name= "Entity", #dff_["Entity"],
-            size = "Dummy_Col_for_Size",
-            symbol_sequence= dff_.shape[0] * ['x'],
-            template = plotting_template,
-            color = "Entity",color_discrete_map = random_colors_assigned #dff_["Entity"], 
-            )
-        
-        fig.update_traces(hovertemplate=  xaxis_column_name[:30] + ': %{x} <br>'+ yaxis_column_name[:30] + ': %{y} <br>' + xaxis_column_name[:30] + " / " + yaxis_column_name[:30] + ': %{customdata[0]:.4f}' )
+        #The dataset is decoded only if this figure has not been built before
+        return coalesced(session_id, 'crossfilter-indicator-scatter.figure', key,
+                         lambda: figure_cache.get_or_create(key, lambda: scatter_of_averages(facts_of(df, years = year_value, labels = [xaxis_column_name, yaxis_column_name]), 
+                                                                                             xaxis_column_name, yaxis_column_name, 
+                                                                                             xaxis_type, yaxis_type, 
+                                                                                             year_value, random_colors_assigned)))
+
+
+def coalesced(session_id, output, key, create_figure):
     
-        fig.update_xaxes(title=xaxis_column_name, type='linear' if xaxis_type == 'Linear' else 'log')
+    '''
+    create_figure() - unless it is cached already, 
+    or a newer request of the same session for the same output came in while this one was waiting (then no update)
+    '''
     
-        fig.update_yaxes(title=yaxis_column_name, type='linear' if yaxis_type == 'Linear' else 'log')
+    if (not coalesce_requests) or (key in figure_cache):
+        return create_figure()
     
-        fig.update_layout(margin={'l': 40, 'b': 40, 't': 10, 'r': 0}, hovermode='closest')
-        
-        fig.update_layout(showlegend=False)
-        
-        return fig
-
-
-
-def create_double_time_series(dff, axis_type, title, random_colors_assigned):
+    return request_coalescer.run(session_id, output, key, create_figure)
 
-    fig = px.scatter(dff, 
-                     x='end', 
-                     y='Value', 
-                     color = "Entity",
-                     color_discrete_map = random_colors_assigned, 
-                     template = plotting_template)
 
-    fig.update_traces(mode='lines+markers')
+def dataset_of(df):
+    
+    '''The dataset on disk memory-output refers to, in out of core mode'''
+    
+    try:
+        return partitioned_facts.open(df["digest"])
+    except KeyError:
+        print("Dataset", df.get("digest"), "is not on disk anymore - load it again")
+        raise PreventUpdate
 
-    fig.update_xaxes(showgrid=False, title_text = "")
 
-    fig.update_yaxes( title_text = "" , type='linear' if axis_type == 'Linear' else 'log')
+def digest_of(df):
+    
+    '''
+    The digest keying what is cached for the dataset in memory-output - signed by the server, or worked out here, never taken from the browser as is.
+    
+    In out of core mode the reference names a dataset the server wrote (and digested) itself, and which has to be on disk still.
+    '''
+    
+    if is_partitioned_reference(df):
+        return dataset_of(df).digest
+    
+    return store_digest(df, key = app.server.secret_key)
 
-    fig.add_annotation(x=0, y=0.85, xanchor='left', yanchor='bottom',
-                       xref='paper', yref='paper', showarrow=False, align='left',
-                       text=title)
 
-    fig.update_layout(height=225, margin={'l': 20, 'b': 30, 'r': 10, 't': 10})
+def facts_of(df, years = None, labels = None, entities = None):
     
-    fig.update_layout(showlegend=False)
+    '''
+    What memory-output holds, as a DataFrame.
+    
+    In out of core mode, only the facts within the years, labels and entities given are read from disk.
+    Otherwise the whole dataset is decoded (the figures filter it themselves).
+    '''
+    
+    if is_partitioned_reference(df):
+        return dataset_of(df).read_frame(years, labels, entities)
+    
+    return store_to_frame(df)
 
-    return fig
 
+def cached_time_series(hoverData, clickData, column_name, axis_type, df, random_colors_assigned, session_id, output):
+    
+    '''The time series of the entity hovered over (and the one clicked on, if any), out of the figure cache when possible'''
+    
+    entity_name = hoverData['points'][0]['hovertext']
+    
+    if clickData is not None:
+        second_entity_name = clickData['points'][0]['hovertext']
+    else:
+        second_entity_name = None
+    
+    key = figure_key("time_series", digest_of(df), entity_name, second_entity_name, column_name, axis_type, random_colors_assigned)
+    
+    entities = [entity for entity in (entity_name, second_entity_name) if entity is not None]
+    
+    return coalesced(session_id, output, key,
+                     lambda: figure_cache.get_or_create(key, lambda: time_series_of_entities(facts_of(df, labels = [column_name], entities = entities), 
+                                                                                             entity_name, second_entity_name, 
+                                                                                             column_name, axis_type, random_colors_assigned)))
 
 
 @app.callback(
@@ -952,42 +1412,17 @@ def create_double_time_series(dff, axis_type, title, random_colors_assigned):
     Input('crossfilter-xaxis-column', 'value'),
     Input('crossfilter-xaxis-type', 'value'),
     Input('memory-output', 'data'),
-    Input('random_colors_assigned','data')
+    Input('random_colors_assigned','data'),
+    State('session-id', 'data')
     )
-def update_x_timeseries(hoverData, clickData, xaxis_column_name, axis_type, df, random_colors_assigned):
+def update_x_timeseries(hoverData, clickData, xaxis_column_name, axis_type, df, random_colors_assigned, session_id):
     
     #print("Type of df in time series plot", type(df))
     
     if (df is None) or (isinstance(df,str)) :
         raise PreventUpdate
     else:
-        df = pd.DataFrame(data = df)
-    
-        entity_name = hoverData['points'][0]['hovertext']
-        
-        second_entity_exists = False
-    
-        if clickData is not None:
-            
-            second_entity_name = clickData['points'][0]['hovertext']
-            second_entity_exists = True
-            dff = df[(df['Entity'] == entity_name) | (df['Entity'] == second_entity_name) ]
-            
-        else:
-            second_entity_exists = False
-            dff = df[df['Entity'] == entity_name]
-        
-        dff = dff[dff['Label'] == xaxis_column_name]       
-        
-        
-        title = '<b>{}</b><br>{}'.format(entity_name, xaxis_column_name)
-        
-        if second_entity_exists:
-        
-            if second_entity_name != entity_name:
-                title = '<b>{} vs {}</b><br>{}'.format(entity_name,second_entity_name ,xaxis_column_name)
-        
-        return create_double_time_series(dff, axis_type, title, random_colors_assigned)
+        return cached_time_series(hoverData, clickData, xaxis_column_name, axis_type, df, random_colors_assigned, session_id, 'x-time-series.figure')
 
 
 @app.callback(
@@ -997,43 +1432,12 @@ def update_x_timeseries(hoverData, clickData, xaxis_column_name, axis_type, df,
     Input('crossfilter-yaxis-column', 'value'),
     Input('crossfilter-yaxis-type', 'value'),
     Input('memory-output', 'data'),
-    Input('random_colors_assigned','data')
+    Input('random_colors_assigned','data'),
+    State('session-id', 'data')
     )
-def update_y_timeseries(hoverData,clickData, yaxis_column_name, axis_type, df, random_colors_assigned ):
+def update_y_timeseries(hoverData,clickData, yaxis_column_name, axis_type, df, random_colors_assigned, session_id):
     
     if (df is None) or (isinstance(df,str)) :
         raise PreventUpdate
     else:
-        df = pd.DataFrame(data = df)
-        entity_name = hoverData['points'][0]['hovertext']
-        
-        second_entity_exists = False
-        
-        if clickData is not None:
-            
-            #print("ClckData Exist")
-            second_entity_name = clickData['points'][0]['hovertext']
-            second_entity_exists = True
-            dff = df[(df['Entity'] == entity_name) | (df['Entity'] == second_entity_name) ]
-            
-        else:
-            second_entity_exists = False
-            dff = df[df['Entity'] == entity_name]
-            
-        dff = dff[dff['Label'] == yaxis_column_name]
-        
-        
-        
-        title = '<b>{}</b><br>{}'.format(entity_name, yaxis_column_name)
-        if second_entity_exists:
-        
-            if second_entity_name != entity_name:
-                title = '<b>{} vs {}</b><br>{}'.format(entity_name,second_entity_name ,yaxis_column_name)
-                
-        
-        #title = '<b>{}</b><br>{}'.format("", yaxis_column_name)
-        
-        #print(title)
-        
-        return create_double_time_series(dff, axis_type, title, random_colors_assigned)
-
+        return cached_time_series(hoverData, clickData, yaxis_column_name, axis_type, df, random_colors_assigned, session_id, 'y-time-series.figure')
@@ -0,0 +1,115 @@
+'''
+A small summary of a loaded dataset, computed once while it is being loaded.
+
+The year slider, the feature dropdowns and the colors of the entities
+all need just a few facts about the dataset - not the dataset itself.
+'''
+
+import colorsys
+
+from app.fact_index import LabelIndex
+
+
+#The colors the app always used, first
+plotly_colors = [
+    '#1f77b4',  # muted blue
+    '#ff7f0e',  # safety orange
+    '#2ca02c',  # cooked asparagus green
+    '#d62728',  # brick red
+    '#9467bd',  # muted purple
+    '#8c564b',  # chestnut brown
+    '#e377c2',  # raspberry yogurt pink
+    '#7f7f7f',  # middle gray
+    '#bcbd22',  # curry yellow-green
+    '#17becf'   # blue-teal
+]
+
+
+def color_of_position(position):
+
+    '''
+    The color of the n-th entity.
+
+    The first ten are plotly's default colors.
+    After those, hues keep going round the color wheel by the golden angle,
+    so that no matter how many entities there are, neighbouring ones stay apart.
+    '''
+
+    if position < len(plotly_colors):
+        return plotly_colors[position]
+
+    hue = ((position - len(plotly_colors)) * 0.618033988749895) % 1
+
+    #Alternate lightness a bit, so that similar hues of far away positions still differ
+    lightness = 0.45 if position % 2 == 0 else 0.6
+
+    red, green, blue = colorsys.hls_to_rgb(hue, lightness, 0.65)
+
+    return '#{:02x}{:02x}{:02x}'.format(int(red * 255), int(green * 255), int(blue * 255))
+
+
+def colors_per_entity(entities):
+
+    '''
+    Assigns a color to each entity.
+
+    Entities are sorted first, so the same group of companies always gets the same colors
+    (which also lets the figure cache serve one analyst's figures to another).
+    '''
+
+    return {entity: color_of_position(p) for p, entity in enumerate(sorted(entities))}
+
+
+def dataset_manifest(fin_df, digest, rows_per_entity = None):
+
+    '''
+    Everything the callbacks need to know about a dataset, besides the data.
+
+    Parameters
+    ----------
+    fin_df : pandas DataFrame with columns 'Entity', 'Label', 'Year' (at least)
+    digest : str
+        The digest of the dataset as stored (see store_format.frame_to_store)
+    rows_per_entity : pandas Series, optional
+        Rows of each Entity, when fin_df is not the facts themselves
+        (e.g. just the distinct Entity, Label, Year of a dataset)
+
+    Returns
+    -------
+    dict, JSON serializable, ready for a dcc.Store
+    '''
+
+    if rows_per_entity is None:
+        rows_per_entity = fin_df["Entity"].value_counts()
+
+    years = sorted(int(year) for year in fin_df["Year"].unique())
+
+    #An index of this dataset alone - the labels other loads of the process indexed must not show up in its dropdowns
+    index = LabelIndex()
+    index.add(fin_df)
+
+    return manifest_of(digest, rows_per_entity, years, index.common_labels(rows_per_entity.index.tolist()))
+
+
+def manifest_of(digest, rows_per_entity, years, common_labels):
+
+    '''
+    The manifest of a dataset whose summary is known already (e.g. kept on disk along with it, see partitioned_facts)
+    - see dataset_manifest
+    '''
+
+    entities = sorted(rows_per_entity.index.tolist())
+
+    years = sorted(int(year) for year in years)
+
+    return {
+        "digest": digest,
+        "rows": int(rows_per_entity.sum()),
+        "rows_per_entity": {entity: int(rows) for entity, rows in rows_per_entity.items()},
+        "entities": entities,
+        "years": years,
+        "min_year": years[0] if years else None,
+        "max_year": years[-1] if years else None,
+        "common_labels": list(common_labels),
+        "colors": colors_per_entity(entities)
+        }
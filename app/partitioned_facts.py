@@ -0,0 +1,539 @@
+'''
+Out of core mode - datasets kept on disk as memory-mapped, partitioned columnar files.
+
+A dataset is a directory, named after its digest:
+
+    <digest>/
+        meta.json                   labels, entities, years, row counts, the labels every entity reports, and the row groups of each year
+        reported.npy                the distinct (entity, label, year) codes
+        year=2015/
+            00000.end.npy           days since epoch (int32)
+            00000.label.npy         label codes (int32), rows sorted by them
+            00000.entity.npy        entity codes (int32)
+            00000.value.npy         values (float64)
+            00000.offsets.npy       where the rows of each label code start and end in this row group
+        year=2016/
+            ...
+
+Reading is done through numpy memory maps, and the filters the figures apply are pushed down:
+    - a Year range skips whole partitions
+    - Labels are contiguous slices of each row group, found from its offsets
+    - Entities are masked on what is left
+
+so that only the pages holding the rows wanted are ever read, however big the dataset.
+Writing goes a chunk at a time, so datasets need not fit in memory either.
+
+Examples
+--------
+>>> facts = partitioned_facts.write(pd.read_csv(file, chunksize = 100000))
+>>> facts.read_frame(years = (2015, 2022), labels = ["Assets", "Liabilities"])
+'''
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+partitioned_format_name = "partitioned"
+partitioned_format_version = 1
+
+columns = ("end", "label", "entity", "value")
+
+column_dtypes = {"end": np.int32, "label": np.int32, "entity": np.int32, "value": np.float64}
+
+digest_pattern = re.compile("^[0-9a-f]{40}$")
+
+
+def is_partitioned_reference(data):
+    '''Whether what a dcc.Store holds points to a dataset on disk (see PartitionedFacts.reference)'''
+
+    return isinstance(data, dict) and data.get("format") == partitioned_format_name
+
+
+def _pack_reported(entity_codes, label_codes, years):
+    '''(entity, label, year) codes as single int64s - 24 bits for each code, 16 for the year'''
+
+    return (entity_codes.astype(np.int64) << 40) | (label_codes.astype(np.int64) << 16) | years.astype(np.int64)
+
+
+class PartitionedFactsWriter:
+
+    '''
+    Writes facts, a chunk at a time, as the row groups of a new dataset.
+
+    Rows are buffered per Year and flushed as a row group every row_group_size rows
+    (or all of them, once more than max_buffered_rows are waiting).
+    '''
+
+    def __init__(self, directory, row_group_size = 250000, max_buffered_rows = 1000000):
+
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+
+        self._label_ids = {}
+        self._entity_ids = {}
+
+        #Year -> list of dicts of arrays waiting to be written
+        self._buffers = {}
+        self._buffered_rows = 0
+        self._buffered_rows_per_year = {}
+
+        #Year -> names of the row groups written
+        self._row_groups = {}
+
+        #Entity code -> its distinct (label, year) codes, packed in an int64 each and sorted - what the label index needs, without the facts
+        #(an entity's are merged only when it comes in more than one chunk, e.g. of a CSV)
+        self._reported = {}
+
+        self._rows_per_entity = {}
+        self._rows = 0
+
+        self._digest = hashlib.sha1()
+
+        os.makedirs(directory, exist_ok = True)
+
+    def _codes_of(self, values, ids):
+
+        codes, uniques = pd.factorize(values, sort = False)
+
+        codes_of_uniques = np.array([ids.setdefault(value, len(ids)) for value in uniques], dtype = np.int32)
+
+        return codes_of_uniques[codes]
+
+    def add(self, fin_df):
+
+        '''Appends a dataframe of preprocessed facts (columns 'end', 'Label', 'Entity', 'Value', 'Year')'''
+
+        if len(fin_df) == 0:
+            return
+
+        end = fin_df["end"]
+
+        #Dates from a CSV come as plain strings
+        if not pd.api.types.is_datetime64_any_dtype(end):
+            end = pd.to_datetime(end)
+
+        end = end.to_numpy(dtype = "datetime64[ns]").astype("datetime64[D]").astype(np.int32)
+
+        chunk = {
+            "end": end,
+            "label": self._codes_of(fin_df["Label"].to_numpy(), self._label_ids),
+            "entity": self._codes_of(fin_df["Entity"].to_numpy(), self._entity_ids),
+            "value": fin_df["Value"].to_numpy(dtype = np.float64)
+            }
+
+        years = fin_df["Year"].to_numpy(dtype = np.int64)
+
+        for column in columns:
+            self._digest.update(chunk[column].tobytes())
+
+        reported = np.unique(_pack_reported(chunk["entity"], chunk["label"], years))
+
+        #Sorted, so each entity's are a slice
+        for part in np.split(reported, np.flatnonzero(np.diff(reported >> 40)) + 1):
+
+            entity = int(part[0] >> 40)
+            part = part & 0xFFFFFFFFFF
+
+            self._reported[entity] = np.union1d(self._reported[entity], part) if entity in self._reported else part
+
+        counts = np.bincount(chunk["entity"])
+        for entity in np.flatnonzero(counts).tolist():
+            self._rows_per_entity[entity] = self._rows_per_entity.get(entity, 0) + int(counts[entity])
+
+        self._rows += len(fin_df)
+
+        for year in sorted(pd.unique(years).tolist()):
+
+            in_year = years == year
+
+            self._buffers.setdefault(year, []).append({column: chunk[column][in_year] for column in columns})
+            self._buffered_rows += int(in_year.sum())
+
+            self._buffered_rows_per_year[year] = self._buffered_rows_per_year.get(year, 0) + int(in_year.sum())
+
+            if self._buffered_rows_per_year[year] >= self.row_group_size:
+                self._flush(year)
+
+        if self._buffered_rows > self.max_buffered_rows:
+            for year in list(self._buffers):
+                self._flush(year)
+
+    def _flush(self, year):
+
+        parts = self._buffers.pop(year, [])
+        self._buffered_rows_per_year.pop(year, None)
+
+        if not parts:
+            return
+
+        row_group = {column: np.concatenate([part[column] for part in parts]) for column in columns}
+
+        self._buffered_rows -= len(row_group["end"])
+
+        #Labels contiguous, and in time order within each label
+        order = np.lexsort((row_group["end"], row_group["entity"], row_group["label"]))
+
+        name = "{:05d}".format(len(self._row_groups.get(year, [])))
+
+        partition = os.path.join(self.directory, "year={}".format(year))
+        os.makedirs(partition, exist_ok = True)
+
+        for column in columns:
+            np.save(os.path.join(partition, "{}.{}.npy".format(name, column)), row_group[column][order].astype(column_dtypes[column]))
+
+        #Rows of label code l are offsets[l]:offsets[l + 1] - labels met later than this row group get empty slices
+        offsets = np.searchsorted(row_group["label"][order], np.arange(len(self._label_ids) + 1)).astype(np.int64)
+        np.save(os.path.join(partition, "{}.offsets.npy".format(name)), offsets)
+
+        self._row_groups.setdefault(year, []).append(name)
+
+    def close(self):
+
+        '''Writes whatever is still buffered, and the metadata - returns the digest of the dataset'''
+
+        for year in list(self._buffers):
+            self._flush(year)
+
+        labels = list(self._label_ids)
+        entities = list(self._entity_ids)
+
+        self._digest.update(json.dumps([labels, entities]).encode("utf-8"))
+
+        reported = sorted(self._reported.items())
+
+        #The labels every entity reports, counted an entity at a time
+        entities_per_label = np.zeros(len(labels), dtype = np.int64)
+        for _, part in reported:
+            entities_per_label[np.unique(part >> 16)] += 1
+
+        common_labels = sorted(labels[l] for l in np.flatnonzero(entities_per_label == len(entities)).tolist()) if entities else []
+
+        meta = {
+            "format": partitioned_format_name,
+            "version": partitioned_format_version,
+            "digest": self._digest.hexdigest(),
+            "rows": self._rows,
+            "labels": labels,
+            "entities": entities,
+            "rows_per_entity": {entities[e]: rows for e, rows in self._rows_per_entity.items()},
+            "common_labels": common_labels,
+            "row_groups": {str(year): names for year, names in sorted(self._row_groups.items())}
+            }
+
+        #A row of (entity, label, year) codes each, written an entity at a time - never all of them in memory at once
+        with open(os.path.join(self.directory, "reported.npy"), "wb") as f:
+
+            np.lib.format.write_array_header_1_0(f, {"descr": np.dtype("<i8").str, "fortran_order": False,
+                                                     "shape": (sum(len(part) for _, part in reported), 3)})
+
+            for entity, part in reported:
+                f.write(np.column_stack([np.full(len(part), entity, dtype = np.int64), part >> 16, part & 0xFFFF]).astype("<i8").tobytes())
+
+        with open(os.path.join(self.directory, "meta.json"), "w", encoding = "utf-8") as f:
+            json.dump(meta, f)
+
+        return meta["digest"]
+
+
+class PartitionedFacts:
+
+    '''A dataset written by PartitionedFactsWriter, read through memory maps'''
+
+    def __init__(self, directory):
+
+        self.directory = directory
+
+        with open(os.path.join(directory, "meta.json"), encoding = "utf-8") as f:
+            self.meta = json.load(f)
+
+        self.digest = self.meta["digest"]
+
+        self._labels = np.array(self.meta["labels"], dtype = object)
+        self._entities = np.array(self.meta["entities"], dtype = object)
+
+        self._label_ids = {label: l for l, label in enumerate(self.meta["labels"])}
+        self._entity_ids = {entity: e for e, entity in enumerate(self.meta["entities"])}
+
+        self.years = sorted(int(year) for year in self.meta["row_groups"])
+
+        #(year, name) -> {column: memmap}, opened the first time they are read
+        self._row_groups = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def reference(self):
+
+        '''What memory-output holds in out of core mode - the dataset itself stays on the server'''
+
+        return {"format": partitioned_format_name, "version": partitioned_format_version,
+                "digest": self.digest, "length": len(self)}
+
+    def label_years(self):
+
+        '''The distinct (Entity, Label, Year) reported - enough for the label index and the manifest'''
+
+        reported = np.load(os.path.join(self.directory, "reported.npy"))
+
+        #Categoricals - far less to hash than the same strings repeated
+        return pd.DataFrame({"Entity": pd.Categorical.from_codes(reported[:, 0], self.meta["entities"]),
+                             "Label": pd.Categorical.from_codes(reported[:, 1], self.meta["labels"]),
+                             "Year": reported[:, 2]})
+
+    def common_labels(self):
+
+        '''The labels every entity of the dataset reports (in any year), sorted - as counted while it was written'''
+
+        if "common_labels" in self.meta:
+            return self.meta["common_labels"]
+
+        #Written before they were counted - worked out on the codes, not the names
+        reported = np.load(os.path.join(self.directory, "reported.npy"))
+
+        no_of_labels = len(self.meta["labels"])
+
+        #Distinct (entity, label) pairs, then the entities each label has
+        pairs = np.unique(reported[:, 0] * no_of_labels + reported[:, 1])
+        entities_per_label = np.bincount(pairs % no_of_labels, minlength = no_of_labels) if no_of_labels else np.empty(0, np.int64)
+
+        if not self.meta["entities"]:
+            return []
+
+        return sorted(self._labels[np.flatnonzero(entities_per_label == len(self.meta["entities"]))].tolist())
+
+    def rows_per_entity(self):
+        return pd.Series(self.meta["rows_per_entity"], dtype = np.int64)
+
+    def _row_group(self, year, name):
+
+        key = (year, name)
+
+        if key not in self._row_groups:
+
+            partition = os.path.join(self.directory, "year={}".format(year))
+
+            arrays = {column: np.load(os.path.join(partition, "{}.{}.npy".format(name, column)), mmap_mode = "r")
+                      for column in columns + ("offsets",)}
+
+            with self._lock:
+                self._row_groups[key] = arrays
+
+        return self._row_groups[key]
+
+    def _codes(self, values, ids):
+        return None if values is None else np.array(sorted(ids[value] for value in values if value in ids), dtype = np.int64)
+
+    def iter_frames(self, years = None, labels = None, entities = None):
+
+        '''
+        The facts, a row group at a time, read only where they can match.
+
+        Parameters
+        ----------
+        years : (low, high), inclusive, optional
+        labels : list of labels, optional
+        entities : list of entity names, optional
+        '''
+
+        label_codes = self._codes(labels, self._label_ids)
+        entity_codes = self._codes(entities, self._entity_ids)
+
+        if ((label_codes is not None) and (len(label_codes) == 0)) or ((entity_codes is not None) and (len(entity_codes) == 0)):
+            return
+
+        for year in self.years:
+
+            if (years is not None) and not (years[0] <= year <= years[1]):
+                continue
+
+            for name in self.meta["row_groups"][str(year)]:
+
+                row_group = self._row_group(year, name)
+
+                if label_codes is None:
+                    slices = [slice(0, len(row_group["end"]))]
+                else:
+                    offsets = row_group["offsets"]
+                    slices = [slice(offsets[l], offsets[l + 1]) for l in label_codes if l + 1 < len(offsets) and offsets[l] < offsets[l + 1]]
+
+                if not slices:
+                    continue
+
+                #Only these pages of the files are read
+                arrays = {column: np.concatenate([row_group[column][s] for s in slices]) for column in columns}
+
+                if entity_codes is not None:
+                    keep = np.isin(arrays["entity"], entity_codes)
+                    arrays = {column: array[keep] for column, array in arrays.items()}
+
+                if len(arrays["end"]) == 0:
+                    continue
+
+                yield self._frame(arrays, year)
+
+    def _frame(self, arrays, year):
+
+        return pd.DataFrame({
+            "end": pd.to_datetime(arrays["end"].astype("datetime64[D]")),
+            "Label": self._labels[arrays["label"]],
+            "Entity": self._entities[arrays["entity"]],
+            "Value": arrays["value"],
+            "Year": np.full(len(arrays["end"]), year, dtype = np.int64)
+            })
+
+    def read_frame(self, years = None, labels = None, entities = None):
+
+        '''The facts matching the filters given, as a single DataFrame (see iter_frames)'''
+
+        frames = list(self.iter_frames(years, labels, entities))
+
+        if not frames:
+            return self._frame({column: np.empty(0, dtype = column_dtypes[column]) for column in columns}, 0)
+
+        return pd.concat(frames, ignore_index = True)
+
+
+class PartitionedFactsDirectory:
+
+    '''
+    The datasets of this machine, under one directory, shared by every worker.
+
+    Datasets are looked up by digest. Opening one (i.e. every figure drawn out of it, by any session) marks it as used
+    - at most once per touch_every seconds - and only datasets nobody used for max_idle seconds are deleted.
+    '''
+
+    def __init__(self, root, max_idle = 12 * 3600, max_open = 16, touch_every = 60):
+
+        self.root = root
+        self.max_idle = max_idle
+        self.max_open = max_open
+        self.touch_every = touch_every
+
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+        #Digest -> when this process last marked it as used
+        self._touched = {}
+
+    def write(self, frames, **writer_kwargs):
+
+        '''
+        Writes a new dataset out of an iterable of DataFrames (e.g. pd.read_csv(..., chunksize = ...))
+        and returns it, opened.
+        '''
+
+        os.makedirs(self.root, exist_ok = True)
+
+        staging = tempfile.mkdtemp(prefix = "writing-{}-".format(uuid.uuid4().hex), dir = self.root)
+
+        try:
+
+            writer = PartitionedFactsWriter(staging, **writer_kwargs)
+
+            for fin_df in frames:
+                writer.add(fin_df)
+
+            digest = writer.close()
+
+            directory = os.path.join(self.root, digest)
+
+            try:
+                os.rename(staging, directory)
+            except OSError:
+                #The same dataset was already written (e.g. by another worker)
+                shutil.rmtree(staging, ignore_errors = True)
+
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors = True)
+            raise
+
+        self._drop_idle_datasets()
+
+        return self.open(digest)
+
+    def _touch(self, digest):
+
+        '''Marks a dataset as used (its directory's modification time) - raises KeyError if it is not on disk anymore'''
+
+        now = time.time()
+
+        if now - self._touched.get(digest, 0) < self.touch_every:
+            return
+
+        try:
+            os.utime(os.path.join(self.root, digest))
+        except FileNotFoundError:
+            with self._lock:
+                self._open.pop(digest, None)
+            raise KeyError(digest)
+
+        self._touched[digest] = now
+
+    def open(self, digest):
+
+        if not digest_pattern.match(digest or ""):
+            raise KeyError(digest)
+
+        self._touch(digest)
+
+        with self._lock:
+
+            if digest in self._open:
+                self._open.move_to_end(digest)
+                return self._open[digest]
+
+        directory = os.path.join(self.root, digest)
+
+        if not os.path.isfile(os.path.join(directory, "meta.json")):
+            raise KeyError(digest)
+
+        facts = PartitionedFacts(directory)
+
+        with self._lock:
+
+            self._open[digest] = facts
+
+            while len(self._open) > self.max_open:
+                self._open.popitem(last = False)
+
+        return facts
+
+    def _drop_idle_datasets(self):
+
+        '''Deletes the datasets (and the writes left half done) nobody used for max_idle seconds'''
+
+        now = time.time()
+
+        for name in os.listdir(self.root):
+
+            directory = os.path.join(self.root, name)
+
+            try:
+                idle = now - os.path.getmtime(directory)
+            except OSError:
+                continue
+
+            if idle <= self.max_idle:
+                continue
+
+            with self._lock:
+                self._open.pop(name, None)
+
+            shutil.rmtree(directory, ignore_errors = True)
+
+
+#One directory per machine - every worker process writes to and reads from the same one
+partitioned_facts = PartitionedFactsDirectory(os.path.join(tempfile.gettempdir(), "secompair-facts"))
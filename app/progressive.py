@@ -0,0 +1,358 @@
+'''
+Progressive loading - the features shown first, right away; everything else, in the background.
+
+Right after a load, the charts only need the starting features (e.g. Assets) of the companies chosen.
+Those come from SEC's companyconcept API (one small JSON per company and feature)
+while the full companyfacts of each company are fetched by a background job,
+which the app polls and delivers company by company.
+
+A job's state is kept on disk, next to the fact store (where the companies it completes are written):
+    <fact store>/backfill_jobs/<job id>/
+        job.json        the CIKs asked for, completed and failed, whether it is finished, and when its runner last moved
+        priority.npz    the starting features, for the companies not completed yet
+        owner           which runner is working on it
+        cancelled       there once the job is not wanted anymore
+so a poll reaching any gunicorn worker delivers the same progress,
+and a job whose runner went quiet (e.g. its worker was restarted) is taken over where it stopped instead of started over.
+'''
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import requests
+
+from app.downloaders import SecApiError, get_json
+from app.fact_store import fact_store
+from app.fetch_pipeline import preprocessed_facts
+
+
+companyconcept_url = "https://data.sec.gov/api/xbrl/companyconcept/CIK{:010d}/{}/{}.json"
+
+#Where a label is looked for - the first taxonomy reporting it wins
+taxonomies = ("us-gaap", "ifrs-full")
+
+
+def concept_of(label):
+    '''The XBRL tag behind a label - for the labels the app starts from, they are the same but for spaces'''
+
+    return label.replace(" ", "")
+
+
+def fetch_priority_facts(downloader, ciks, labels):
+
+    '''
+    The facts of just a few labels, for each company.
+
+    Parameters
+    ----------
+    downloader : a pooled SecFactsDownloader (see downloaders), whose session is used
+    ciks : list of int
+    labels : list of str, e.g. [starting_x, starting_y]
+
+    Returns
+    -------
+    pandas DataFrame shaped like SecFactsDownloader.fetch_facts returns it (so that preprocess_df applies),
+    or None if nothing was found - a label the SEC does not deliver (not reported, throttled, timed out...) is left to the backfill
+    '''
+
+    frames = []
+
+    for cik in ciks:
+        for label in dict.fromkeys(labels):
+            for taxonomy in taxonomies:
+
+                url = companyconcept_url.format(int(cik), taxonomy, concept_of(label))
+
+                try:
+                    concept = get_json(downloader.session, url)
+                    unit, values = next(iter(concept["units"].items()))
+                except SecApiError as e:
+                    #Not reported under this taxonomy - maybe under the next one
+                    if e.status == 404:
+                        continue
+                    print("Fetching", url, "failed:", e)
+                    break
+                except (requests.RequestException, ValueError, KeyError, StopIteration) as e:
+                    print("Fetching", url, "failed:", e)
+                    break
+
+                facts_df = pd.DataFrame(values)
+                facts_df["Description"] = concept.get("description")
+                facts_df["Label"] = concept["label"]
+                facts_df["Unit_of_Measurement"] = unit
+                facts_df["cik"] = concept["cik"]
+                facts_df["Entity"] = concept["entityName"]
+                facts_df["Underlying_Principles"] = taxonomy
+
+                frames.append(facts_df)
+
+                break
+
+    if not frames:
+        return None
+
+    return pd.concat(frames, ignore_index = True)
+
+
+def save_facts(facts, path):
+
+    '''Writes preprocessed facts (of any number of entities) to an .npz file, aside then renamed'''
+
+    label_codes, labels = pd.factorize(facts["Label"])
+    entity_codes, entities = pd.factorize(facts["Entity"])
+
+    temporary = "{}.{}.tmp.npz".format(path, uuid.uuid4().hex)
+
+    np.savez(temporary,
+             end = pd.to_datetime(facts["end"]).to_numpy(dtype = "datetime64[ns]").astype("datetime64[D]").astype(np.int32),
+             label = label_codes.astype(np.int32),
+             labels = np.array(labels.tolist(), dtype = str),
+             entity = entity_codes.astype(np.int32),
+             entities = np.array(entities.tolist(), dtype = str),
+             value = facts["Value"].to_numpy(dtype = np.float64))
+
+    os.replace(temporary, path)
+
+
+def read_facts(path):
+
+    '''What save_facts wrote, shaped like preprocess_df's output - or None if there is nothing there'''
+
+    if not os.path.isfile(path):
+        return None
+
+    with np.load(path) as saved:
+        end, label, labels, entity, entities, value = (saved[k] for k in ("end", "label", "labels", "entity", "entities", "value"))
+
+    end = pd.to_datetime(end.astype("datetime64[D]").astype("datetime64[ns]"))
+
+    return pd.DataFrame({"end": end,
+                         "Label": np.array(labels.tolist(), dtype = object)[label],
+                         "Entity": np.array(entities.tolist(), dtype = object)[entity],
+                         "Value": value,
+                         "Year": end.year})
+
+
+class BackfillJob:
+
+    '''
+    The full facts of some companies, fetched one company at a time in the background - as seen from its directory.
+
+    Any process can read where a job stands; only the runner named in its owner file works on it.
+    '''
+
+    def __init__(self, directory):
+
+        self.directory = directory
+        self.id = os.path.basename(directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def state(self):
+
+        '''{"ciks", "completed", "failed", "finished", "heartbeat"} - or None if the job is gone'''
+
+        try:
+            with open(self._path("job.json"), encoding = "utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_state(self, state):
+
+        temporary = "{}.{}.tmp".format(self._path("job.json"), uuid.uuid4().hex)
+
+        with open(temporary, "w", encoding = "utf-8") as f:
+            json.dump(state, f)
+
+        os.replace(temporary, self._path("job.json"))
+
+    def _owner(self):
+
+        try:
+            with open(self._path("owner"), encoding = "utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def claim(self, owner):
+
+        '''Makes owner the job's runner (whoever ran it before stops after the company it is on)'''
+
+        temporary = "{}.{}.tmp".format(self._path("owner"), uuid.uuid4().hex)
+
+        with open(temporary, "w", encoding = "utf-8") as f:
+            f.write(owner)
+
+        os.replace(temporary, self._path("owner"))
+
+        state = self.state()
+        self._write_state(dict(state, heartbeat = time.time()))
+
+    @property
+    def cancelled(self):
+        return os.path.exists(self._path("cancelled"))
+
+    def cancel(self):
+        open(self._path("cancelled"), "w").close()
+
+    def is_stale(self, state, stale_after):
+        '''Whether the job is unfinished and its runner has not moved for stale_after seconds'''
+
+        return (not state["finished"]) and (not self.cancelled) and (time.time() - state["heartbeat"] > stale_after)
+
+    def run(self, downloader, preprocess, owner):
+
+        '''Fetches the companies neither completed nor failed yet, for as long as owner is the job's runner and it is wanted'''
+
+        state = self.state()
+
+        if (state is None) or self.cancelled:
+            return
+
+        done = set(state["completed"]) | set(state["failed"])
+
+        #Each company done is kept on disk (see fact_store) - for the job's deliveries, every worker and the query API
+        for cik, facts in preprocessed_facts(downloader, [cik for cik in state["ciks"] if cik not in done], preprocess, store = fact_store):
+
+            #Taken over meanwhile
+            if self._owner() != owner:
+                return
+
+            if facts is None:
+                state["failed"].append(cik)
+            else:
+                state["completed"].append(cik)
+
+            state["heartbeat"] = time.time()
+
+            self._write_state(state)
+
+            if self.cancelled:
+                return
+
+        state["finished"] = True
+
+        self._write_state(state)
+
+    def frames(self, state, remember = True):
+
+        '''
+        What is known, as of state, a company at a time: the full facts of the companies completed (from the fact store),
+        then the starting features of the rest.
+
+        Unless remember, the fact store does not keep the facts it reads (see FactStore.company_facts).
+        '''
+
+        completed_entities = set()
+
+        for cik in state["completed"]:
+
+            facts = fact_store.company_facts(cik, remember = remember)
+
+            if facts is None:
+                continue
+
+            completed_entities.update(facts["Entity"].unique())
+
+            yield facts
+
+        priority_data = read_facts(self._path("priority.npz"))
+
+        if priority_data is not None:
+            yield priority_data.loc[~priority_data["Entity"].isin(completed_entities)]
+
+    @staticmethod
+    def no_of_completed(state):
+        return len(state["completed"]) + len(state["failed"])
+
+
+class BackfillJobs:
+
+    '''
+    The background jobs of every process sharing directory.
+
+    Each job runs in a thread of its own, in the process that started it - or took it over, once its runner went quiet
+    for stale_after seconds. Jobs are deleted once untouched for max_age seconds.
+    '''
+
+    def __init__(self, directory, max_age = 3600, stale_after = 180):
+
+        self.directory = directory
+        self.max_age = max_age
+        self.stale_after = stale_after
+
+    def _drop_old_jobs(self):
+
+        now = time.time()
+
+        for entry in os.scandir(self.directory):
+            try:
+                if now - os.stat(os.path.join(entry.path, "job.json")).st_mtime > self.max_age:
+                    shutil.rmtree(entry.path, ignore_errors = True)
+            except OSError:
+                continue
+
+    def _run(self, job, downloader, preprocess):
+
+        owner = uuid.uuid4().hex
+        job.claim(owner)
+
+        threading.Thread(target = job.run, args = (downloader, preprocess, owner), name = "backfill-" + job.id, daemon = True).start()
+
+    def start(self, downloader, ciks, priority_data, preprocess, job_id = None):
+
+        os.makedirs(self.directory, exist_ok = True)
+
+        self._drop_old_jobs()
+
+        job = BackfillJob(os.path.join(self.directory, job_id or uuid.uuid4().hex))
+
+        os.makedirs(job.directory, exist_ok = True)
+
+        if priority_data is not None:
+            save_facts(priority_data, job._path("priority.npz"))
+
+        job._write_state({"ciks": [int(cik) for cik in ciks], "completed": [], "failed": [], "finished": False, "heartbeat": time.time()})
+
+        self._run(job, downloader, preprocess)
+
+        return job
+
+    def get(self, job_id):
+
+        '''The job (started by any process) - or None if there is no such job'''
+
+        if not re.match("^[0-9a-f]{32}$", job_id or ""):
+            return None
+
+        job = BackfillJob(os.path.join(self.directory, job_id))
+
+        return job if job.state() is not None else None
+
+    def cancel(self, job_id):
+
+        '''Stops a job (wherever it runs) after the company it is on - e.g. when the same browser loads something else'''
+
+        job = self.get(job_id)
+
+        if job is not None:
+            job.cancel()
+
+    def resume(self, job, downloader, preprocess):
+
+        '''Takes over a job whose runner went quiet, from the company it stopped at'''
+
+        self._run(job, downloader, preprocess)
+
+
+#Shared by every process using the same fact store
+backfill_jobs = BackfillJobs(os.path.join(fact_store.directory, "backfill_jobs"))
@@ -0,0 +1,239 @@
+'''
+Screening of label pairs - which X/Y comparisons are worth a look, out of all of them at once.
+
+The scatter compares one X label against one Y label, and finding a good pair took an update_graph round trip per pair tried.
+Here, for the entities loaded, a single vectorized pass over their facts aligned as Entity x Label x quarter gives:
+    - the correlation of every pair of labels, over the (entity, quarter) cells where both were reported
+    - the dispersion of each label across entities: how far apart the entities' averages of it lie
+
+Values are compared as signed log magnitudes (sign(v) * log10(1 + |v|)) - financial figures span orders of magnitude,
+and on a linear scale the few biggest companies would decide every correlation.
+
+A pair ranks high when its labels move together and both of them spread the entities out (the scatter has something to show).
+Pairs of labels that are one and the same number (e.g. total assets vs total liabilities and equity) are left out.
+
+Examples
+--------
+>>> screen_label_pairs(fin_df, labels = manifest["common_labels"], years = [2015, 2022], top_n = 20)
+
+Screened pairs are kept per dataset in a small LRU of their own (screening_cache), apart from the figures.
+'''
+
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def signed_log(values):
+    return np.sign(values) * np.log10(1 + np.abs(values))
+
+
+def aligned_values(fin_df, labels = None, years = None):
+
+    '''
+    The facts as a (labels x entities x quarters) array of signed log values - NaN where nothing was reported.
+
+    Facts are aligned on the calendar quarter their period ends in (fiscal quarters end on different days for different companies);
+    a quarter reported more than once for the same label gets the mean of its values.
+
+    Returns
+    -------
+    (label names, entity names, array)
+    '''
+
+    if labels is not None:
+        fin_df = fin_df.loc[fin_df["Label"].isin(labels)]
+
+    if years is not None:
+        fin_df = fin_df.loc[(fin_df["Year"] >= years[0]) & (fin_df["Year"] <= years[1])]
+
+    label_codes, label_names = pd.factorize(fin_df["Label"], sort = True)
+    entity_codes, entity_names = pd.factorize(fin_df["Entity"], sort = True)
+
+    #Months since 1970, then quarters
+    months = pd.to_datetime(fin_df["end"]).to_numpy(dtype = "datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+    quarter_codes, quarters = pd.factorize(months // 3, sort = True)
+
+    shape = (len(label_names), len(entity_names), len(quarters))
+
+    cells = np.ravel_multi_index((label_codes, entity_codes, quarter_codes), shape) if len(fin_df) else np.empty(0, np.int64)
+    size = int(np.prod(shape))
+
+    sums = np.bincount(cells, weights = signed_log(fin_df["Value"].to_numpy(dtype = np.float64)), minlength = size)
+    counts = np.bincount(cells, minlength = size)
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        values = np.where(counts > 0, sums / counts, np.nan)
+
+    return list(label_names), list(entity_names), values.reshape(shape)
+
+
+def label_correlations(values):
+
+    '''
+    Pearson correlations between every two labels of a (labels x entities x quarters) array,
+    each over the cells both labels have a value in - as matrix products, not a loop over pairs.
+
+    Returns
+    -------
+    (correlations, cells in common), both labels x labels
+    '''
+
+    flat = values.reshape(len(values), -1)
+
+    present = ~np.isnan(flat)
+    weights = present.astype(np.float64)
+    x = np.where(present, flat, 0.0)
+
+    n = weights @ weights.T
+
+    #Row label i's sums over the cells shared with column label j
+    sum_x = x @ weights.T
+    sum_xx = (x * x) @ weights.T
+    sum_xy = x @ x.T
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+
+        covariance = sum_xy - sum_x * sum_x.T / n
+        variance_x = sum_xx - sum_x ** 2 / n
+        variance_y = variance_x.T
+
+        correlations = covariance / np.sqrt(variance_x * variance_y)
+
+    return correlations, n
+
+
+def label_dispersion(values):
+
+    '''For each label, the standard deviation across entities of the entities' average (signed log) value'''
+
+    #Labels an entity never reported are all NaN - their mean is NaN, and no warning is needed to say so
+    with warnings.catch_warnings():
+
+        warnings.simplefilter("ignore", RuntimeWarning)
+
+        averages = np.nanmean(values, axis = 2)
+
+        return np.nanstd(averages, axis = 1)
+
+
+def screen_label_pairs(fin_df, labels = None, years = None, top_n = 20, min_entities = 3, min_cells = 8, identical = 0.999):
+
+    '''
+    The top_n most informative X/Y label pairs for the scatter.
+
+    Parameters
+    ----------
+    fin_df : pandas DataFrame with columns 'end', 'Label', 'Entity', 'Value', 'Year'
+    labels : list of str, optional
+        Only pairs among these (e.g. the labels every entity reports, which the dropdowns offer)
+    years : [first, last], optional
+    top_n : int
+    min_entities : int
+        Entities that must report both labels of a pair
+    min_cells : int
+        (Entity, quarter) cells in which both labels must have been reported
+    identical : float
+        Pairs correlated at least as much as that are taken for the same number under two labels and left out
+
+    Returns
+    -------
+    pandas DataFrame with columns 'X', 'Y', 'correlation', 'dispersion_x', 'dispersion_y', 'entities', 'score',
+    best pair first
+    '''
+
+    columns = ["X", "Y", "correlation", "dispersion_x", "dispersion_y", "entities", "score"]
+
+    label_names, _, values = aligned_values(fin_df, labels, years)
+
+    if len(label_names) < 2:
+        return pd.DataFrame(columns = columns)
+
+    correlations, cells = label_correlations(values)
+
+    dispersion = label_dispersion(values)
+
+    #Entities reporting both labels of each pair
+    reported = (~np.isnan(values)).any(axis = 2).astype(np.float64)
+    entities = reported @ reported.T
+
+    with np.errstate(invalid = "ignore"):
+
+        spread = np.sqrt(np.outer(dispersion, dispersion)) / np.nanmax(dispersion) if np.nanmax(dispersion) > 0 else np.zeros_like(correlations)
+
+        scores = np.abs(correlations) * spread
+
+        #Each pair once, and only those worth showing
+        candidates = np.triu(np.ones_like(scores, dtype = bool), k = 1)
+        candidates &= np.isfinite(scores) & (entities >= min_entities) & (cells >= min_cells) & (np.abs(correlations) < identical)
+
+    first, second = np.nonzero(candidates)
+    pair_scores = scores[first, second]
+
+    if len(pair_scores) > top_n:
+        best = np.argpartition(-pair_scores, top_n - 1)[:top_n]
+        first, second, pair_scores = first[best], second[best], pair_scores[best]
+
+    order = np.argsort(-pair_scores, kind = "stable")
+    first, second = first[order], second[order]
+
+    label_names = np.array(label_names, dtype = object)
+
+    return pd.DataFrame({"X": label_names[first],
+                         "Y": label_names[second],
+                         "correlation": correlations[first, second],
+                         "dispersion_x": dispersion[first],
+                         "dispersion_y": dispersion[second],
+                         "entities": entities[first, second].astype(int),
+                         "score": pair_scores[order]},
+                        columns = columns)
+
+
+class ScreeningCache:
+
+    '''
+    LRU of screening results (e.g. the suggested pairs as dropdown options), a few per dataset.
+
+    Examples
+    --------
+    >>> cache = ScreeningCache(max_entries = 64)
+    >>> cache.get_or_create((digest, (2015, 2022), 20), lambda: screen_label_pairs(fin_df, years = [2015, 2022]))
+    '''
+
+    def __init__(self, max_entries = 64):
+
+        self.max_entries = max_entries
+
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get_or_create(self, key, create):
+
+        '''The result stored under key (hashable), or create()'s, stored first'''
+
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+
+        #Outside of the lock: other datasets are screened meanwhile
+        result = create()
+
+        with self._lock:
+
+            self._results[key] = result
+            self._results.move_to_end(key)
+
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last = False)
+
+        return result
+
+
+screening_cache = ScreeningCache()
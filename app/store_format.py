@@ -0,0 +1,195 @@
+'''
+A compact, columnar way to keep a DataFrame in a dcc.Store.
+
+DataFrame.to_dict() repeats the row index as a string key in every column,
+which makes the JSON sent back and forth between browser and server several times bigger than the data.
+
+Here instead:
+    - every column is a single array
+    - text columns (Entity, Label) are dictionary encoded: the distinct values once, plus an integer code per row
+    - numbers and dates travel as base64 encoded little-endian typed buffers
+
+The result is plain JSON, so dcc.Store can hold it as is.
+'''
+
+import base64
+import hashlib
+import hmac
+
+import numpy as np
+import pandas as pd
+
+
+store_format_name = "columnar"
+store_format_version = 1
+
+
+def _pack(array):
+    '''A numpy array as {"dtype", "data"} with data the base64 of its little-endian bytes'''
+
+    array = np.ascontiguousarray(array)
+    array = array.astype(array.dtype.newbyteorder("<"), copy = False)
+
+    return {"dtype": array.dtype.str, "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def _unpack(packed):
+    '''The reverse of _pack'''
+
+    return np.frombuffer(base64.b64decode(packed["data"]), dtype = np.dtype(packed["dtype"]))
+
+
+def _smallest_code_dtype(no_of_categories):
+    '''Signed, so that -1 can stand for a missing value'''
+
+    for dtype in (np.int8, np.int16, np.int32):
+        if no_of_categories <= np.iinfo(dtype).max:
+            return dtype
+
+    return np.int64
+
+
+def _encode_column(series):
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+
+        #Reporting periods are whole days - days since epoch fit in an int32
+        days = series.to_numpy(dtype = "datetime64[ns]").astype("datetime64[D]").astype(np.int32)
+
+        return {"kind": "date", "values": _pack(days)}
+
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+
+        values = series.to_numpy()
+
+        #Years and other small integers do not need 8 bytes
+        if pd.api.types.is_integer_dtype(values.dtype) and len(values) > 0 and values.min() >= -32768 and values.max() <= 32767:
+            values = values.astype(np.int16)
+
+        return {"kind": "number", "values": _pack(values)}
+
+    #Missing values get the code -1
+    codes, categories = pd.factorize(series)
+
+    categories = categories.tolist()
+
+    return {"kind": "category",
+            "categories": categories,
+            "codes": _pack(codes.astype(_smallest_code_dtype(len(categories))))}
+
+
+def _decode_column(encoded):
+
+    kind = encoded["kind"]
+
+    if kind == "date":
+        return _unpack(encoded["values"]).astype("datetime64[D]").astype("datetime64[ns]")
+
+    if kind == "number":
+        return _unpack(encoded["values"])
+
+    if kind == "category":
+
+        categories = np.array(encoded["categories"] + [np.nan], dtype = object)
+
+        #Code -1 picks the trailing NaN
+        return categories[_unpack(encoded["codes"])]
+
+    raise ValueError("Unknown column kind in stored data: {}".format(kind))
+
+
+def frame_to_store(df, key = None):
+
+    '''
+    Encodes a DataFrame for a dcc.Store.
+
+    The row index is dropped; every column keeps its name and order.
+    A digest of the encoded content is included, so that anything caching on the data
+    can tell two datasets apart without hashing them again - signed with key (bytes or str), if given (see store_digest).
+
+    Examples
+    --------
+    >>> data = frame_to_store(df[['end', 'Label', 'Entity', 'Value', 'Year']])
+    >>> store_to_frame(data).equals(df[['end', 'Label', 'Entity', 'Value', 'Year']].reset_index(drop = True))
+    True
+    '''
+
+    columns = {str(column): _encode_column(df[column]) for column in df.columns}
+
+    data = {"format": store_format_name,
+            "version": store_format_version,
+            "length": len(df),
+            "digest": _digest_of_columns(columns),
+            "columns": columns}
+
+    if key is not None:
+        data["signature"] = _signature_of(data, key)
+
+    return data
+
+
+def _digest_of_columns(columns):
+
+    digest = hashlib.sha1()
+    for name, encoded in columns.items():
+        digest.update(name.encode("utf-8"))
+        digest.update(repr(encoded).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+def _signature_of(data, key):
+
+    '''HMAC of the digest, along with the size of every column - so that a signed digest cannot be moved onto data of another shape'''
+
+    sizes = [(name, len(part["data"])) for name, encoded in data["columns"].items() for part in encoded.values() if isinstance(part, dict)]
+
+    message = "{}|{}|{}".format(data["digest"], data["length"], sizes)
+
+    return hmac.new(key.encode("utf-8") if isinstance(key, str) else key, message.encode("utf-8"), hashlib.sha1).hexdigest()
+
+
+def store_digest(data, key = None):
+
+    '''
+    The digest of the stored data - as is, if signed with key by frame_to_store, otherwise computed again out of its columns.
+
+    The "digest" field comes back from the browser like the rest of the Store, and a client can set it to anything
+    (e.g. another dataset's, to get its own figures cached under it) - whatever is shared across sessions is keyed by this instead.
+    Checking the signature takes the same time whatever the size of the data; hashing it again takes a pass over all of it.
+    '''
+
+    if (key is not None) and isinstance(data.get("signature"), str) and hmac.compare_digest(data["signature"], _signature_of(data, key)):
+        return data["digest"]
+
+    return _digest_of_columns(data["columns"])
+
+
+def is_stored_frame(data):
+    '''Whether data (e.g. the content of a dcc.Store) was produced by frame_to_store'''
+
+    return isinstance(data, dict) and data.get("format") == store_format_name
+
+
+def store_column(data, column):
+    '''A single column of the stored data, without decoding the rest'''
+
+    return _decode_column(data["columns"][column])
+
+
+def store_to_frame(data, columns = None):
+
+    '''
+    Decodes the content of a dcc.Store back to a DataFrame.
+
+    Parameters
+    ----------
+    data : dict produced by frame_to_store
+    columns : list of str, optional
+        Decode only these columns (all of them by default)
+    '''
+
+    if columns is None:
+        columns = list(data["columns"])
+
+    return pd.DataFrame({column: store_column(data, column) for column in columns})
@@ -0,0 +1,306 @@
+'''
+The companies of a watchlist, preprocessed ahead of time and loaded once per server, at boot.
+
+Without it, every worker starts cold, and the first analysts after a deploy wait on full EDGAR downloads. Here:
+    - the local cache is a directory with one .npz file per company, holding its preprocessed facts
+      (written by "python -m app.warm_cache --user-agent my_email@my_domain.com", which downloads the watchlist)
+    - at boot, the facts of the watchlist companies found there are read into a few contiguous, read-only numpy arrays
+      (dates as days, labels and entities as integer codes, values) - no Python object per fact
+      for reference counting or the garbage collector to write to
+    - each file holds when the company was fetched: once older than max_age (SECOMPAIR_WARM_MAX_AGE seconds, a week by default),
+      a company is not served from here anymore, but downloaded again (which writes its file anew)
+
+Under gunicorn's preload_app (see gunicorn.conf.py) that happens once, in the master,
+and the forked workers share those pages copy-on-write instead of each holding (and downloading) its own copy.
+
+Examples
+--------
+>>> warm_facts.load(companies_index().ciks_of(read_watchlist()))
+>>> warm_facts.facts_of(warm_facts.fresh([320193, 789019]))
+'''
+
+import argparse
+import os
+import re
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from app.fetch_pipeline import preprocessed_facts
+
+
+app_directory = os.path.dirname(os.path.abspath(__file__))
+
+#Both can be pointed elsewhere, e.g. to a volume surviving deploys
+cache_directory = os.environ.get("SECOMPAIR_WARM_CACHE", os.path.join(app_directory, "warm_cache"))
+watchlist_file = os.environ.get("SECOMPAIR_WATCHLIST", os.path.join(app_directory, "watchlist.txt"))
+
+#Seconds after which a company's cached facts are too old to be served, and it is fetched from the SEC again
+max_age = float(os.environ.get("SECOMPAIR_WARM_MAX_AGE", 7 * 24 * 3600))
+
+
+def read_watchlist(file = watchlist_file):
+
+    '''The titles of the companies in the watchlist file (one per line, as in the companies dropdown; # starts a comment)'''
+
+    if not os.path.isfile(file):
+        return []
+
+    with open(file, encoding = "utf-8") as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+
+    return [line for line in lines if line]
+
+
+cache_file_pattern = re.compile(r"^CIK(\d{10})\.npz$")
+
+
+def cache_file_of(cik, directory = cache_directory):
+    return os.path.join(directory, "CIK{:010d}.npz".format(int(cik)))
+
+
+def save_company(facts, cik, directory = cache_directory):
+
+    '''
+    Writes the preprocessed facts (see preprocess_df) of a single company to the local cache.
+
+    The file is written aside and renamed, so that a server booting meanwhile never reads half of it
+    (and aside under a name of its own, as workers fetching the same company at once may both write it).
+
+    When it was written is kept along, as the time the facts were fetched (see fetched_of).
+    '''
+
+    os.makedirs(directory, exist_ok = True)
+
+    label_codes, labels = pd.factorize(facts["Label"])
+
+    path = cache_file_of(cik, directory)
+    temporary = "{}.{}.tmp.npz".format(path, uuid.uuid4().hex)
+
+    np.savez(temporary,
+             entity = np.array(str(facts["Entity"].iloc[0])),
+             end = pd.to_datetime(facts["end"]).to_numpy(dtype = "datetime64[ns]").astype("datetime64[D]").astype(np.int32),
+             label = label_codes.astype(np.int32),
+             labels = np.array(labels.tolist(), dtype = str),
+             value = facts["Value"].to_numpy(dtype = np.float64),
+             fetched = np.float64(time.time()))
+
+    os.replace(temporary, path)
+
+
+def fetched_of(cached):
+
+    '''When the facts of a company's file (as opened by np.load) were fetched, in seconds since the epoch - 0 if the file does not say'''
+
+    return float(cached["fetched"]) if "fetched" in cached.files else 0.0
+
+
+def is_fresh(fetched, max_age = max_age):
+    return time.time() - fetched < max_age
+
+
+def read_company(path):
+
+    '''
+    The facts of a single company's file, shaped like preprocess_df's output
+    (columns 'end', 'Label', 'Entity', 'Value', 'Year')
+    '''
+
+    with np.load(path) as cached:
+        entity, end, label, labels, value = (cached[k] for k in ("entity", "end", "label", "labels", "value"))
+
+    end = pd.to_datetime(end.astype("datetime64[D]").astype("datetime64[ns]"))
+
+    return pd.DataFrame({"end": end,
+                         "Label": np.array(labels.tolist(), dtype = object)[label],
+                         "Entity": str(entity),
+                         "Value": value,
+                         "Year": end.year})
+
+
+def refresh(downloader, ciks, preprocess, directory = cache_directory, max_workers = 4):
+
+    '''Downloads and preprocesses these companies and (re)writes them to the local cache - returns the CIKs written'''
+
+    written = []
+
+    for cik, facts in preprocessed_facts(downloader, ciks, preprocess, max_workers):
+
+        if facts is None or len(facts) == 0:
+            continue
+
+        save_company(facts, cik, directory)
+        written.append(cik)
+
+    return written
+
+
+class WarmFacts:
+
+    '''
+    The preprocessed facts of some companies, held in contiguous read-only arrays, a company's rows next to each other.
+
+    Examples
+    --------
+    >>> warm_facts = WarmFacts()
+    >>> warm_facts.load([320193, 789019])
+    >>> 320193 in warm_facts
+    True
+    '''
+
+    def __init__(self):
+        self._set([], [], np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, np.float64), {}, {})
+
+    def _set(self, labels, entities, end, label, entity, value, rows_of, fetched):
+
+        for array in (end, label, entity, value):
+            array.setflags(write = False)
+
+        #Code -> name, as object arrays, so that a request's rows get their names with a single take
+        self._labels = np.array(labels, dtype = object)
+        self._entities = np.array(entities, dtype = object)
+
+        self._end = end
+        self._label = label
+        self._entity = entity
+        self._value = value
+
+        #CIK -> (first row, row after the last)
+        self._rows_of = rows_of
+
+        #CIK -> when its facts were fetched (see fetched_of)
+        self._fetched = fetched
+
+    def __contains__(self, cik):
+        return int(cik) in self._rows_of
+
+    def __len__(self):
+        return len(self._rows_of)
+
+    @property
+    def ciks(self):
+        return list(self._rows_of)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self._end, self._label, self._entity, self._value))
+
+    def load(self, ciks, directory = cache_directory):
+
+        '''
+        Reads the companies of ciks found in the local cache (the others are left to be downloaded) - returns how many were.
+
+        Whatever was loaded before is replaced.
+        '''
+
+        labels, label_code_of = [], {}
+        entities = []
+        ends, label_codes, entity_codes, values = [], [], [], []
+        rows_of = {}
+        fetched = {}
+
+        rows = 0
+
+        for cik in dict.fromkeys(int(cik) for cik in ciks):
+
+            path = cache_file_of(cik, directory)
+
+            if not os.path.isfile(path):
+                continue
+
+            try:
+                with np.load(path) as cached:
+                    entity, end, label, company_labels, value = (cached[k] for k in ("entity", "end", "label", "labels", "value"))
+                    fetched[cik] = fetched_of(cached)
+            except Exception as e:
+                print("Reading", path, "failed:", e)
+                continue
+
+            #The company's own label codes, mapped to codes shared by all companies
+            for company_label in company_labels.tolist():
+                if company_label not in label_code_of:
+                    label_code_of[company_label] = len(labels)
+                    labels.append(company_label)
+
+            shared_codes = np.array([label_code_of[company_label] for company_label in company_labels.tolist()], dtype = np.int32)
+
+            ends.append(end)
+            label_codes.append(shared_codes[label])
+            entity_codes.append(np.full(len(end), len(entities), dtype = np.int32))
+            values.append(value)
+
+            entities.append(str(entity))
+            rows_of[cik] = (rows, rows + len(end))
+
+            rows += len(end)
+
+        if not rows_of:
+            self.__init__()
+            return 0
+
+        #One allocation per column, made once - never to be written to again
+        self._set(labels, entities, np.concatenate(ends), np.concatenate(label_codes), np.concatenate(entity_codes), np.concatenate(values), rows_of, fetched)
+
+        print("Warm cache:", len(rows_of), "companies,", rows, "facts,", round(self.nbytes / 1024 ** 2, 1), "MB")
+
+        return len(rows_of)
+
+    def fresh(self, ciks, max_age = max_age):
+
+        '''The CIKs among ciks held here and fetched less than max_age seconds ago - the others are to be fetched again'''
+
+        return [int(cik) for cik in ciks if (int(cik) in self._fetched) and is_fresh(self._fetched[int(cik)], max_age)]
+
+    def facts_of(self, ciks):
+
+        '''
+        The facts of the companies of ciks held here, shaped like preprocess_df's output
+        (columns 'end', 'Label', 'Entity', 'Value', 'Year') - or None if none of them is.
+        '''
+
+        slices = [self._rows_of[int(cik)] for cik in ciks if int(cik) in self._rows_of]
+
+        if not slices:
+            return None
+
+        rows = np.concatenate([np.arange(start, stop) for start, stop in slices])
+
+        end = pd.to_datetime(self._end[rows].astype("datetime64[D]").astype("datetime64[ns]"))
+
+        return pd.DataFrame({"end": end,
+                             "Label": self._labels[self._label[rows]],
+                             "Entity": self._entities[self._entity[rows]],
+                             "Value": self._value[rows],
+                             "Year": end.year})
+
+
+#Filled in at boot (see main) - then only ever read
+warm_facts = WarmFacts()
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Download the watchlist companies into the local cache the app warms up from")
+    parser.add_argument("--user-agent", required = True, help = "What the SEC asks for, e.g. my_email@my_domain.com")
+    parser.add_argument("--watchlist", default = watchlist_file, help = "Company titles, one per line")
+    parser.add_argument("--directory", default = cache_directory)
+    parser.add_argument("--workers", type = int, default = 4, help = "Companies fetched at once (the SEC allows up to 10 requests/second)")
+    args = parser.parse_args(argv)
+
+    from app.downloaders import downloader_pool, companies_index
+    from app.main import preprocess_df
+
+    downloader = downloader_pool.get(args.user_agent)
+
+    titles = read_watchlist(args.watchlist)
+    ciks = companies_index(downloader.session).ciks_of(titles)
+
+    written = refresh(downloader, ciks, preprocess_df, args.directory, args.workers)
+
+    print(len(written), "of", len(ciks), "companies written to", args.directory)
+
+
+if __name__ == "__main__":
+    main()
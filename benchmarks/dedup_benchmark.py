@@ -0,0 +1,82 @@
+'''
+What dropping facts reported more than once for the same period (preprocess_df's deduplicate) saves.
+
+On fake companyfacts payloads (where some concepts get restated under a new tag, see fake_edgar.company_facts),
+preprocess_df is run with and without it, and the result goes through the Store encoding and the scatter's aggregation.
+
+    python -m benchmarks.dedup_benchmark --companies 20 --labels 300 --restated 0.1
+'''
+
+import argparse
+import json
+import time
+
+import pandas as pd
+
+from benchmarks.fake_edgar import install, company_facts, company_facts_to_df
+
+
+def timed(function, *args, **kwargs):
+
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+
+    return result, time.perf_counter() - started
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Rows, Store size and time with and without deduplication")
+    parser.add_argument("--companies", type = int, default = 20)
+    parser.add_argument("--labels", type = int, default = 300, help = "Labels per company")
+    parser.add_argument("--restated", type = float, default = 0.1, help = "Share of the concepts restated under a new tag")
+    args = parser.parse_args(argv)
+
+    install()
+
+    from app.main import preprocess_df
+    from app.store_format import frame_to_store
+    from app.figures import averages_per_entity
+    from app.manifest import colors_per_entity
+
+    raw = pd.concat([company_facts_to_df(company_facts(cik, labels_per_company = args.labels, restated_share = args.restated))
+                     for cik in range(1, args.companies + 1)], ignore_index = True)
+
+    results = {}
+
+    for deduplicate in (False, True):
+
+        facts, preprocess_seconds = timed(preprocess_df, raw.copy(), deduplicate = deduplicate)
+
+        stored, store_seconds = timed(frame_to_store, facts)
+
+        colors = colors_per_entity(facts["Entity"].unique())
+        years = [int(facts["Year"].min()), int(facts["Year"].max())]
+
+        #The averages of (up to) 100 labels against Assets, as the scatter would show them one pair at a time
+        started = time.perf_counter()
+        averages = pd.concat([averages_per_entity(facts, label, "Assets", years, colors).set_index("Entity")[label].rename(label)
+                              for label in sorted(facts["Label"].unique())[:100] if label != "Assets"], axis = 1)
+        averages_seconds = time.perf_counter() - started
+
+        results[deduplicate] = {"rows": len(facts), "store_kb": len(json.dumps(stored)) / 1024,
+                                "preprocess_s": preprocess_seconds, "store_s": store_seconds, "averages_s": averages_seconds,
+                                "averages": averages}
+
+    print("{:>13}{:>10}{:>11}{:>15}{:>9}{:>12}".format("deduplicate", "rows", "store KB", "preprocess s", "store s", "averages s"))
+
+    for deduplicate, result in results.items():
+        print("{:>13}{rows:>10}{store_kb:>11.0f}{preprocess_s:>15.3f}{store_s:>9.3f}{averages_s:>12.3f}".format(str(deduplicate), **result))
+
+    #(Entity, Label) averages that duplicates skewed
+    before, after = results[False]["averages"].stack(), results[True]["averages"].stack()
+    before, after = before.align(after, join = "inner")
+
+    skewed = int(((before - after).abs() > 1e-9 * after.abs()).sum())
+
+    print("{} of {} rows removed ({} raw rows); {} of {} averages per (Entity, Label) were skewed by them".format(
+        results[False]["rows"] - results[True]["rows"], results[False]["rows"], len(raw), skewed, len(after)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+'''
+A local EDGAR, serving the two endpoints the app relies on:
+
+    /files/company_tickers.json                     (what fetch_companies_info downloads)
+    /api/xbrl/companyfacts/CIK##########.json       (what fetch_facts downloads, per company)
+
+    /api/xbrl/companyconcept/CIK##########/{taxonomy}/{tag}.json   (what progressive loading asks for first)
+
+The content comes from fake_edgar, so it is deterministic, in the same shapes the SEC serves.
+Per-request latency, payload size and error rate are configurable,
+and, like the SEC's Fair Access Policy, no more than 10 requests per second are served (429 beyond that).
+
+    python -m benchmarks.edgar_simulator --port 8765 --latency 0.15 --error-rate 0.01
+'''
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fake_edgar import company_concept, company_facts, company_tickers
+
+
+companyfacts_path = re.compile(r"^/api/xbrl/companyfacts/CIK(\d{10})\.json$")
+companyconcept_path = re.compile(r"^/api/xbrl/companyconcept/CIK(\d{10})/([^/]+)/([^/]+)\.json$")
+
+
+class SimulatorSettings:
+
+    '''
+    How the simulated SEC behaves.
+
+    Parameters
+    ----------
+    latency : float
+        Seconds added to every response
+    jitter : float
+        Up to this many seconds more, at random
+    labels_per_company : int
+        Size of each companyfacts payload (see fake_edgar.company_facts)
+    error_rate : float
+        Share of requests answered with a 500
+    max_requests_per_second : int
+        Requests beyond this, within any second, get a 429
+    seed : int
+        For the jitter and the errors - the same seed, the same run
+    '''
+
+    def __init__(self, latency = 0.0, jitter = 0.0, labels_per_company = 150, error_rate = 0.0, max_requests_per_second = 10, seed = 0):
+
+        self.latency = latency
+        self.jitter = jitter
+        self.labels_per_company = labels_per_company
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.recent_requests = deque()
+
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def admit(self):
+
+        '''Whether one more request fits within the rate limit (and, if it does, counts it)'''
+
+        now = time.monotonic()
+
+        with self.lock:
+
+            self.requests += 1
+
+            while self.recent_requests and now - self.recent_requests[0] >= 1:
+                self.recent_requests.popleft()
+
+            if len(self.recent_requests) >= self.max_requests_per_second:
+                self.throttled += 1
+                return False
+
+            self.recent_requests.append(now)
+
+            return True
+
+    def draw(self):
+
+        '''The delay and whether this request fails'''
+
+        with self.lock:
+
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fails = self.random.random() < self.error_rate
+
+            if fails:
+                self.errors += 1
+
+        return delay, fails
+
+
+@lru_cache(maxsize = 256)
+def companyfacts_payload(cik, labels_per_company):
+    return json.dumps(company_facts(cik, labels_per_company = labels_per_company)).encode("utf-8")
+
+
+@lru_cache(maxsize = 1)
+def tickers_payload():
+    return json.dumps(company_tickers()).encode("utf-8")
+
+
+def make_handler(settings):
+
+    class EdgarHandler(BaseHTTPRequestHandler):
+
+        def send(self, status, body = b"", content_type = "application/json", headers = None):
+
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+
+            #The SEC refuses requests without a user agent
+            if not self.headers.get("User-Agent"):
+                return self.send(403, b"No User-Agent", "text/plain")
+
+            if not settings.admit():
+                return self.send(429, b"Request Rate Threshold Exceeded", "text/plain", {"Retry-After": "1"})
+
+            delay, fails = settings.draw()
+
+            time.sleep(delay)
+
+            if fails:
+                return self.send(500, b"Internal Server Error", "text/plain")
+
+            path = self.path.split("?")[0]
+
+            if path == "/files/company_tickers.json":
+                return self.send(200, tickers_payload())
+
+            match = companyfacts_path.match(path)
+
+            if match:
+                return self.send(200, companyfacts_payload(int(match.group(1)), settings.labels_per_company))
+
+            match = companyconcept_path.match(path)
+
+            if match:
+
+                concept = company_concept(int(match.group(1)), match.group(2), match.group(3), settings.labels_per_company)
+
+                if concept is not None:
+                    return self.send(200, json.dumps(concept).encode("utf-8"))
+
+            return self.send(404, b"Not Found", "text/plain")
+
+        def log_message(self, format, *args):
+            pass
+
+    return EdgarHandler
+
+
+def start_simulator(settings = None, port = 0):
+
+    '''
+    Starts the simulator in a background thread.
+
+    Returns
+    -------
+    (server, base_url) - call server.shutdown() to stop it
+    '''
+
+    settings = settings or SimulatorSettings()
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(settings))
+    server.settings = settings
+
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    return server, "http://127.0.0.1:{}".format(server.server_port)
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "A local, deterministic EDGAR")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Seconds added to every response")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "Up to this many random seconds more")
+    parser.add_argument("--labels", type = int, default = 150, help = "Labels per company - the size of each companyfacts payload")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "Share of requests failing with a 500")
+    parser.add_argument("--rate-limit", type = int, default = 10, help = "Requests per second served before answering 429")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args(argv)
+
+    settings = SimulatorSettings(args.latency, args.jitter, args.labels, args.error_rate, args.rate_limit, args.seed)
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(settings))
+
+    print("EDGAR simulator on http://127.0.0.1:{}".format(args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
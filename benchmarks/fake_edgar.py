@@ -0,0 +1,357 @@
+'''
+A fake EDGAR, for benchmarking the app without going anywhere near the SEC.
+
+It produces, deterministically (the same CIK always gives the same facts):
+    - companyfacts JSON, shaped like https://data.sec.gov/api/xbrl/companyfacts/CIK##########.json
+    - companyconcept JSON (a single feature of a company), shaped like
+      https://data.sec.gov/api/xbrl/companyconcept/CIK##########/us-gaap/Assets.json
+    - FakeSecFactsDownloader, a stand-in for secdata's SecFactsDownloader
+      that turns those JSONs into the very same DataFrame fetch_facts returns
+
+Use install() before importing the app, so that every "from secdata import SecFactsDownloader" gets the fake one.
+'''
+
+import os
+import re
+import sys
+import tempfile
+import time
+import types
+import zlib
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+companies_info_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "companiesinfo.csv")
+
+#Reported by (nearly) everyone, so that the app's starting features always exist
+common_tags = [("Assets", "Assets"), ("Liabilities", "Liabilities")]
+
+
+def companies_info():
+    '''CIK, ticker and title of every company - the real list, as shipped with the app'''
+
+    return pd.read_csv(companies_info_file, index_col = 0).reset_index(drop = True)
+
+
+def company_tickers():
+    '''The content of https://www.sec.gov/files/company_tickers.json'''
+
+    info = companies_info()
+
+    return {str(i): {"cik_str": int(row.cik_str), "ticker": row.ticker, "title": row.title}
+            for i, row in enumerate(info.itertuples(index = False))}
+
+
+@lru_cache(maxsize = 128)
+def company_facts(cik, entity_name = None, labels_per_company = 150, first_year = 2009, last_year = 2022, restated_share = 0.1):
+
+    '''
+    The companyfacts JSON of a company (cached - do not modify it).
+
+    Each label is reported every quarter between first_year and last_year:
+    Q1-Q3 in 10-Qs (framed CYyyyyQn or CYyyyyQnI),
+    Q4 within the 10-K covering the whole year (framed CYyyyy),
+    plus last year's comparatives repeated without a frame, the way real filings do.
+
+    Some concepts (restated_share of them) move to a new tag, with the same label, at some point:
+    the two years before the move are filed again, restated, under the new tag - so both tags carry a framed fact
+    for those periods, and only the later filing should be kept.
+
+    Parameters
+    ----------
+    cik : int
+    entity_name : str, optional
+        Looked up in the companies info when not given
+    labels_per_company : int
+        Roughly how big the payload gets - real companies report a few hundred
+    restated_share : float
+        Share of the concepts that get restated under a new tag
+    '''
+
+    cik = int(cik)
+
+    if entity_name is None:
+        info = companies_info()
+        titles = info.loc[info["cik_str"] == cik, "title"]
+        entity_name = titles.iloc[0] if len(titles) else "Company {}".format(cik)
+
+    rng = np.random.default_rng(cik)
+
+    #Which of a larger pool of tags this company reports - some overlap between companies, some not
+    pool = max(labels_per_company * 3, 10)
+    own_tags = np.sort(rng.choice(pool, size = max(labels_per_company - len(common_tags), 0), replace = False))
+
+    tags = common_tags + [("Concept{:04d}".format(t), "Concept {:04d}".format(t)) for t in own_tags]
+
+    quarter_ends = {1: "03-31", 2: "06-30", 3: "09-30", 4: "12-31"}
+    quarter_starts = {1: "01-01", 2: "04-01", 3: "07-01", 4: "10-01"}
+
+    us_gaap = {}
+
+    for t, (tag, label) in enumerate(tags):
+
+        #Balance sheet items are instants, the rest durations
+        instant = (t < len(common_tags)) or (zlib.crc32(tag.encode()) % 2 == 0)
+
+        level = rng.lognormal(18, 2)
+        growth = rng.normal(0.01, 0.02)
+
+        facts = []
+
+        for year in range(first_year, last_year + 1):
+
+            for quarter in (1, 2, 3, 4):
+
+                period = (year - first_year) * 4 + quarter
+                value = float(round(level * (1 + growth) ** period * rng.lognormal(0, 0.05)))
+
+                annual = quarter == 4
+
+                form = "10-K" if annual else "10-Q"
+                filed_year, filed_month = (year + 1, 2) if annual else (year, quarter * 3 + 1)
+                filed = "{}-{:02d}-{:02d}".format(filed_year, filed_month, 1 + (cik % 27))
+                accn = "{:010d}-{:02d}-{:06d}".format(cik, filed_year % 100, period)
+
+                fact = {"end": "{}-{}".format(year, quarter_ends[quarter]),
+                        "val": value,
+                        "accn": accn,
+                        "fy": year,
+                        "fp": "FY" if annual else "Q{}".format(quarter),
+                        "form": form,
+                        "filed": filed}
+
+                if instant:
+                    fact["frame"] = "CY{}Q{}I".format(year, quarter)
+                else:
+                    fact["start"] = "{}-{}".format(year, "01-01" if annual else quarter_starts[quarter])
+                    fact["frame"] = "CY{}".format(year) if annual else "CY{}Q{}".format(year, quarter)
+
+                facts.append(fact)
+
+                #Last year's figure, repeated in this year's filing for comparison - no frame
+                if year > first_year:
+
+                    comparative = dict(facts[-5])
+                    comparative.pop("frame", None)
+                    comparative.update({"accn": accn, "fy": year, "form": form, "filed": filed})
+
+                    facts.append(comparative)
+
+        us_gaap[tag] = {"label": label,
+                        "description": "{} as reported by the company.".format(label),
+                        "units": {"USD": facts}}
+
+    for tag, label in tags[len(common_tags):]:
+
+        if zlib.crc32(tag.encode()) % 1000 >= restated_share * 1000:
+            continue
+
+        switch_year = first_year + 2 + zlib.crc32(label.encode()) % max(last_year - first_year - 2, 1)
+
+        facts = us_gaap[tag]["units"]["USD"]
+
+        revised = []
+
+        for fact in facts:
+
+            year = int(fact["end"][:4])
+
+            if year < switch_year - 2:
+                continue
+
+            fact = dict(fact)
+
+            #Filed again a year later, a bit different
+            if year < switch_year:
+                fact["val"] = float(round(fact["val"] * rng.lognormal(0, 0.02)))
+                fact["filed"] = str(int(fact["filed"][:4]) + 1) + fact["filed"][4:]
+
+            revised.append(fact)
+
+        us_gaap[tag]["units"]["USD"] = [fact for fact in facts if int(fact["end"][:4]) < switch_year]
+
+        us_gaap[tag + "Revised"] = {"label": label,
+                                    "description": us_gaap[tag]["description"],
+                                    "units": {"USD": revised}}
+
+    return {"cik": cik, "entityName": entity_name, "facts": {"us-gaap": us_gaap}}
+
+
+def company_concept(cik, taxonomy, tag, labels_per_company = 150):
+
+    '''The companyconcept JSON of a company, or None if the company does not report that tag'''
+
+    facts = company_facts(cik, labels_per_company = labels_per_company)
+
+    concept = facts["facts"].get(taxonomy, {}).get(tag)
+
+    if concept is None:
+        return None
+
+    return {"cik": facts["cik"], "taxonomy": taxonomy, "tag": tag,
+            "label": concept["label"], "description": concept["description"],
+            "entityName": facts["entityName"], "units": concept["units"]}
+
+
+def company_facts_to_df(response_content):
+
+    '''
+    The DataFrame secdata's fetch_facts builds out of one companyfacts JSON
+    (same columns, one row per fact), without its row-by-row appends.
+    '''
+
+    frames = []
+
+    for principles, facts_of_principles in response_content["facts"].items():
+
+        for fact in facts_of_principles.values():
+
+            unit, values = next(iter(fact["units"].items()))
+
+            facts_df = pd.DataFrame(values)
+            facts_df["Description"] = fact["description"]
+            facts_df["Label"] = fact["label"]
+            facts_df["Unit_of_Measurement"] = unit
+            facts_df["Underlying_Principles"] = principles
+
+            frames.append(facts_df)
+
+    all_facts_df = pd.concat(frames)
+
+    all_facts_df["cik"] = response_content["cik"]
+    all_facts_df["Entity"] = response_content["entityName"]
+
+    return all_facts_df
+
+
+class FakeResponse:
+
+    '''Just as much of a requests.Response as the app uses'''
+
+    def __init__(self, status_code, content = None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {}
+        self._content = content
+
+    def json(self):
+        return self._content
+
+
+class FakeSession:
+
+    '''
+    Stands in for the requests.Session the app attaches to each downloader,
+    answering the SEC urls it asks for out of this module.
+    '''
+
+    companyconcept_path = re.compile(r"/api/xbrl/companyconcept/CIK(\d{10})/([^/]+)/([^/]+)\.json$")
+    companyfacts_path = re.compile(r"/api/xbrl/companyfacts/CIK(\d{10})\.json$")
+
+    def __init__(self, downloader):
+        self.downloader = downloader
+        self.headers = {}
+
+    def get(self, url, **kwargs):
+
+        time.sleep(self.downloader.latency)
+
+        if url.endswith("/files/company_tickers.json"):
+            return FakeResponse(200, company_tickers())
+
+        match = self.companyconcept_path.search(url)
+        if match:
+            concept = company_concept(int(match.group(1)), match.group(2), match.group(3), self.downloader.labels_per_company)
+            return FakeResponse(404) if concept is None else FakeResponse(200, concept)
+
+        match = self.companyfacts_path.search(url)
+        if match:
+            payload = company_facts if self.downloader.cache_payloads else company_facts.__wrapped__
+            return FakeResponse(200, payload(int(match.group(1)), labels_per_company = self.downloader.labels_per_company))
+
+        return FakeResponse(404)
+
+    def close(self):
+        pass
+
+
+class FakeSecFactsDownloader:
+
+    '''
+    Same interface as secdata.SecFactsDownloader, served from company_facts().
+
+    Parameters
+    ----------
+    user_email : str
+    latency : float
+        Seconds each (fake) request to the SEC takes
+    labels_per_company : int
+        See company_facts()
+    '''
+
+    #Class level, so that the app's own "SecFactsDownloader(credentials)" picks them up too
+    latency = float(os.environ.get("FAKE_EDGAR_LATENCY", 0.0))
+    labels_per_company = int(os.environ.get("FAKE_EDGAR_LABELS", 150))
+
+    #Generate each payload anew, like the SEC sending it, instead of keeping the last ones around
+    cache_payloads = True
+
+    def __init__(self, user_email, latency = None, labels_per_company = None):
+
+        self.headers = {'User-Agent': user_email}
+        self._session = FakeSession(self)
+
+        if latency is not None:
+            self.latency = latency
+
+        if labels_per_company is not None:
+            self.labels_per_company = labels_per_company
+
+    @property
+    def session(self):
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        #Whatever session the app attaches, requests are still answered here
+        pass
+
+    def fetch_companies_info(self, return_dataframe = False, file_if_info_already_downloaded = "companiesinfo.csv"):
+
+        self.sec_companies_info = companies_info()
+
+        if return_dataframe:
+            return self.sec_companies_info
+
+    def fetch_facts(self, ciks):
+
+        frames = []
+
+        for cik in ciks:
+
+            time.sleep(self.latency)
+
+            payload = company_facts if self.cache_payloads else company_facts.__wrapped__
+
+            frames.append(company_facts_to_df(payload(cik, labels_per_company = self.labels_per_company)))
+
+        return pd.concat(frames)
+
+
+def install():
+
+    '''
+    Makes "from secdata import SecFactsDownloader" give FakeSecFactsDownloader
+    - and points the app's fact store (see app/fact_store.py) to a directory of its own, unless one is given,
+    so that fake companies never end up among the real ones
+    '''
+
+    os.environ.setdefault("SECOMPAIR_WARM_CACHE", tempfile.mkdtemp(prefix = "fake_edgar_facts"))
+
+    fake_secdata = types.ModuleType("secdata")
+    fake_secdata.SecFactsDownloader = FakeSecFactsDownloader
+
+    sys.modules["secdata"] = fake_secdata
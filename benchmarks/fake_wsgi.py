@@ -0,0 +1,12 @@
+'''
+The app, backed by the fake EDGAR - for running the load test against a real gunicorn box:
+
+    gunicorn --workers 4 --threads 4 benchmarks.fake_wsgi:server
+    python -m benchmarks.load_test --url http://127.0.0.1:8000
+'''
+
+from benchmarks.fake_edgar import install
+
+install()
+
+from wsgi import server  # noqa: E402
@@ -0,0 +1,198 @@
+'''
+How long "Load Data" takes, from the click to a populated Store, when the companies come from EDGAR
+(with progressive loading: to the first chart, and to the complete data).
+
+The app's own fetch path runs unchanged - app.downloaders.fetch_company_facts (get_json, retrying when throttled)
+through the pooled, rate-limited session of the user agent's downloader (see DownloaderPool), the starting features
+through progressive.fetch_priority_facts, then preprocess_df and the Store encoding - secdata's fetch_facts is never called.
+Only every request meant for the SEC is sent to a local edgar_simulator instead.
+
+The companies fetched are written to a temporary directory (the app's fact store), emptied after every load.
+A load counts as failed when it errors, or ends with fewer rows than the simulator's companies preprocess to
+(e.g. companies left out after the SEC kept answering errors).
+
+    python -m benchmarks.fetch_benchmark --companies 1,10,50 --latency 0.1 --repeat 3
+'''
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from benchmarks.edgar_simulator import SimulatorSettings, start_simulator
+from benchmarks.fake_edgar import companies_info, company_facts, company_facts_to_df
+from benchmarks.load_test import load_until_complete
+
+
+sec_hosts = ("https://data.sec.gov", "https://www.sec.gov")
+
+
+@contextmanager
+def sec_redirected_to(base_url):
+
+    '''Every request (through the requests library) to an SEC host goes to base_url instead'''
+
+    import requests
+
+    original_request = requests.sessions.Session.request
+
+    def request(self, method, url, *args, **kwargs):
+
+        for host in sec_hosts:
+            if url.startswith(host):
+                url = base_url + url[len(host):]
+
+        return original_request(self, method, url, *args, **kwargs)
+
+    requests.sessions.Session.request = request
+
+    try:
+        yield
+    finally:
+        requests.sessions.Session.request = original_request
+
+
+def forget_companies(directory):
+
+    '''Deletes the companies the app has written to its fact store, so that the next load downloads them again'''
+
+    from app.warm_cache import cache_file_pattern
+
+    for entry in os.scandir(directory):
+        if cache_file_pattern.match(entry.name):
+            os.remove(entry.path)
+
+
+def expected_rows(ciks, labels_per_company, rows_of):
+
+    '''The rows the companies of ciks preprocess to, as served by the simulator (rows_of: CIK -> rows, filled in as needed)'''
+
+    from app.main import preprocess_df
+
+    for cik in ciks:
+        if cik not in rows_of:
+            rows_of[cik] = len(preprocess_df(company_facts_to_df(company_facts(cik, labels_per_company = labels_per_company))))
+
+    return sum(rows_of[cik] for cik in ciks)
+
+
+def time_load(client, companies):
+
+    '''
+    Seconds from posting the Load Data click to the first Store content (the first chart)
+    and to the complete one (same, unless loading progressively), and the rows loaded in the end.
+    '''
+
+    started = time.perf_counter()
+    first_response = []
+
+    def call(name, body):
+
+        response = client.post("/_dash-update-component", json = body)
+
+        if response.status_code == 204:
+            return None
+
+        if response.status_code != 200:
+            raise RuntimeError("{} answered {}".format(name, response.status_code))
+
+        response = json.loads(response.data)["response"]
+
+        if not first_response and "memory-output" in response:
+            first_response.append(time.perf_counter() - started)
+
+        return response
+
+    try:
+        _, last = load_until_complete(call, companies, poll_interval = 0.1)
+    except RuntimeError as e:
+        print(e)
+        return None, None, None
+
+    if "dataset-manifest" not in last:
+        return None, None, None
+
+    return first_response[0], time.perf_counter() - started, last["dataset-manifest"]["data"]["rows"]
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "End-to-end load time of companies from a simulated EDGAR")
+    parser.add_argument("--companies", default = "1,10,50", help = "Comma separated numbers of companies per load")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--latency", type = float, default = 0.1, help = "Seconds the simulated SEC takes per request")
+    parser.add_argument("--jitter", type = float, default = 0.05)
+    parser.add_argument("--labels", type = int, default = 150, help = "Labels per company - the payload size")
+    parser.add_argument("--error-rate", type = float, default = 0.0)
+    parser.add_argument("--rate-limit", type = int, default = 10)
+    args = parser.parse_args(argv)
+
+    settings = SimulatorSettings(args.latency, args.jitter, args.labels, args.error_rate, args.rate_limit)
+
+    simulator, base_url = start_simulator(settings)
+
+    #Nothing warmed up at boot, nor left on disk from a previous run
+    cache = tempfile.mkdtemp(prefix = "fetch_benchmark")
+    os.environ["SECOMPAIR_WARM_CACHE"] = cache
+    os.environ["SECOMPAIR_WATCHLIST"] = os.devnull
+
+    with sec_redirected_to(base_url):
+
+        #Imported here, so that anything the app downloads while being imported goes to the simulator too
+        from wsgi import server
+        from app.downloaders import companies_index
+
+        client = server.test_client()
+
+        titles = companies_info().drop_duplicates("cik_str")["title"].drop_duplicates().tolist()
+
+        rows_of = {}
+
+        print("{:>10}{:>10}{:>14}{:>14}{:>10}{:>11}".format("companies", "rows", "first chart s", "complete s", "failed", "throttled"))
+
+        for no_of_companies in [int(c) for c in args.companies.split(",")]:
+
+            first_timings, complete_timings = [], []
+            failed = 0
+            rows = None
+            throttled_before = settings.throttled
+
+            for r in range(args.repeat):
+
+                #Different companies each time, so that nothing is served from any cache
+                start = (r * no_of_companies) % max(len(titles) - no_of_companies, 1)
+
+                companies = titles[start:start + no_of_companies]
+
+                first, complete, rows_ = time_load(client, companies)
+
+                forget_companies(cache)
+
+                if rows_ is None:
+                    failed += 1
+
+                elif rows_ < expected_rows(companies_index().ciks_of(companies), args.labels, rows_of):
+                    print("Loaded", rows_, "rows of", expected_rows(companies_index().ciks_of(companies), args.labels, rows_of))
+                    failed += 1
+                else:
+                    first_timings.append(first)
+                    complete_timings.append(complete)
+                    rows = rows_
+
+            print("{:>10}{:>10}{:>14.2f}{:>14.2f}{:>10}{:>11}".format(
+                no_of_companies, rows if rows is not None else "-",
+                statistics.median(first_timings) if first_timings else float("nan"),
+                statistics.median(complete_timings) if complete_timings else float("nan"),
+                failed, settings.throttled - throttled_before))
+
+    simulator.shutdown()
+
+    shutil.rmtree(cache, ignore_errors = True)
+
+
+if __name__ == "__main__":
+    main()
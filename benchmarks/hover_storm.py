@@ -0,0 +1,171 @@
+'''
+A replayed hover storm - the mouse swept over the points of the scatter again and again - with and without request coalescing.
+
+The app runs the way it is deployed - gunicorn with the repo's gunicorn.conf.py (preloaded, --workers threaded workers), on the fake EDGAR -
+and the CPU time of the master and all of its workers is read from /proc (Linux).
+After a load, the storm replays a hover event every --interval seconds, each sending both time series requests
+through a browser's pool of --connections connections (each request on a connection of its own, so that they are spread over the workers),
+and measures:
+    - the server's CPU seconds spent on the storm
+    - how many requests were answered with a figure (200) and how many were dropped as superseded (204)
+    - how long after the last hover both time series of the last point were in
+
+    python -m benchmarks.hover_storm --companies 20 --hovers 60 --interval 0.02 --workers 4
+'''
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_edgar import companies_info
+from benchmarks.load_test import dash_request, load_until_complete, time_series_request
+from benchmarks.warm_boot_benchmark import children_of, root_directory
+
+
+def server(coalescing = "on"):
+
+    '''The app on the fake EDGAR, for gunicorn - e.g. "benchmarks.hover_storm:server('off')"'''
+
+    from benchmarks.fake_wsgi import server
+    import app.main
+
+    app.main.coalesce_requests = coalescing == "on"
+
+    return server
+
+
+def cpu_seconds(pid):
+    '''utime + stime of a process and its children (the gunicorn workers), from /proc/<pid>/stat'''
+
+    seconds = 0
+
+    for process in [pid] + children_of(pid):
+
+        with open("/proc/{}/stat".format(process)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+
+        seconds += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    return seconds
+
+
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def post(url, body):
+
+    '''(status, response) of a callback request'''
+
+    request = urllib.request.Request(url, data = json.dumps(body).encode("utf-8"), headers = {"Content-Type": "application/json"})
+
+    with urllib.request.urlopen(request) as response:
+        return response.status, (json.loads(response.read())["response"] if response.status == 200 else None)
+
+
+def storm(coalesce, companies, hovers, interval, connections, workers):
+
+    port = free_port()
+    url = "http://127.0.0.1:{}/_dash-update-component".format(port)
+
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "--config", os.path.join(root_directory, "gunicorn.conf.py"),
+                                "--workers", str(workers), "--bind", "127.0.0.1:{}".format(port),
+                                "benchmarks.hover_storm:server('{}')".format("on" if coalesce else "off")],
+                               cwd = root_directory, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+    try:
+
+        for _ in range(600):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout = 1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        _, response = load_until_complete(lambda name, body: post(url, body)[1], companies, poll_interval = 0.2)
+
+        data = response["memory-output"]["data"]
+        manifest = response["dataset-manifest"]["data"]
+        colors = post(url, dash_request(["random_colors_assigned.data"], [("dataset-manifest.data", manifest)], changed = ["dataset-manifest.data"]))[1]["random_colors_assigned"]["data"]
+
+        x, y = manifest["common_labels"][0], manifest["common_labels"][-1]
+        entities = manifest["entities"]
+
+        #Sweeps over every point, another company clicked on before each - so that no two hovers ask for the same figures
+        points = [(entities[h % len(entities)], None if h < len(entities) else entities[h // len(entities) - 1]) for h in range(hovers)]
+        session_id = uuid.uuid4().hex
+
+        statuses = Counter()
+        answered = {}
+        lock = threading.Lock()
+
+        def hover(h, axis, label):
+
+            hovered, clicked = points[h]
+
+            status, _ = post(url, time_series_request(axis, label, hovered, clicked, data, colors, session_id))
+
+            with lock:
+                statuses[status] += 1
+                answered[(h, axis)] = time.perf_counter()
+
+        cpu_before = cpu_seconds(process.pid)
+
+        with ThreadPoolExecutor(max_workers = connections) as browser:
+
+            started = time.perf_counter()
+
+            for h in range(hovers):
+
+                time.sleep(max(started + h * interval - time.perf_counter(), 0))
+
+                browser.submit(hover, h, "x", x)
+                browser.submit(hover, h, "y", y)
+
+            last_hover = time.perf_counter()
+
+        last_point_in = max(answered[(hovers - 1, "x")], answered[(hovers - 1, "y")]) - last_hover
+
+        return {"cpu_s": cpu_seconds(process.pid) - cpu_before, "figures": statuses[200], "dropped": statuses[204],
+                "last_point_s": last_point_in, "storm_s": time.perf_counter() - started}
+
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "CPU spent on a hover storm, with and without request coalescing")
+    parser.add_argument("--companies", type = int, default = 20)
+    parser.add_argument("--hovers", type = int, default = 60, help = "Hover events in the storm")
+    parser.add_argument("--interval", type = float, default = 0.02, help = "Seconds between hover events")
+    parser.add_argument("--connections", type = int, default = 6, help = "Requests the browser has in flight at most")
+    parser.add_argument("--workers", type = int, default = 4, help = "gunicorn workers (each with the threads gunicorn.conf.py gives it)")
+    args = parser.parse_args(argv)
+
+    companies = companies_info()["title"].drop_duplicates().tolist()[:args.companies]
+
+    print("{:>12}{:>10}{:>9}{:>9}{:>15}{:>10}".format("coalescing", "CPU s", "figures", "dropped", "last point s", "storm s"))
+
+    for coalesce in (False, True):
+
+        result = storm(coalesce, companies, args.hovers, args.interval, args.connections, args.workers)
+
+        print("{:>12}{cpu_s:>10.2f}{figures:>9}{dropped:>9}{last_point_s:>15.2f}{storm_s:>10.2f}".format("on" if coalesce else "off", **result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+'''
+End-to-end load test of the app's Dash callbacks.
+
+Simulated analysts replay what a browser sends to /_dash-update-component:
+    1. load   - Load Data for a number of companies (from the fake EDGAR), polling a progressive load until complete
+    2. setup  - year slider, feature dropdowns and colors, out of the manifest
+    3. axes   - a few X/Y feature pairs on the main scatter
+    4. slide  - dragging the year slider
+    5. hover  - a storm of hovers over the scatter, updating both time series
+
+For every concurrency level and dataset size asked for, it reports
+throughput and p50/p95/p99 latency per callback.
+
+Against an app started here (in-process, threaded werkzeug server, fake EDGAR):
+
+    python -m benchmarks.load_test --concurrency 1,4,16 --companies 5,20
+
+Against a real gunicorn box running benchmarks.fake_wsgi:server:
+
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --concurrency 1,8,32
+'''
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_edgar import companies_info
+
+
+def prop(component_property, value = None):
+    '''A single {"id", "property", "value"} of a Dash request'''
+
+    component_id, property_name = component_property.rsplit(".", 1)
+
+    return {"id": component_id, "property": property_name, "value": value}
+
+
+def dash_request(outputs, inputs, state = (), changed = ()):
+
+    '''
+    The body the Dash renderer POSTs to /_dash-update-component.
+
+    Parameters
+    ----------
+    outputs : list of "component-id.property"
+    inputs, state : list of ("component-id.property", value)
+    changed : list of "component-id.property" that triggered the call
+    '''
+
+    outputs_ = [{"id": o.rsplit(".", 1)[0], "property": o.rsplit(".", 1)[1]} for o in outputs]
+
+    return {"output": outputs[0] if len(outputs) == 1 else ".." + "...".join(outputs) + "..",
+            "outputs": outputs_[0] if len(outputs_) == 1 else outputs_,
+            "inputs": [prop(name, value) for name, value in inputs],
+            "state": [prop(name, value) for name, value in state],
+            "changedPropIds": list(changed)}
+
+
+load_outputs = ["memory-output.data", "dataset-manifest.data", "backfill-job.data", "backfill-poll.disabled", "load-failures.children"]
+
+
+def load_request(companies, user_agent = "load_test@example.com"):
+    '''What the browser sends when Load Data is clicked'''
+
+    return dash_request(
+        load_outputs,
+        [("load-data.n_clicks", 1),
+         ("backfill-poll.n_intervals", 0),
+         ("choose-companies.value", companies),
+         ("user-credentials.value", user_agent),
+         ("upload-data.contents", None)],
+        [("upload-data.filename", None),
+         ("backfill-job.data", None)],
+        ["load-data.n_clicks"])
+
+
+def poll_request(companies, backfill, n_intervals, user_agent = "load_test@example.com"):
+    '''What the browser sends when it asks whether more of a progressive load has arrived'''
+
+    return dash_request(
+        load_outputs,
+        [("load-data.n_clicks", 1),
+         ("backfill-poll.n_intervals", n_intervals),
+         ("choose-companies.value", companies),
+         ("user-credentials.value", user_agent),
+         ("upload-data.contents", None)],
+        [("upload-data.filename", None),
+         ("backfill-job.data", backfill)],
+        ["backfill-poll.n_intervals"])
+
+
+def load_until_complete(call, companies, poll_interval = 0.5):
+
+    '''
+    Clicks Load Data, then (when loading progressively) polls until all the data has arrived.
+
+    Parameters
+    ----------
+    call : function(name, body) returning the "response" part of the reply, or None for no update
+
+    Returns
+    -------
+    (first response, last response) - the Store contents of each can be in either
+    '''
+
+    first = latest = call("loadData", load_request(companies))
+
+    backfill = first.get("backfill-job", {}).get("data")
+    done = first.get("backfill-poll", {}).get("disabled", True)
+
+    n_intervals = 0
+
+    while not done:
+
+        time.sleep(poll_interval)
+        n_intervals += 1
+
+        response = call("loadData (backfill poll)", poll_request(companies, backfill, n_intervals))
+
+        if response is None:
+            continue
+
+        if "memory-output" in response:
+            latest = dict(latest, **response)
+
+        backfill = response.get("backfill-job", {}).get("data", backfill)
+        done = response.get("backfill-poll", {}).get("disabled", done)
+
+    return first, latest
+
+
+class DashClient:
+
+    '''Posts callback requests to an app and keeps the latency of each, per callback'''
+
+    def __init__(self, base_url, latencies, lock):
+
+        self.url = base_url.rstrip("/") + "/_dash-update-component"
+        self.latencies = latencies
+        self.lock = lock
+
+    def call(self, name, body):
+
+        request = urllib.request.Request(self.url,
+                                         data = json.dumps(body).encode("utf-8"),
+                                         headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+
+        started = time.perf_counter()
+
+        with urllib.request.urlopen(request) as response:
+
+            status = response.status
+            raw = response.read()
+
+            if response.headers.get("Content-Encoding") == "gzip":
+                raw = gzip.decompress(raw)
+
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.latencies[name].append(elapsed)
+
+        #PreventUpdate
+        if status == 204:
+            return None
+
+        return json.loads(raw)["response"]
+
+
+def scatter_request(x, y, years, data, colors, changed, session_id = None):
+    '''What the browser sends when a feature, a scale or the year slider changes'''
+
+    return dash_request(
+        ["crossfilter-indicator-scatter.figure"],
+        [("crossfilter-xaxis-column.value", x),
+         ("crossfilter-yaxis-column.value", y),
+         ("crossfilter-xaxis-type.value", "Linear"),
+         ("crossfilter-yaxis-type.value", "Linear"),
+         ("crossfilter-year--slider.value", years),
+         ("memory-output.data", data),
+         ("random_colors_assigned.data", colors)],
+        [("session-id.data", session_id)],
+        [changed])
+
+
+def time_series_request(axis, label, hovered, clicked, data, colors, session_id = None):
+    '''What the browser sends for the x or y time series when the mouse moves over a point of the scatter'''
+
+    return dash_request(
+        ["{}-time-series.figure".format(axis)],
+        [("crossfilter-indicator-scatter.hoverData", {"points": [{"hovertext": hovered}]}),
+         ("crossfilter-indicator-scatter.clickData", None if clicked is None else {"points": [{"hovertext": clicked}]}),
+         ("crossfilter-{}axis-column.value".format(axis), label),
+         ("crossfilter-{}axis-type.value".format(axis), "Linear"),
+         ("memory-output.data", data),
+         ("random_colors_assigned.data", colors)],
+        [("session-id.data", session_id)],
+        ["crossfilter-indicator-scatter.hoverData"])
+
+
+def analyst_session(client, companies, seed, hovers = 40, slides = 10, pairs = 5):
+
+    '''One analyst, from loading the data to hovering all over the scatter'''
+
+    rng = random.Random(seed)
+
+    #Progressive loads are polled until complete - the analyst then works on the full data
+    _, response = load_until_complete(client.call, companies)
+
+    data = response["memory-output"]["data"]
+    manifest = response["dataset-manifest"]["data"]
+
+    client.call("updateRangeSlider", dash_request(
+        ["crossfilter-year--slider.min", "crossfilter-year--slider.max", "crossfilter-year--slider.value", "crossfilter-year--slider.marks"],
+        [("dataset-manifest.data", manifest)], changed = ["dataset-manifest.data"]))
+
+    for name, output in (("extract_available_features_for_x", "crossfilter-xaxis-column.options"),
+                         ("extract_available_features_for_y", "crossfilter-yaxis-column.options")):
+        client.call(name, dash_request([output], [("dataset-manifest.data", manifest)], changed = ["dataset-manifest.data"]))
+
+    colors = client.call("random_colors", dash_request(
+        ["random_colors_assigned.data"], [("dataset-manifest.data", manifest)], changed = ["dataset-manifest.data"]))["random_colors_assigned"]["data"]
+
+    labels = manifest["common_labels"]
+    entities = manifest["entities"]
+    low, high = manifest["min_year"], manifest["max_year"]
+
+    #Like a browser tab, every session has its own id
+    session_id = uuid.UUID(int = rng.getrandbits(128)).hex
+
+    def scatter(x, y, years, changed):
+        client.call("update_graph", scatter_request(x, y, years, data, colors, changed, session_id))
+
+    def time_series(name, axis, label, hovered, clicked):
+        client.call(name, time_series_request(axis, label, hovered, clicked, data, colors, session_id))
+
+    x, y = "Assets", "Assets"
+
+    #Picking features
+    for _ in range(pairs):
+        x, y = rng.choice(labels), rng.choice(labels)
+        scatter(x, y, [low, high], "crossfilter-xaxis-column.value")
+
+    #Dragging the slider
+    for _ in range(slides):
+        start = rng.randint(low, high)
+        scatter(x, y, [start, rng.randint(start, high)], "crossfilter-year--slider.value")
+
+    #Hovering all over the scatter
+    clicked = rng.choice(entities)
+    for _ in range(hovers):
+        hovered = rng.choice(entities)
+        time_series("update_x_timeseries", "x", x, hovered, clicked)
+        time_series("update_y_timeseries", "y", y, hovered, clicked)
+
+
+def percentile(sorted_values, q):
+    '''Nearest-rank percentile of an already sorted list'''
+
+    if not sorted_values:
+        return float("nan")
+
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def run(base_url, concurrency, no_of_companies, sessions_per_worker, seed = 0, **session_kwargs):
+
+    '''Runs concurrency analysts at once, each going through sessions_per_worker sessions'''
+
+    titles = companies_info()["title"].drop_duplicates().tolist()
+
+    latencies = defaultdict(list)
+    lock = threading.Lock()
+
+    def worker(w):
+
+        client = DashClient(base_url, latencies, lock)
+
+        #Every analyst picks their own companies, the same ones on every run
+        rng = random.Random(seed * 1000 + w)
+
+        for s in range(sessions_per_worker):
+            analyst_session(client, rng.sample(titles, no_of_companies), seed = rng.random(), **session_kwargs)
+
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers = concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+
+    wall = time.perf_counter() - started
+
+    report = {}
+
+    for name, values in latencies.items():
+
+        values = sorted(values)
+
+        report[name] = {"requests": len(values),
+                        "throughput": len(values) / wall,
+                        "p50_ms": percentile(values, 50) * 1000,
+                        "p95_ms": percentile(values, 95) * 1000,
+                        "p99_ms": percentile(values, 99) * 1000}
+
+    return wall, report
+
+
+def print_report(concurrency, no_of_companies, wall, report):
+
+    total = sum(r["requests"] for r in report.values())
+
+    print("\nconcurrency {} | companies {} | {} requests in {:.1f}s ({:.1f} req/s)".format(concurrency, no_of_companies, total, wall, total / wall))
+    print("{:<34}{:>9}{:>10}{:>10}{:>10}{:>10}".format("callback", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+
+    for name, r in sorted(report.items()):
+        print("{:<34}{:>9}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(name, r["requests"], r["throughput"], r["p50_ms"], r["p95_ms"], r["p99_ms"]))
+
+
+def serve_in_process(port = 0):
+
+    '''Starts the app (on the fake EDGAR) in a threaded werkzeug server and returns its base url'''
+
+    import logging
+
+    from werkzeug.serving import make_server
+
+    from benchmarks.fake_wsgi import server
+
+    #One line per request would drown the report
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    http_server = make_server("127.0.0.1", port, server, threaded = True)
+
+    threading.Thread(target = http_server.serve_forever, daemon = True).start()
+
+    return "http://127.0.0.1:{}".format(http_server.server_port)
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Load test of the app's Dash callbacks")
+    parser.add_argument("--url", help = "Base url of an app already running (on benchmarks.fake_wsgi:server). Starts one in-process if not given.")
+    parser.add_argument("--concurrency", default = "1,4,16", help = "Comma separated numbers of concurrent analysts")
+    parser.add_argument("--companies", default = "5,20", help = "Comma separated numbers of companies each analyst loads")
+    parser.add_argument("--sessions", type = int, default = 2, help = "Sessions each analyst goes through")
+    parser.add_argument("--hovers", type = int, default = 40)
+    parser.add_argument("--slides", type = int, default = 10)
+    parser.add_argument("--pairs", type = int, default = 5)
+    parser.add_argument("--json", help = "Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    base_url = args.url or serve_in_process()
+
+    results = []
+
+    for no_of_companies in [int(c) for c in args.companies.split(",")]:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+
+            wall, report = run(base_url, concurrency, no_of_companies, args.sessions,
+                               hovers = args.hovers, slides = args.slides, pairs = args.pairs)
+
+            print_report(concurrency, no_of_companies, wall, report)
+
+            results.append({"concurrency": concurrency, "companies": no_of_companies, "seconds": wall, "callbacks": report})
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+'''
+Peak memory of a worker, in memory vs out of core, as the dataset grows.
+
+Each size is measured in two fresh processes:
+    - one loading N fake companies through main.to_stores, handed over a company at a time the way loadData does,
+      which writes what memory-output gets to a file
+    - one answering the figure callbacks (the scatter and a time series) out of that, like any other worker would
+
+In memory, the dataset travels in the Store (store_format) and is decoded whole for each figure;
+out of core, it is written a company at a time to disk (partitioned_facts) and only the rows a figure needs are read back.
+
+    python -m benchmarks.out_of_core_benchmark --companies 50,200,800 --labels 150
+'''
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def peak_rss_mb():
+    '''Peak resident memory of this process so far (ru_maxrss is in KB on Linux)'''
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def facts_of_companies(no_of_companies, labels_per_company, preprocess_df):
+
+    '''
+    Preprocessed facts, a company at a time - nothing kept around between companies.
+
+    Generating every company's JSON would take longer than everything measured,
+    so the companies are copies of one, under their own names and with their own values.
+    '''
+
+    import numpy as np
+
+    from benchmarks.fake_edgar import company_facts, company_facts_to_df
+
+    template = preprocess_df(company_facts_to_df(company_facts(1, labels_per_company = labels_per_company)))
+
+    rng = np.random.default_rng(0)
+
+    for cik in range(1, no_of_companies + 1):
+        yield template.assign(Entity = "COMPANY {:07d} INC".format(cik), Value = template["Value"] * rng.lognormal(0, 1))
+
+
+def load(mode, no_of_companies, labels_per_company, workdir):
+
+    from benchmarks.fake_edgar import install
+    install()
+
+    from app import main
+    from app.partitioned_facts import PartitionedFactsDirectory
+
+    baseline = peak_rss_mb()
+
+    started = time.perf_counter()
+
+    main.out_of_core = mode == "out_of_core"
+    main.partitioned_facts = PartitionedFactsDirectory(os.path.join(workdir, "facts"))
+
+    stored, manifest = main.to_stores(facts_of_companies(no_of_companies, labels_per_company, main.preprocess_df), None)
+
+    seconds = time.perf_counter() - started
+
+    with open(os.path.join(workdir, "stores.json"), "w") as f:
+        json.dump({"memory-output": stored, "dataset-manifest": manifest}, f)
+
+    return {"rows": manifest["rows"], "store_kb": len(json.dumps(stored)) / 1024,
+            "load_rss_mb": peak_rss_mb() - baseline, "load_s": seconds}
+
+
+def figures(workdir):
+
+    from benchmarks.fake_edgar import install
+    install()
+
+    from app import main
+    from app.figures import scatter_of_averages, time_series_of_entities
+    from app.partitioned_facts import PartitionedFactsDirectory
+
+    main.partitioned_facts = PartitionedFactsDirectory(os.path.join(workdir, "facts"))
+
+    baseline = peak_rss_mb()
+
+    #What reaches a callback: the Store contents, as JSON
+    with open(os.path.join(workdir, "stores.json")) as f:
+        stores = json.load(f)
+
+    stored, manifest = stores["memory-output"], stores["dataset-manifest"]
+
+    labels = manifest["common_labels"]
+    x, y = labels[0], labels[len(labels) // 2]
+    years = [manifest["min_year"], manifest["max_year"]]
+    entity = manifest["entities"][0]
+
+    started = time.perf_counter()
+    scatter_of_averages(main.facts_of(stored, years = years, labels = [x, y]), x, y, "Linear", "Linear", years, manifest["colors"])
+    scatter_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    time_series_of_entities(main.facts_of(stored, labels = [x], entities = [entity]), entity, None, x, "Linear", manifest["colors"])
+    series_seconds = time.perf_counter() - started
+
+    return {"figures_rss_mb": peak_rss_mb() - baseline, "scatter_s": scatter_seconds, "time_series_s": series_seconds}
+
+
+def run_child(*args):
+
+    output = subprocess.run([sys.executable, "-m", "benchmarks.out_of_core_benchmark"] + [str(arg) for arg in args],
+                            check = True, capture_output = True, text = True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Peak memory in memory vs out of core")
+    parser.add_argument("--companies", default = "50,200,400", help = "Comma separated numbers of companies")
+    parser.add_argument("--labels", type = int, default = 150, help = "Labels per company")
+    parser.add_argument("--load", nargs = 3, metavar = ("MODE", "COMPANIES", "WORKDIR"), help = argparse.SUPPRESS)
+    parser.add_argument("--figures", metavar = "WORKDIR", help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.load:
+        print(json.dumps(load(args.load[0], int(args.load[1]), args.labels, args.load[2])))
+        return
+
+    if args.figures:
+        print(json.dumps(figures(args.figures)))
+        return
+
+    print("{:>12}{:>10}{:>10}{:>12}{:>14}{:>9}{:>17}{:>11}{:>15}".format(
+        "mode", "companies", "rows", "store KB", "load RSS MB", "load s", "figures RSS MB", "scatter s", "time series s"))
+
+    for no_of_companies in [int(c) for c in args.companies.split(",")]:
+        for mode in ("memory", "out_of_core"):
+
+            workdir = tempfile.mkdtemp(prefix = "out_of_core_benchmark-")
+
+            try:
+                result = dict(run_child("--labels", args.labels, "--load", mode, no_of_companies, workdir), **run_child("--figures", workdir))
+            finally:
+                shutil.rmtree(workdir, ignore_errors = True)
+
+            print("{:>12}{:>10}{rows:>10}{store_kb:>12.0f}{load_rss_mb:>14.0f}{load_s:>9.1f}{figures_rss_mb:>17.0f}{scatter_s:>11.2f}{time_series_s:>15.3f}".format(
+                mode, no_of_companies, **result))
+
+
+if __name__ == "__main__":
+    main()
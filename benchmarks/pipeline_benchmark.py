@@ -0,0 +1,82 @@
+'''
+Peak memory and time of downloading N companies: all at once, or through fetch_pipeline.
+
+Each run is a fresh process fetching from the fake EDGAR (payloads generated anew for every request):
+    - all_at_once: fetch_facts(ciks), then preprocess_df on the whole of it - the way loadData used to
+    - streaming: fetch_pipeline.fetch_preprocessed, a company at a time
+    - streaming xN: the same, with N companies in flight
+
+    python -m benchmarks.pipeline_benchmark --companies 10,40 --labels 300 --latency 0.1 --workers 4
+'''
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+
+def peak_rss_mb():
+    '''Peak resident memory of this process so far (ru_maxrss is in KB on Linux)'''
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def fetch(mode, no_of_companies, labels_per_company, latency, workers):
+
+    from benchmarks.fake_edgar import install, FakeSecFactsDownloader
+    install()
+
+    from app.main import preprocess_df
+    from app.fetch_pipeline import fetch_preprocessed
+
+    downloader = FakeSecFactsDownloader("pipeline_benchmark@example.com", latency = latency, labels_per_company = labels_per_company)
+    downloader.cache_payloads = False
+
+    ciks = list(range(1, no_of_companies + 1))
+
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+
+    if mode == "all_at_once":
+        facts = preprocess_df(downloader.fetch_facts(ciks))
+    else:
+        facts = fetch_preprocessed(downloader, ciks, preprocess_df, max_workers = workers)
+
+    return {"rows": len(facts), "seconds": time.perf_counter() - started, "peak_rss_mb": peak_rss_mb() - baseline}
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Downloading all companies at once vs a company at a time")
+    parser.add_argument("--companies", default = "10,40", help = "Comma separated numbers of companies")
+    parser.add_argument("--labels", type = int, default = 300, help = "Labels per company")
+    parser.add_argument("--latency", type = float, default = 0.1, help = "Seconds each request to the (fake) SEC takes")
+    parser.add_argument("--workers", type = int, default = 4, help = "Companies in flight for the last run")
+    parser.add_argument("--fetch", nargs = 3, metavar = ("MODE", "COMPANIES", "WORKERS"), help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.fetch:
+        print(json.dumps(fetch(args.fetch[0], int(args.fetch[1]), args.labels, args.latency, int(args.fetch[2]))))
+        return
+
+    print("{:>16}{:>11}{:>10}{:>15}{:>11}".format("mode", "companies", "rows", "peak RSS MB", "seconds"))
+
+    for no_of_companies in [int(c) for c in args.companies.split(",")]:
+        for mode, workers in (("all_at_once", 1), ("streaming", 1), ("streaming", args.workers)):
+
+            output = subprocess.run([sys.executable, "-m", "benchmarks.pipeline_benchmark",
+                                     "--labels", str(args.labels), "--latency", str(args.latency),
+                                     "--fetch", mode, str(no_of_companies), str(workers)],
+                                    check = True, capture_output = True, text = True).stdout
+
+            result = json.loads(output.strip().splitlines()[-1])
+
+            name = mode if workers == 1 else "{} x{}".format(mode, workers)
+
+            print("{:>16}{:>11}{rows:>10}{peak_rss_mb:>15.0f}{seconds:>11.1f}".format(name, no_of_companies, **result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+'''
+Ranking every X/Y label pair at once (app/screening.py), vs trying pairs one update_graph at a time.
+
+For N fake companies, preprocessed the way loadData does:
+    - the labels every company reports (what the dropdowns offer, and the app screens)
+    - every label reported by at least 3 of them (the fake companies share few labels, real ones share hundreds)
+are screened with screen_label_pairs, and a sample of pairs is drawn with scatter_of_averages -
+the work of one update_graph, without the round trip - to tell what going through all the pairs would take.
+
+    python -m benchmarks.screening_benchmark --companies 20 --labels 300
+'''
+
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from benchmarks.fake_edgar import install, company_facts, company_facts_to_df
+
+
+def best_of(runs, function, *args, **kwargs):
+
+    seconds = []
+
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds.append(time.perf_counter() - started)
+
+    return result, min(seconds)
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Seconds to rank every label pair, vs one scatter per pair")
+    parser.add_argument("--companies", type = int, default = 20)
+    parser.add_argument("--labels", type = int, default = 300, help = "Labels per company")
+    parser.add_argument("--sample", type = int, default = 20, help = "Pairs drawn one at a time, to time a single scatter")
+    args = parser.parse_args(argv)
+
+    install()
+
+    from app.main import preprocess_df
+    from app.fact_index import LabelIndex
+    from app.figures import scatter_of_averages
+    from app.manifest import colors_per_entity
+    from app.screening import screen_label_pairs
+
+    facts = pd.concat([preprocess_df(company_facts_to_df(company_facts(cik, labels_per_company = args.labels)))
+                       for cik in range(1, args.companies + 1)], ignore_index = True)
+
+    entities = sorted(facts["Entity"].unique())
+    colors = colors_per_entity(entities)
+    years = [int(facts["Year"].min()), int(facts["Year"].max())]
+
+    label_index = LabelIndex()
+    label_index.add(facts)
+
+    companies_per_label = facts.groupby("Label")["Entity"].nunique()
+
+    label_sets = {"common to all": label_index.common_labels(entities),
+                  "reported by 3+": companies_per_label.index[companies_per_label >= 3].tolist()}
+
+    print("{:>16}{:>8}{:>13}{:>13}{:>15}{:>21}".format("labels", "count", "pairs", "screening s", "scatter ms", "pair by pair s (est)"))
+
+    for name, labels in label_sets.items():
+
+        pairs, screening_seconds = best_of(3, screen_label_pairs, facts, labels = labels, years = years, top_n = 20)
+
+        no_of_pairs = len(labels) * (len(labels) - 1) // 2
+
+        rng = random.Random(0)
+        sample = [tuple(rng.sample(labels, 2)) for _ in range(min(args.sample, no_of_pairs))]
+
+        #Plotly builds its first figure much slower than the next ones
+        scatter_of_averages(facts, sample[0][0], sample[0][1], "Linear", "Linear", years, colors)
+
+        started = time.perf_counter()
+        for x, y in sample:
+            scatter_of_averages(facts, x, y, "Linear", "Linear", years, colors)
+        per_scatter = (time.perf_counter() - started) / len(sample)
+
+        print("{:>16}{:>8}{:>13}{:>13.3f}{:>15.1f}{:>21.0f}".format(name, len(labels), no_of_pairs, screening_seconds, per_scatter * 1000, per_scatter * no_of_pairs))
+
+    print("\nTop pairs among the labels reported by 3+ companies:")
+    print(pairs.head(5).to_string(index = False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+'''
+Right after a deploy: how long the first analyst waits, and how much memory each gunicorn worker takes.
+
+The watchlist companies are written to a local cache first (from the fake EDGAR, see app/warm_cache.py),
+then gunicorn (on benchmarks.fake_wsgi:server) is started three ways:
+    - cold: no preload, no warm cache - every worker imports the app itself and downloads what it is asked for
+    - preload: the app imported once in the master (gunicorn.conf.py), still no warm cache
+    - preload + warm: the same, with the watchlist loaded from the local cache at boot
+
+Each time, as soon as the server is started, Load Data is clicked for the watchlist companies, and measured are:
+    - the seconds from starting gunicorn to the first chart, and to all of the data
+    - the memory of a worker once booted, before serving anything (from /proc/<pid>/smaps_rollup, Linux):
+      PSS (shared pages split between the processes sharing them) and private (what no other process shares)
+    - the PSS of the master and all workers together, after the load
+      (progressive loading polls reach every worker, and each one missing the job runs it again)
+
+Memory is measured in a second boot, left alone until its workers are up.
+
+    python -m benchmarks.warm_boot_benchmark --companies 20 --workers 4 --latency 0.5
+'''
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.fake_edgar import companies_info
+from benchmarks.load_test import load_until_complete
+
+
+root_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def populate(directory, titles, labels_per_company):
+
+    '''Writes the local cache the way "python -m app.warm_cache" would, out of the fake EDGAR'''
+
+    from benchmarks.fake_edgar import install, FakeSecFactsDownloader
+    install()
+
+    from app.main import preprocess_df
+    from app.downloaders import companies_index
+    from app.warm_cache import refresh
+
+    downloader = FakeSecFactsDownloader("warm_boot_benchmark@example.com", latency = 0, labels_per_company = labels_per_company)
+
+    return refresh(downloader, companies_index().ciks_of(titles), preprocess_df, directory)
+
+
+def memory_mb(pid):
+    '''(PSS, private) MB of a process'''
+
+    fields = {}
+
+    with open("/proc/{}/smaps_rollup".format(pid)) as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0])
+
+    return fields["Pss"] / 1024, (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024
+
+
+def children_of(pid):
+
+    with open("/proc/{0}/task/{0}/children".format(pid)) as f:
+        return [int(child) for child in f.read().split()]
+
+
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def workers_memory(pid, workers):
+
+    '''(PSS, private) MB of each worker, once all of them are up and their memory has stopped growing'''
+
+    memory = None
+
+    for _ in range(600):
+
+        time.sleep(0.5)
+
+        children = children_of(pid)
+
+        if len(children) < workers:
+            continue
+
+        now = [memory_mb(child) for child in children]
+
+        if memory is not None and abs(sum(p for p, _ in now) - sum(p for p, _ in memory)) < 1:
+            return now
+
+        memory = now
+
+    return memory
+
+
+def boot(mode, titles, workers, latency, labels_per_company, cache, watchlist, load = True):
+
+    port = free_port()
+    url = "http://127.0.0.1:{}/_dash-update-component".format(port)
+
+    #No preload: any config file but the repo's
+    config = os.path.join(root_directory, "gunicorn.conf.py") if mode != "cold" else os.devnull
+
+    env = dict(os.environ,
+               FAKE_EDGAR_LATENCY = str(latency), FAKE_EDGAR_LABELS = str(labels_per_company),
+               SECOMPAIR_WARM_CACHE = cache,
+               SECOMPAIR_WATCHLIST = watchlist if mode == "preload + warm" else os.devnull)
+
+    started = time.perf_counter()
+
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "--config", config, "--workers", str(workers), "--threads", "4",
+                                "--timeout", "600", "--bind", "127.0.0.1:{}".format(port), "benchmarks.fake_wsgi:server"],
+                               cwd = root_directory, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+    try:
+
+        if not load:
+            return workers_memory(process.pid, workers)
+
+        for _ in range(1200):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout = 1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+        first_chart = []
+
+        def call(name, body):
+
+            request = urllib.request.Request(url, data = json.dumps(body).encode("utf-8"), headers = {"Content-Type": "application/json"})
+
+            with urllib.request.urlopen(request, timeout = 600) as response:
+                reply = json.loads(response.read())["response"] if response.status == 200 else None
+
+            if not first_chart:
+                first_chart.append(time.perf_counter() - started)
+
+            return reply
+
+        load_until_complete(call, titles, poll_interval = 0.2)
+
+        complete = time.perf_counter() - started
+
+        memory = [memory_mb(pid) for pid in children_of(process.pid)]
+
+        return {"first_chart_s": first_chart[0], "complete_s": complete,
+                "total_pss_mb": sum(pss for pss, _ in memory) + memory_mb(process.pid)[0]}
+
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "First-request latency and per-worker memory after a deploy, cold vs preloaded and warmed up")
+    parser.add_argument("--companies", type = int, default = 20, help = "Companies in the watchlist (and loaded)")
+    parser.add_argument("--labels", type = int, default = 300, help = "Labels per company")
+    parser.add_argument("--workers", type = int, default = 4)
+    parser.add_argument("--latency", type = float, default = 0.5, help = "Seconds each request to the (fake) SEC takes")
+    parser.add_argument("--populate", nargs = 2, metavar = ("DIRECTORY", "WATCHLIST"), help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    titles = companies_info().drop_duplicates("cik_str")["title"].drop_duplicates().tolist()[:args.companies]
+
+    if args.populate:
+        with open(args.populate[1], encoding = "utf-8") as f:
+            print(len(populate(args.populate[0], [line.strip() for line in f if line.strip()], args.labels)))
+        return
+
+    directory = tempfile.mkdtemp(prefix = "warm_boot_benchmark")
+
+    try:
+
+        cache = os.path.join(directory, "cache")
+        watchlist = os.path.join(directory, "watchlist.txt")
+
+        with open(watchlist, "w", encoding = "utf-8") as f:
+            f.write("\n".join(titles) + "\n")
+
+        #In its own process, so that this one never imports the app
+        subprocess.run([sys.executable, "-m", "benchmarks.warm_boot_benchmark", "--labels", str(args.labels), "--populate", cache, watchlist],
+                       check = True, capture_output = True, cwd = root_directory)
+
+        print("{:>16}{:>15}{:>12}{:>16}{:>19}{:>23}".format("mode", "first chart s", "complete s", "worker PSS MB", "worker private MB", "total PSS MB (load)"))
+
+        for mode in ("cold", "preload", "preload + warm"):
+
+            result = boot(mode, titles, args.workers, args.latency, args.labels, cache, watchlist)
+
+            memory = boot(mode, titles, args.workers, args.latency, args.labels, cache, watchlist, load = False)
+
+            result["pss_mb"] = sum(pss for pss, _ in memory) / len(memory)
+            result["private_mb"] = sum(private for _, private in memory) / len(memory)
+
+            print("{:>16}{first_chart_s:>15.2f}{complete_s:>12.2f}{pss_mb:>16.0f}{private_mb:>19.0f}{total_pss_mb:>23.0f}".format(mode, **result))
+
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+'''
+gunicorn settings - picked up by "gunicorn wsgi:server" (see Procfile) from the directory it is started in.
+
+The app is imported once, in the master, before the workers are forked (preload_app),
+so that whatever it sets up at import - the companies index, the watchlist companies of the warm cache (see app/warm_cache.py) -
+is built once and shared by every worker, copy-on-write, instead of being built (or downloaded) again by each of them.
+
+Each worker answers requests in threads (SECOMPAIR_THREADS of them, 4 by default): a sync worker answers one at a time,
+so a session's burst of hovers would queue up behind each other instead of the newest overtaking the rest (see app/coalescing.py).
+
+The number of workers comes from WEB_CONCURRENCY and the port from PORT, as gunicorn reads them by itself.
+'''
+
+import gc
+import os
+
+
+preload_app = True
+
+worker_class = "gthread"
+threads = int(os.environ.get("SECOMPAIR_THREADS", 4))
+
+
+def when_ready(server):
+
+    #Everything the master has built so far is left out of garbage collection for good -
+    #otherwise the first collection in each worker writes to (and so copies) every page holding one of those objects
+    gc.freeze()
+
+    server.log.info("App preloaded - %d objects frozen before forking the workers", gc.get_freeze_count())